@@ -0,0 +1,109 @@
+import argparse
+import random
+import statistics
+import time
+
+import psycopg2
+
+# Бенчмарк поиска ближайшего дома: старый запрос (ORDER BY ST_Distance по
+# geom::geography) против KNN (<-> по GiST-индексу на geog + точная
+# пересортировка кандидатов) на синтетической таблице размером с город.
+
+# Границы Москвы (примерно)
+LAT_MIN, LAT_MAX = 55.55, 55.92
+LON_MIN, LON_MAX = 37.35, 37.85
+
+OLD_QUERY = """
+SELECT b.building_id,
+       ST_Distance(b.geom::geography, ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography) AS dist
+FROM bench_building b
+ORDER BY ST_Distance(b.geom::geography, ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography)
+LIMIT 1;
+"""
+
+KNN_QUERY = """
+WITH pt AS (
+    SELECT ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography AS geog
+),
+candidates AS (
+    SELECT b.building_id, b.geog
+    FROM bench_building b, pt
+    ORDER BY b.geog <-> pt.geog
+    LIMIT %s
+)
+SELECT c.building_id, ST_Distance(c.geog, pt.geog) AS dist
+FROM candidates c, pt
+ORDER BY dist
+LIMIT 1;
+"""
+
+
+def create_fixture(cur, n):
+    cur.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+    cur.execute("DROP TABLE IF EXISTS bench_building;")
+    cur.execute("""
+        CREATE TABLE bench_building AS
+        SELECT g AS building_id,
+               ST_SetSRID(ST_MakePoint(
+                   %s + random() * %s,
+                   %s + random() * %s), 4326) AS geom
+        FROM generate_series(1, %s) g;
+    """, (LON_MIN, LON_MAX - LON_MIN, LAT_MIN, LAT_MAX - LAT_MIN, n))
+    cur.execute("ALTER TABLE bench_building ADD COLUMN geog geography(Point, 4326);")
+    cur.execute("UPDATE bench_building SET geog = geom::geography;")
+    cur.execute("CREATE INDEX ON bench_building USING GIST (geog);")
+    cur.execute("ANALYZE bench_building;")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def run(cur, query, params_fn, points):
+    timings = []
+    results = []
+    for lat, lon in points:
+        started = time.perf_counter()
+        cur.execute(query, params_fn(lat, lon))
+        results.append(cur.fetchone()[0])
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default="dbname=postgres")
+    parser.add_argument("--buildings", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=16)
+    parser.add_argument("--keep", action="store_true", help="не удалять bench_building")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    create_fixture(cur, args.buildings)
+
+    rnd = random.Random(42)
+    points = [(rnd.uniform(LAT_MIN, LAT_MAX), rnd.uniform(LON_MIN, LON_MAX))
+              for _ in range(args.queries)]
+
+    old_t, old_r = run(cur, OLD_QUERY, lambda lat, lon: (lon, lat, lon, lat), points)
+    knn_t, knn_r = run(cur, KNN_QUERY, lambda lat, lon: (lon, lat, args.candidates), points)
+
+    mismatches = sum(1 for a, b in zip(old_r, knn_r) if a != b)
+    print(f"buildings={args.buildings} queries={args.queries} candidates={args.candidates}")
+    for name, t in (("st_distance", old_t), ("knn", knn_t)):
+        print(f"{name:12s} p50={statistics.median(t):8.2f} ms  p99={percentile(t, 99):8.2f} ms")
+    print(f"mismatches={mismatches}")
+
+    if not args.keep:
+        cur.execute("DROP TABLE bench_building;")
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
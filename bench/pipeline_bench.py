@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import Response
+
+os.environ.setdefault("API_TOKEN", "123456:bench-token")   # запросы к Telegram не уходят
+import main
+import metrics
+import search
+from bench.webhook_bench import fake_message_update
+from cards import card_head, card_objects
+from geocoder import LocalGeocoder
+from spatial_index import BuildingIndex
+from state import MemoryStateStore
+from webhook import update_user_id
+
+# Нагрузочный бенчмарк конвейера бота без сети: обновления проходят через
+# настоящий диспетчер и хендлеры main.py, Bot API подменён заглушкой
+# (StubSession), вместо PostgreSQL — синтетический город в памяти
+# (InMemoryDB) или настоящая база (--dbname). Замеряются пропускная способность
+# и перцентили задержки по сценариям: координаты, адрес, Топ-10, распределение,
+# сравнение домов. Отчёт сохраняется в JSON (--out) и сравнивается с прошлым
+# прогоном (--baseline). С --abusers добавляются пользователи, которые без пауз
+# шлют тяжёлые запросы (сценарий abuse): видно, сколько их отсёк throttle.py и
+# как это сказалось на задержке остальных.
+#
+#   python -m bench.pipeline_bench --users 200 --rounds 5 --out run.json
+#   python -m bench.pipeline_bench --users 200 --rounds 5 --baseline run.json
+#   python -m bench.pipeline_bench --replay updates.jsonl      # записанные обновления
+#   python -m bench.pipeline_bench --users 200 --abusers 5
+
+LAT_MIN, LAT_MAX = 55.55, 55.92
+LON_MIN, LON_MAX = 37.35, 37.85
+
+STREETS = [
+    "Тверская", "Арбат", "Садовая", "Мясницкая", "Покровка", "Остоженка", "Пречистенка",
+    "Маросейка", "Большая Ордынка", "Пятницкая", "Профсоюзная", "Ленинский проспект",
+    "Вернадского проспект", "Мира проспект", "Новослободская", "Бауманская",
+]
+
+AMENITY_TYPES = ["Школа", "Детский сад", "Больница", "Парк", "Метро", "Остановка", "Парковка"]
+
+FLOWS = ["coords", "address", "top10", "distribution", "compare", "search"]
+
+
+class StubSession(BaseSession):
+    # Bot API без сети: отвечает правдоподобным результатом нужного типа
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+
+    def _message(self, chat_id, **extra):
+        self._message_id += 1
+        return {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, **extra,
+        }
+
+    def _photo(self):
+        file_id = f"photo{self._message_id}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 600, "height": 400}]
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = getattr(method, "chat_id", 0)
+        if name == "SendMediaGroup":
+            result = [self._message(chat_id, photo=self._photo()) for _ in method.media]
+        elif name == "SendPhoto":
+            result = self._message(chat_id, photo=self._photo())
+        elif name == "SendDocument":
+            result = self._message(chat_id, document={"file_id": "doc", "file_unique_id": "doc"})
+        elif name.startswith("Send"):
+            result = self._message(chat_id, text=getattr(method, "text", ""))
+        else:
+            result = True
+        return Response[method.__returning__].model_validate(
+            {"ok": True, "result": result}, context={"bot": bot}
+        ).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class InMemoryDB:
+    # Синтетический город: дома с оценками, объекты рядом, агрегаты рейтинга.
+    # Подменяет main.db_call и search.db_call: запросы выполняются по имени функции.
+    def __init__(self, buildings: int, latency: float = 0.0, seed: int = 0):
+        rnd = random.Random(seed)
+        self.latency = latency
+        self.rows = []
+        for i in range(1, buildings + 1):
+            lat = rnd.uniform(LAT_MIN, LAT_MAX)
+            lon = rnd.uniform(LON_MIN, LON_MAX)
+            social, quality, transport = rnd.uniform(0, 35), rnd.uniform(0, 30), rnd.uniform(0, 35)
+            self.rows.append({
+                "building_id": i,
+                "name": f"Москва, ул. {STREETS[i % len(STREETS)]}, д. {i // len(STREETS) + 1}",
+                "total_score": Decimal(f"{social + quality + transport:.2f}"),
+                "social_score": Decimal(f"{social:.2f}"),
+                "quality_score": Decimal(f"{quality:.2f}"),
+                "transport_score": Decimal(f"{transport:.2f}"),
+                "build_year": rnd.randint(1900, 2023),
+                "floors_number": rnd.randint(2, 30),
+                "is_emergency": rnd.random() < 0.01,
+                "square": Decimal(f"{rnd.uniform(500, 30000):.1f}"),
+                "apartments_number": rnd.randint(8, 600),
+                "building_type_id": rnd.randint(1, 6),
+                "living_area": Decimal(f"{rnd.uniform(300, 20000):.1f}"),
+                "not_living_area": Decimal(f"{rnd.uniform(0, 3000):.1f}"),
+                "is_cultural_heritage": rnd.random() < 0.02,
+                "latitude": lat, "longitude": lon, "geom_lat": lat, "geom_lon": lon,
+            })
+        self.by_id = {row["building_id"]: row for row in self.rows}
+        self.index = BuildingIndex(self.rows)
+
+    def objects(self, building_id: int, radius: float):
+        rnd = random.Random(building_id)
+        count = min(40, int(rnd.randint(2, 12) * max(radius, 100) / 1000))
+        return sorted(
+            ({"type": rnd.choice(AMENITY_TYPES), "name": f"Объект {rnd.randint(1, 9999)}"} for _ in range(count)),
+            key=lambda o: (o["type"], o["name"]),
+        )
+
+    def _query_objects(self, building_id, radius):
+        return self.objects(building_id, radius)
+
+    def _query_building_info(self, lat, lon, radius):
+        row = self.index.nearest_record(lat, lon)
+        if row is not None:
+            row["objects"] = self.objects(row["building_id"], radius)
+        return row
+
+    def _query_buildings(self, building_ids, radii):
+        return {
+            (b, r): dict(self.by_id[b], objects=self.objects(b, r))
+            for b, r in zip(building_ids, radii) if b in self.by_id
+        }
+
+    def _query_card(self, building_id, radius):
+        row = self.by_id.get(building_id)
+        if row is None:
+            return None
+        return card_head(row), card_objects(self.objects(building_id, radius), radius)
+
+    def _query_top10(self):
+        top = sorted(self.rows, key=lambda r: r["total_score"], reverse=True)[:10]
+        return [{"building_id": r["building_id"], "address": r["name"], "total_score": r["total_score"]} for r in top]
+
+    def _query_total_histogram(self):
+        bins = {}
+        for r in self.rows:
+            start = min(int(r["total_score"]) // main.DISTRIBUTION_BIN, 100 // main.DISTRIBUTION_BIN - 1)
+            bins[start * main.DISTRIBUTION_BIN] = bins.get(start * main.DISTRIBUTION_BIN, 0) + 1
+        return sorted(bins.items())
+
+    def _query_ratings_version(self):
+        return 1
+
+    def _query_all_buildings(self):
+        return self.rows
+
+    # Ячейки тепловой карты по домам в квадрате вокруг точки (проекция индекса)
+    def _query_cells(self, lat, lon, radius, score):
+        size = search.cell_size_for(radius)
+        qx, qy = self.index.project(lat, lon)
+        idx, _ = self.index.within(lat, lon, radius * 1.5)
+        values = {}
+        for i in idx:
+            key = (int((self.index.x[i] - qx + radius) // size), int((self.index.y[i] - qy + radius) // size))
+            values.setdefault(key, []).append(float(self.rows[i][score]))
+        cells = [(cx, cy, statistics.median(v)) for (cx, cy), v in values.items()]
+        return (radius, radius), size, cells
+
+    async def call(self, func, *args, retry: bool = False):
+        name = func.__name__
+        with metrics.span(f"db.{name.lstrip('_')}"):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return getattr(self, name)(*args)
+
+
+# Сценарий пользователя: список (сценарий, текст). У сравнения подготовительные
+# шаги (два запроса и «Сравнить дома») попадают в отчёт как setup
+def user_script(rnd: random.Random, db_rows):
+    flow = rnd.choice(FLOWS)
+    if flow == "coords":
+        row = rnd.choice(db_rows)
+        return [("coords", f"{row['geom_lat'] + rnd.uniform(-5e-4, 5e-4):.6f}, "
+                           f"{row['geom_lon'] + rnd.uniform(-5e-4, 5e-4):.6f}")]
+    if flow == "address":
+        return [("address", f"адрес: {rnd.choice(db_rows)['name']}")]
+    if flow == "top10":
+        return [("top10", "Топ-10")]
+    if flow == "distribution":
+        return [("distribution", "Распределение")]
+    if flow == "search":
+        row = rnd.choice(db_rows)
+        return [("search", f"лучшие: {row['geom_lat']:.6f}, {row['geom_lon']:.6f}, 2000 год>=1960")]
+    a, b = rnd.sample(db_rows, 2)
+    return [
+        ("setup", f"{a['geom_lat']:.6f}, {a['geom_lon']:.6f}"),
+        ("setup", f"{b['geom_lat']:.6f}, {b['geom_lon']:.6f}"),
+        ("setup", "Сравнить дома"),
+        ("compare", "1 2"),
+    ]
+
+
+# Пользователь, который без пауз шлёт тяжёлые запросы
+def abuser_script(rnd: random.Random, db_rows, count: int):
+    row = rnd.choice(db_rows)
+    texts = ["Распределение", "Сравнить дома", "1 2", f"карта: {row['geom_lat']:.6f}, {row['geom_lon']:.6f}"]
+    return [("abuse", rnd.choice(texts)) for _ in range(count)]
+
+
+# Сценарий записанного обновления — по тексту сообщения
+def classify(update: dict) -> str:
+    text = ((update.get("message") or {}).get("text") or "").strip()
+    if text == "Топ-10":
+        return "top10"
+    if text == "Распределение":
+        return "distribution"
+    if text.lower().startswith("адрес:"):
+        return "address"
+    if text.lower().startswith("лучшие:"):
+        return "search"
+    if text == "Сравнить дома" or text.replace(" ", "").replace(",", "").isdigit():
+        return "compare"
+    if text[:1].isdigit():
+        return "coords"
+    return "other"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(samples, errors, elapsed):
+    flows = {}
+    for flow, times in sorted(samples.items()):
+        ms = [t * 1000 for t in times]
+        flows[flow] = {
+            "count": len(ms),
+            "errors": errors.get(flow, 0),
+            "rps": round(len(ms) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(ms), 2),
+            "p50_ms": round(percentile(ms, 50), 2),
+            "p90_ms": round(percentile(ms, 90), 2),
+            "p99_ms": round(percentile(ms, 99), 2),
+            "max_ms": round(max(ms), 2),
+        }
+    stages = {
+        name: {"count": h.count, "mean_ms": round(h.sum / h.count * 1000, 3)}
+        for name, h in sorted(metrics.histograms["stage"].items()) if h.count
+    }
+    return flows, stages
+
+
+async def run(args):
+    session = StubSession(latency=args.api_latency / 1000)
+    session.middleware(metrics.TelegramMetricsMiddleware())
+    main.bot.session = session
+    main.user_state = MemoryStateStore()
+
+    if args.dbname:
+        main.configure_db(host=args.host, dbname=args.dbname, user=args.user, password=args.password)
+        await main.reload_building_index()
+        db_rows = main.building_index.records
+    else:
+        db = InMemoryDB(args.buildings, latency=args.db_latency / 1000, seed=args.seed)
+        main.db_call = db.call
+        search.db_call = db.call
+        main.building_index = db.index
+        main.set_ratings_version(1)
+        main.geocoder.local = LocalGeocoder(db.rows)
+        db_rows = db.rows
+    main.chart_renderer.start()
+
+    rnd = random.Random(args.seed)
+    scripts = {}
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    update = json.loads(line)
+                    user_id = update_user_id(update)
+                    scripts.setdefault(user_id, []).append((classify(update), update))
+    else:
+        for u in range(args.users):
+            user_id = 200000 + u
+            steps = []
+            for _ in range(args.rounds):
+                steps += user_script(rnd, db_rows)
+            scripts[user_id] = [(flow, fake_message_update(user_id, text)) for flow, text in steps]
+        for u in range(args.abusers):
+            user_id = 300000 + u
+            steps = abuser_script(rnd, db_rows, args.abuse_count)
+            scripts[user_id] = [(flow, fake_message_update(user_id, text)) for flow, text in steps]
+
+    samples, errors = {}, {}
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def user_chain(steps):
+        for flow, update in steps:
+            async with sem:
+                started = time.perf_counter()
+                try:
+                    await main.handle_update(update)
+                except Exception:
+                    errors[flow] = errors.get(flow, 0) + 1
+                samples.setdefault(flow, []).append(time.perf_counter() - started)
+
+    # Прогрев: пул графиков, кэши Топ-10/распределения
+    await user_chain([("warmup", fake_message_update(1, "Распределение")),
+                      ("warmup", fake_message_update(1, "Топ-10"))])
+    samples.clear()
+    metrics.histograms["stage"].clear()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user_chain(steps) for steps in scripts.values()))
+    elapsed = time.perf_counter() - t0
+    main.chart_renderer.close()
+
+    total = sum(len(v) for v in samples.values())
+    flows, stages = summarize(samples, errors, elapsed)
+    return {
+        "meta": {
+            "source": args.replay or "synthetic", "db": "postgres" if args.dbname else "memory",
+            "users": len(scripts), "updates": total, "concurrency": args.concurrency,
+            "api_latency_ms": args.api_latency, "db_latency_ms": args.db_latency,
+            "buildings": len(db_rows), "elapsed_s": round(elapsed, 3),
+            "updates_per_s": round(total / elapsed, 1),
+        },
+        "flows": flows,
+        "stages": stages,
+        "telegram_calls": session.calls,
+        "throttle": dict(main.throttle.stats),
+        "single_flight": dict(main.shared.stats),
+    }
+
+
+def print_report(report, baseline=None):
+    meta = report["meta"]
+    print(f"updates={meta['updates']} users={meta['users']} db={meta['db']} "
+          f"elapsed={meta['elapsed_s']} s -> {meta['updates_per_s']} updates/s")
+    print(f"{'flow':14s} {'count':>6s} {'err':>4s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'max':>9s}")
+    for flow, s in report["flows"].items():
+        line = (f"{flow:14s} {s['count']:6d} {s['errors']:4d} {s['p50_ms']:9.2f} "
+                f"{s['p90_ms']:9.2f} {s['p99_ms']:9.2f} {s['max_ms']:9.2f}")
+        base = (baseline or {}).get("flows", {}).get(flow)
+        if base:
+            line += f"   p50 {_delta(s['p50_ms'], base['p50_ms'])}  p99 {_delta(s['p99_ms'], base['p99_ms'])}"
+        print(line)
+    print("stages (mean ms): " + ", ".join(f"{k}={v['mean_ms']}" for k, v in report["stages"].items()))
+    if "throttle" in report:
+        print("throttle: " + ", ".join(f"{k}={v}" for k, v in report["throttle"].items()) +
+              "; single_flight: " + ", ".join(f"{k}={v}" for k, v in report["single_flight"].items()))
+
+
+def _delta(new, old):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=5, help="сценариев на пользователя")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--buildings", type=int, default=50000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="задержка in-memory БД, мс")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--abusers", type=int, default=0, help="пользователей, шлющих тяжёлые запросы без пауз")
+    parser.add_argument("--abuse-count", type=int, default=30, help="запросов от каждого из них")
+    parser.add_argument("--replay", help="файл с обновлениями Bot API, по одному JSON в строке")
+    parser.add_argument("--out", help="сохранить отчёт в JSON")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--dbname", default="", help="настоящая база вместо синтетической")
+    parser.add_argument("--user", default="")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
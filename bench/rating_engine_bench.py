@@ -0,0 +1,114 @@
+import argparse
+import time
+
+import numpy as np
+import psycopg2
+
+from rating_engine import AMENITY_KINDS, RatingEngine, load_from_db, load_from_snapshot
+
+# Сверка rating_engine.py с building_ratings в БД и замер скорости.
+#
+#   python -m bench.rating_engine_bench --dsn "dbname=estate"   # сверка с SQL
+#   python -m bench.rating_engine_bench --snapshot snapshot     # сверка с оценками снимка, без БД
+#   python -m bench.rating_engine_bench --synthetic 200000      # только скорость
+
+COLUMNS = ['social_score', 'quality_score', 'transport_score', 'total_score']
+
+# Сколько объектов каждого типа на синтетический город
+SYNTHETIC_AMENITIES = {
+    'school': 900, 'kindergarten': 1500, 'hospital': 600, 'park': 400,
+    'metro': 250, 'public_transport_stop': 11000, 'parking': 5000,
+}
+
+
+def parity(dsn: str, tolerance: float):
+    conn = psycopg2.connect(dsn)
+    engine = load_from_db(conn)
+    cur = conn.cursor()
+    cur.execute(f"SELECT building_id, {', '.join(COLUMNS)} FROM building_ratings;")
+    expected = {row[0]: row[1:] for row in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return compare(engine, expected, tolerance)
+
+
+# Оценки снимка — это building_ratings на момент выгрузки (округлённые до сотых)
+def snapshot_parity(path: str, tolerance: float):
+    from snapshot import Snapshot
+
+    snap = Snapshot(path)
+    engine = load_from_snapshot(snap)
+    b = snap.buildings
+    expected = {
+        int(building_id): tuple(None if np.isnan(b[c][i]) else float(b[c][i]) for c in COLUMNS)
+        for i, building_id in enumerate(b['building_id'])
+    }
+    return compare(engine, expected, tolerance)
+
+
+def compare(engine: RatingEngine, expected: dict, tolerance: float):
+    started = time.perf_counter()
+    out = engine.score()
+    elapsed = time.perf_counter() - started
+
+    worst = {c: 0.0 for c in COLUMNS}
+    mismatched = 0
+    for i, building_id in enumerate(out['building_id']):
+        row = expected.get(int(building_id))
+        if row is None:
+            continue
+        bad = False
+        for c, v in zip(COLUMNS, row):
+            diff = abs(float(v) - out[c][i]) if v is not None else 0.0
+            worst[c] = max(worst[c], diff)
+            bad = bad or diff > tolerance
+        mismatched += bad
+
+    n = len(out['building_id'])
+    print(f"buildings={n} time={elapsed:.2f} s throughput={n / elapsed:,.0f} buildings/s")
+    for c in COLUMNS:
+        print(f"  max |diff| {c:16s} {worst[c]:.4f}")
+    print(f"mismatched (> {tolerance}): {mismatched}")
+    return mismatched == 0
+
+
+def synthetic(n: int, batch_size: int, seed: int = 42):
+    rnd = np.random.default_rng(seed)
+
+    def points(count):
+        return {'latitude': rnd.uniform(55.55, 55.92, count), 'longitude': rnd.uniform(37.35, 37.85, count)}
+
+    buildings = points(n)
+    buildings['building_id'] = np.arange(n)
+    buildings['is_emergency'] = np.array(rnd.random(n) < 0.01, dtype=object)
+    buildings['floors_number'] = rnd.integers(1, 30, n).astype(np.float64)
+    buildings['build_year'] = rnd.integers(1900, 2025, n).astype(np.float64)
+    amenities = {kind: points(SYNTHETIC_AMENITIES[kind]) for kind in AMENITY_KINDS}
+    amenities['parking']['car_capacity'] = rnd.integers(5, 300, SYNTHETIC_AMENITIES['parking']).astype(np.float64)
+
+    engine = RatingEngine(buildings, amenities)
+    started = time.perf_counter()
+    engine.score(batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"buildings={n} batch={batch_size} time={elapsed:.2f} s throughput={n / elapsed:,.0f} buildings/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn")
+    parser.add_argument("--snapshot", help="каталог снимка (snapshot.py)")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--synthetic", type=int, default=0, help="число синтетических домов")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        synthetic(args.synthetic, args.batch_size)
+    if args.snapshot:
+        raise SystemExit(0 if snapshot_parity(args.snapshot, args.tolerance) else 1)
+    if args.dsn:
+        raise SystemExit(0 if parity(args.dsn, args.tolerance) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Бюджет холодного старта бота: время импорта main.py и пиковый RSS процесса
+# после импорта — в чистом интерпретаторе, как при запуске новой реплики или
+# рабочего процесса webhook. Проверяется также, что при импорте не загружаются
+# модули, которые должны подгружаться лениво (LAZY_MODULES: графики — только в
+# процессах пула charts.py, numpy — вместе с индексом домов). С --charts
+# дополнительно замеряется первый график (запуск пула и импорт matplotlib в нём).
+# Код выхода 1 — бюджет превышен.
+#
+#   python -m bench.startup_bench --runs 5
+#   python -m bench.startup_bench --max-import-ms 2500 --max-rss-mb 140 --out startup.json
+
+# Бюджеты — чуть выше замеров на эталонной машине с ленивой загрузкой (импорт
+# ~150 мс, RSS ~100 МБ); с графиками и numpy при импорте (~560 мс, ~140 МБ)
+# бенчмарк должен падать. Время импорта почти целиком зависит от окружения:
+# в медленной песочнице один aiogram импортируется ~2,3 с, а main.py целиком
+# ~3,4 с — там бюджет задаётся флагами (--max-import-ms).
+IMPORT_BUDGET_MS = 400
+RSS_BUDGET_MB = 120
+# psycopg2 сюда не входит намеренно: db.py и main.py (psycopg2.errors)
+# импортируют его при старте, он нужен пулу соединений до первого запроса
+# и весит несколько мегабайт — ленивая загрузка не окупается.
+LAZY_MODULES = ("matplotlib", "numpy", "pandas")
+
+# Выполняется в дочернем интерпретаторе; печатает одну JSON-строку
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - started) * 1000
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+result = {
+    "import_ms": import_ms,
+    "rss_mb": rss_mb,
+    "loaded": [m for m in LAZY if m in sys.modules],
+}
+if CHARTS:
+    import asyncio
+    from charts import render_distribution
+    async def first_chart():
+        started = time.perf_counter()
+        main.chart_renderer.start()
+        await main.chart_renderer.render(render_distribution, [(0, 1), (10, 2)], 10)
+        return (time.perf_counter() - started) * 1000
+    result["first_chart_ms"] = asyncio.run(first_chart())
+    main.chart_renderer.close()
+print(json.dumps(result))
+"""
+
+
+def measure(charts: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("API_TOKEN", "123456:bench-token")
+    code = f"LAZY = {LAZY_MODULES!r}\nCHARTS = {charts!r}\n" + CHILD
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(runs) -> dict:
+    report = {
+        "runs": len(runs),
+        "import_ms_median": statistics.median(r["import_ms"] for r in runs),
+        "import_ms_max": max(r["import_ms"] for r in runs),
+        "rss_mb_max": max(r["rss_mb"] for r in runs),
+        "loaded": sorted({m for r in runs for m in r["loaded"]}),
+    }
+    if "first_chart_ms" in runs[0]:
+        report["first_chart_ms_median"] = statistics.median(r["first_chart_ms"] for r in runs)
+    return report
+
+
+def check(report: dict, max_import_ms: float, max_rss_mb: float):
+    problems = []
+    if report["import_ms_median"] > max_import_ms:
+        problems.append(f"импорт {report['import_ms_median']:.0f} мс > {max_import_ms:.0f} мс")
+    if report["rss_mb_max"] > max_rss_mb:
+        problems.append(f"RSS {report['rss_mb_max']:.1f} МБ > {max_rss_mb:.0f} МБ")
+    if report["loaded"]:
+        problems.append("загружены при импорте: " + ", ".join(report["loaded"]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--max-rss-mb", type=float, default=RSS_BUDGET_MB)
+    parser.add_argument("--charts", action="store_true", help="замерить первый график")
+    parser.add_argument("--out", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    # Первый запуск прогревает __pycache__ и в замер не входит
+    measure(False)
+    report = summarize([measure(args.charts) for _ in range(args.runs)])
+    print(f"import main: median {report['import_ms_median']:.0f} ms, max {report['import_ms_max']:.0f} ms "
+          f"(budget {args.max_import_ms:.0f} ms)")
+    print(f"peak RSS: {report['rss_mb_max']:.1f} MB (budget {args.max_rss_mb:.0f} MB)")
+    if "first_chart_ms_median" in report:
+        print(f"first chart: median {report['first_chart_ms_median']:.0f} ms")
+
+    problems = check(report, args.max_import_ms, args.max_rss_mb)
+    report["ok"] = not problems
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if problems:
+        print("FAIL: " + "; ".join(problems))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import random
+import time
+
+import aiohttp
+
+from webhook import consume, run_webhook
+
+# Бенчмарк webhook-режима без Telegram: генератор поддельных обновлений шлёт их
+# POST-запросами на локальный webhook, рабочие процессы вместо бота выполняют
+# заглушку с заданной задержкой. Проверяется пропускная способность
+# (обновлений/сек) и то, что обновления одного пользователя обработаны по порядку.
+# С --url обновления отправляются на уже запущенный бот (python main.py с
+# WEBHOOK_URL) — тогда бот будет отвечать в Telegram настоящими запросами.
+#
+#   python -m bench.webhook_bench --updates 20000 --users 500 --workers 4
+
+TEXTS = ["О рейтинге", "О нас", "Мои запросы", "Топ-10", "55.75, 37.62", "адрес: Тверская 1"]
+
+_update_ids = itertools.count(1)
+
+
+# Обновление в формате Bot API: текстовое сообщение пользователя в личном чате
+def fake_message_update(user_id: int, text: str, update_id: int = None) -> dict:
+    update_id = next(_update_ids) if update_id is None else update_id
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+# Обновления по пользователям: {user_id: [update, ...]} с возрастающими update_id
+def fake_updates(n: int, users: int, texts=TEXTS, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    by_user = {}
+    for _ in range(n):
+        user_id = 100000 + rnd.randrange(users)
+        by_user.setdefault(user_id, []).append(fake_message_update(user_id, rnd.choice(texts)))
+    return by_user
+
+
+async def _bench_worker(updates, delay, results):
+    last = {}
+    violations = 0
+
+    async def handle(update):
+        nonlocal violations
+        user_id = update["message"]["from"]["id"]
+        if update["update_id"] <= last.get(user_id, 0):
+            violations += 1
+        last[user_id] = update["update_id"]
+        await asyncio.sleep(delay)
+
+    stats = await consume(updates, handle)
+    results.put({**stats, "violations": violations, "done_at": time.time()})
+
+
+async def _send(url, by_user, concurrency):
+    # Обновления одного пользователя отправляются последовательно (как их шлёт
+    # Telegram), разных пользователей — параллельно, но не больше concurrency
+    sem = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async with aiohttp.ClientSession() as session:
+        async def user_chain(updates):
+            nonlocal rejected
+            for update in updates:
+                async with sem:
+                    while True:
+                        async with session.post(url, json=update) as resp:
+                            if resp.status != 503:
+                                resp.raise_for_status()
+                                break
+                        rejected += 1
+                        await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(user_chain(u) for u in by_user.values()))
+    return rejected
+
+
+async def run(args):
+    by_user = fake_updates(args.updates, args.users, seed=args.seed)
+    total = sum(len(u) for u in by_user.values())
+
+    if args.url:
+        t0 = time.perf_counter()
+        rejected = await _send(args.url, by_user, args.concurrency)
+        elapsed = time.perf_counter() - t0
+        print(f"updates={total} sent in {elapsed:.2f} s -> {total / elapsed:.0f} updates/s  503={rejected}")
+        return
+
+    results = multiprocessing.get_context('spawn').Queue()
+    stop = asyncio.Event()
+    server = asyncio.create_task(run_webhook(
+        _bench_worker, '/webhook', '127.0.0.1', args.port, workers=args.workers,
+        worker_args=(args.delay, results), stop=stop,
+    ))
+    url = f"http://127.0.0.1:{args.port}/webhook"
+    # Ждём, пока сервер начнёт принимать соединения
+    for _ in range(100):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:   # 405, но сервер уже слушает
+                    await resp.read()
+            break
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.1)
+
+    t0 = time.time()
+    rejected = await _send(url, by_user, args.concurrency)
+    sent = time.time() - t0
+    stop.set()
+    await server
+
+    stats = [results.get() for _ in range(args.workers)]
+    processed = sum(s["processed"] for s in stats)
+    elapsed = max(s["done_at"] for s in stats) - t0
+    print(f"workers={args.workers} users={len(by_user)} delay={args.delay * 1000:.0f} ms "
+          f"concurrency={args.concurrency}")
+    print(f"updates={total} sent in {sent:.2f} s, processed={processed} in {elapsed:.2f} s "
+          f"-> {processed / elapsed:.0f} updates/s")
+    print(f"503={rejected} dropped={sum(s['dropped'] for s in stats)} "
+          f"errors={sum(s['errors'] for s in stats)} order_violations={sum(s['violations'] for s in stats)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--delay', type=float, default=0.005, help="время обработки обновления, сек")
+    parser.add_argument('--concurrency', type=int, default=64, help="одновременных POST-запросов")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="webhook уже запущенного бота")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
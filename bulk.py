@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import re
+import sys
+import time
+from decimal import Decimal
+
+from psycopg2.extras import RealDictCursor
+
+from db import configure_db, db_call, close_db_pool
+from geocoder import Geocoder, GeocodeCache, UpstreamBudget
+
+# Пакетная оценка списка координат или адресов.
+# Вход — строки «lat, lon» (радиус после них допускается и не учитывается)
+# или адреса (можно с префиксом «адрес:»), пустые строки и строки с #
+# пропускаются. Строки читаются и обрабатываются
+# пачками по BULK_BATCH: адреса пачки геокодируются параллельно (в Nominatim —
+# через общий RateLimiter геокодера и не больше BULK_MAX_UPSTREAM запросов на
+# файл, остальные адреса — только по локальному индексу и кэшу), ближайшие дома
+# для всей пачки ищутся одним запросом (KNN по building.geog для каждой точки)
+# или по in-memory индексу, результат сразу пишется в CSV/JSON — весь файл
+# в памяти не держится.
+#
+#   python bulk.py points.txt -o result.csv --host localhost --dbname estate --user bot
+#   python bulk.py addresses.txt --format json > result.json
+#   python bulk.py points.txt --snapshot snapshot -o result.csv   # дома из снимка (snapshot.py)
+
+BULK_BATCH = 500
+BULK_GEOCODE_CONCURRENCY = 4
+BULK_MAX_UPSTREAM = 100           # запросов к Nominatim на один файл
+NEAREST_CANDIDATES = 16           # как в main.py
+
+FIELDS = [
+    'line', 'query', 'lat', 'lon', 'building_id', 'address', 'dist',
+    'total_score', 'social_score', 'quality_score', 'transport_score', 'status',
+]
+
+NEAREST_MANY_QUERY = f"""
+SELECT p.ord,
+       n.building_id, n.address, n.dist,
+       n.total_score, n.social_score, n.quality_score, n.transport_score
+FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(lon, lat, ord)
+CROSS JOIN LATERAL (
+    SELECT b.building_id,
+           b.address,
+           ST_Distance(b.geog, ST_SetSRID(ST_MakePoint(p.lon, p.lat),4326)::geography) AS dist,
+           ROUND(br.total_score::numeric,2) AS total_score,
+           ROUND(br.social_score::numeric,2) AS social_score,
+           ROUND(br.quality_score::numeric,2) AS quality_score,
+           ROUND(br.transport_score::numeric,2) AS transport_score
+    FROM (
+        SELECT b.building_id
+        FROM building b
+        ORDER BY b.geog <-> ST_SetSRID(ST_MakePoint(p.lon, p.lat),4326)::geography
+        LIMIT {NEAREST_CANDIDATES}
+    ) c
+    JOIN building b ON b.building_id = c.building_id
+    JOIN building_ratings br ON br.building_id = b.building_id
+    ORDER BY dist
+    LIMIT 1
+) n;
+"""
+
+_COORDS_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[,;\s]\s*(-?\d+(?:\.\d+)?)(?:\s*[,;\s]\s*(\d+(?:\.\d+)?))?\s*$')
+
+
+class BulkStats:
+    def __init__(self):
+        self.rows = 0
+        self.found = 0
+        self.not_found = 0
+        self.not_geocoded = 0
+        self.over_budget = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        text = (f"Строк: {self.rows}, найдено домов: {self.found}, не найдено: {self.not_found}, "
+                f"не геокодировано: {self.not_geocoded}; {self.elapsed:.1f} с ({self.rate:.0f} строк/с)")
+        if self.over_budget:
+            text += f". Исчерпан лимит запросов к геокодеру, адресов без координат: {self.over_budget}"
+        return text
+
+
+# Строка входа -> запрос: {'line', 'query', 'lat', 'lon'} или {'line', 'query', 'query_address'}
+def parse_line(number: int, line: str):
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    m = _COORDS_RE.match(line)
+    if m:
+        return {'line': number, 'query': line, 'lat': float(m.group(1)), 'lon': float(m.group(2))}
+    address = line[6:].strip() if line.lower().startswith('адрес:') else line
+    return {'line': number, 'query': line, 'query_address': address}
+
+
+def _query_nearest_many(conn, lons, lats):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(NEAREST_MANY_QUERY, (list(lons), list(lats)))
+    found = {row.pop('ord'): row for row in cur.fetchall()}
+    cur.close()
+    return [found.get(i + 1) for i in range(len(lons))]
+
+
+def _from_index(index, lat: float, lon: float):
+    rec = index.nearest_record(lat, lon)
+    if rec is None:
+        return None
+    return {
+        'building_id': rec['building_id'], 'address': rec['name'], 'dist': rec['dist'],
+        'total_score': rec['total_score'], 'social_score': rec['social_score'],
+        'quality_score': rec['quality_score'], 'transport_score': rec['transport_score'],
+    }
+
+
+async def _resolve_batch(batch, geocoder, index, stats: BulkStats, budget: UpstreamBudget):
+    # 1. адреса -> координаты (параллельно, с ограничением)
+    sem = asyncio.Semaphore(BULK_GEOCODE_CONCURRENCY)
+
+    async def geocode(item):
+        async with sem:
+            geo = await geocoder.geocode(item['query_address'], budget) if geocoder is not None else None
+        if geo:
+            item['lat'], item['lon'] = geo
+
+    await asyncio.gather(*(geocode(item) for item in batch if 'query_address' in item))
+    stats.over_budget = budget.refused
+
+    # 2. ближайшие дома — одним запросом на пачку или по индексу
+    points = [item for item in batch if 'lat' in item]
+    if index is not None:
+        nearest = [_from_index(index, item['lat'], item['lon']) for item in points]
+    elif points:
+        nearest = await db_call(_query_nearest_many,
+                                [item['lon'] for item in points], [item['lat'] for item in points], retry=True)
+    else:
+        nearest = []
+    for item, house in zip(points, nearest):
+        item.update(house or {})
+        item['status'] = 'ok' if house else 'not_found'
+
+    for item in batch:
+        if 'lat' not in item:
+            item['status'] = 'not_geocoded'
+            stats.not_geocoded += 1
+        elif item['status'] == 'ok':
+            stats.found += 1
+        else:
+            stats.not_found += 1
+        stats.rows += 1
+    stats.batches += 1
+    return batch
+
+
+# Результаты по мере готовности пачек; lines — любой итерируемый источник строк
+async def rate_many(lines, geocoder: Geocoder = None, index=None,
+                    batch_size: int = BULK_BATCH, stats: BulkStats = None,
+                    max_upstream: int = BULK_MAX_UPSTREAM):
+    stats = stats if stats is not None else BulkStats()
+    budget = UpstreamBudget(max_upstream)
+    batch = []
+    for number, line in enumerate(lines, 1):
+        item = parse_line(number, line)
+        if item is None:
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            for row in await _resolve_batch(batch, geocoder, index, stats, budget):
+                yield row
+            batch = []
+    if batch:
+        for row in await _resolve_batch(batch, geocoder, index, stats, budget):
+            yield row
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+# Запись результатов в out (текстовый файл) по одной строке; возвращает число строк
+async def write_results(rows, out, fmt: str = 'csv') -> int:
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        async for row in rows:
+            writer.writerow({k: _plain(row.get(k)) for k in FIELDS})
+            count += 1
+    elif fmt == 'json':
+        out.write('[')
+        async for row in rows:
+            out.write(',\n' if count else '\n')
+            out.write(json.dumps({k: _plain(row.get(k)) for k in FIELDS}, ensure_ascii=False))
+            count += 1
+        out.write('\n]\n')
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    return count
+
+
+async def run(args):
+    configure_db(host=args.host, dbname=args.dbname, user=args.user, password=args.password)
+    geocoder = Geocoder(GeocodeCache(path=args.geocode_cache or None))
+    index = None
+    if args.snapshot:
+        from snapshot import Snapshot
+        from spatial_index import BuildingIndex
+
+        index = BuildingIndex.from_snapshot(Snapshot(args.snapshot))
+    stats = BulkStats()
+    src = open(args.input, encoding='utf-8-sig') if args.input != '-' else sys.stdin
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        await write_results(rate_many(src, geocoder, index, batch_size=args.batch, stats=stats,
+                                      max_upstream=args.max_upstream), out, args.format)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if src is not sys.stdin:
+            src.close()
+        await geocoder.close()
+        close_db_pool()
+    print(stats.summary(), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная оценка координат и адресов")
+    parser.add_argument("input", help="файл со строками «lat, lon» или адресами; - — stdin")
+    parser.add_argument("-o", "--output", help="куда писать результат (по умолчанию stdout)")
+    parser.add_argument("--format", choices=['csv', 'json'], default='csv')
+    parser.add_argument("--batch", type=int, default=BULK_BATCH, help="строк в одном запросе к БД")
+    parser.add_argument("--host", default='')
+    parser.add_argument("--dbname", default='')
+    parser.add_argument("--user", default='')
+    parser.add_argument("--password", default='')
+    parser.add_argument("--snapshot", help="искать дома по снимку (snapshot.py), а не запросом к БД")
+    parser.add_argument("--max-upstream", type=int, default=BULK_MAX_UPSTREAM,
+                        help="не больше запросов к Nominatim (1 в секунду)")
+    parser.add_argument("--geocode-cache", default='geocode_cache.json', help="пусто — кэш только в памяти")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import math
+
+# Карточка дома для ответа бота.
+# Карточка собирается из двух частей, которые зависят только от рейтинга
+# и объектов: head — дом, характеристики и оценки; objects — объекты в радиусе.
+# Между ними при отправке вставляется строка с отклонением координат запроса.
+# rebuild_ratings.py заранее собирает обе части для радиусов CARD_RADII
+# в таблицу building_cards (sql/building_cards.sql), бот отдаёт их без
+# повторной сборки; для прочих радиусов карточка собирается на лету той же
+# функцией.
+
+# Радиусы, для которых карточки предрасчитаны (не больше AMENITY_MAX_RADIUS в main.py)
+CARD_RADII = (500, 1000, 2000)
+
+# Поля дома, которые отдаются в карточку
+BUILDING_COLUMNS = """
+           b.building_id,
+           b.address AS name,
+           ROUND(br.total_score::numeric,2) AS total_score,
+           ROUND(br.social_score::numeric,2) AS social_score,
+           ROUND(br.quality_score::numeric,2) AS quality_score,
+           ROUND(br.transport_score::numeric,2) AS transport_score,
+           b.build_year,
+           b.floors_number,
+           b.is_emergency,
+           b.square,
+           b.apartments_number,
+           b.building_type_id,
+           b.living_area,
+           b.not_living_area,
+           b.is_cultural_heritage,
+           b.latitude,
+           b.longitude,
+           ST_X(b.geom) AS geom_lon,
+           ST_Y(b.geom) AS geom_lat"""
+
+
+# Радиус предрасчитанной карточки или None, если карточку нужно собирать
+def card_radius(radius: float):
+    r_int = int(radius) if radius > 0 else 1000
+    return r_int if r_int in CARD_RADII and r_int == radius else None
+
+
+def card_head(res) -> str:
+    lines = [
+        f"🏠 *Дом:* {res['name']} (ID: {res['building_id']})",
+        f"⭐ *Рейтинг:* {res['total_score']} / 100",
+        "",
+        "🏗 *Характеристики:*",
+        f"- Год постройки: {res['build_year']}",
+        f"- Этажей: {res['floors_number']}",
+        f"- Аварийный: {'Да' if res['is_emergency'] else 'Нет'}",
+        f"- Общая площадь: {res.get('square', 'нет данных')}",
+        f"- Количество квартир: {res.get('apartments_number', 'нет данных')}",
+        f"- Тип здания (ID): {res.get('building_type_id', 'нет данных')}",
+        f"- Жилая площадь: {res.get('living_area', 'нет данных')}",
+        f"- Нежилая площадь: {res.get('not_living_area', 'нет данных')}",
+        f"- Культурное наследие: {'Да' if res.get('is_cultural_heritage') else 'Нет'}",
+        f"- Координаты в БД: {res.get('latitude', 'нет данных')}, {res.get('longitude', 'нет данных')}",
+        "",
+        "📊 *Оценки по категориям:*",
+        f"- Соц: {res['social_score']}",
+        f"- Качество: {res['quality_score']}",
+        f"- Транспорт: {res['transport_score']}",
+    ]
+    return "\n".join(lines)
+
+
+def card_objects(objs, radius: float) -> str:
+    lines = [f"Объекты в радиусе {int(radius)} м:"]
+    if objs:
+        for o in objs:
+            lines.append(f"- {o['type']}: {o['name']}")
+    else:
+        lines.append("Объекты не найдены.")
+    return "\n".join(lines)
+
+
+# Отклонение точки запроса от дома, м
+def card_distance(lat: float, lon: float, res) -> float:
+    return math.dist([lat, lon], [res['geom_lat'], res['geom_lon']]) * 111000
+
+
+def render_card(head: str, objects: str, dist: float) -> str:
+    return f"{head}\n\n📍 Отклонение координат: {dist:.2f} м\n\n{objects}"
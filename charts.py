@@ -0,0 +1,183 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import span
+
+# Отрисовка графиков в пуле процессов.
+# Функции render_* выполняются в дочерних процессах и используют объектный
+# API matplotlib (Figure + Agg) без глобального состояния pyplot.
+# Результат — PNG в байтах: файлы на диск не пишутся, и одновременные
+# запросы разных пользователей не перезаписывают графики друг друга.
+# ChartRenderer ограничивает число задач в очереди: когда пул занят,
+# хендлеры ждут своей очереди, а не копят задачи без предела.
+# matplotlib и numpy импортируются только в процессах пула (_warmup при их
+# запуске): процесс бота их не загружает и не держит в памяти.
+
+CHART_WORKERS = max(1, min(4, os.cpu_count() or 1))
+CHART_MAX_PENDING = CHART_WORKERS * 4
+# Приоритет процессов пула (nice): на общем процессоре графики уступают
+# процессу бота, и текстовые ответы не ждут отрисовки
+CHART_NICE = 10
+
+# Цвета домов на графиках сравнения: первый, второй, ...
+PALETTE = ["skyblue", "salmon", "mediumseagreen", "orchid", "goldenrod", "slategray"]
+
+
+def _colors(n):
+    return [PALETTE[i % len(PALETTE)] for i in range(n)]
+
+
+# Запуск процесса пула: понижение приоритета и загрузка matplotlib до первой задачи
+def _warmup():
+    if CHART_NICE:
+        os.nice(CHART_NICE)
+    import numpy  # noqa: F401
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+    from matplotlib.figure import Figure  # noqa: F401
+
+
+def _figure(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _png(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+# Гистограмма распределения рейтингов по готовым интервалам [(начало, домов)]
+def render_distribution(bins, width):
+    starts = [start for start, _ in bins]
+    counts = [count for _, count in bins]
+    fig, ax = _figure((6, 4))
+    ax.bar(starts, counts, width=width, align='edge', color='skyblue', edgecolor='black')
+    ax.set_xlim(0, 100)
+    ax.set_title("Распределение рейтингов")
+    ax.set_xlabel("Рейтинг")
+    ax.set_ylabel("Количество домов")
+    return _png(fig)
+
+
+# Столбцы «Дом 1 / Дом 2 / ...» по одному показателю
+def render_values(label, values):
+    names = [f"Дом {i + 1}" for i in range(len(values))]
+    fig, ax = _figure((max(4, 1.2 * len(values)), 3))
+    ax.bar(names, values, color=_colors(len(values)))
+    ax.set_title(label)
+    fig.tight_layout()
+    return _png(fig)
+
+
+# Сгруппированные столбцы нескольких домов по нескольким показателям:
+# series[i] — значения i-го дома, names[i] — его подпись в легенде
+def render_series(labels, series, names, title,
+                  figsize=(6, 4), rotation=25, ha='center', legend=True, label_len=10):
+    import numpy as np
+
+    x = np.arange(len(labels))
+    width = 0.7 / len(series)
+
+    fig, ax = _figure(figsize)
+    for i, (vals, name, color) in enumerate(zip(series, names, _colors(len(series)))):
+        ax.bar(x + (i - (len(series) - 1) / 2) * width, vals, width, label=name[:label_len], color=color)
+    ax.set_title(title)
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=rotation, ha=ha)
+    if legend:
+        ax.legend()
+    fig.tight_layout()
+    return _png(fig)
+
+
+# Тепловая карта ячеек сетки (см. rating_cells в sql/rating_aggregates.sql):
+# cells — [(cx, cy, value), ...], origin — точка запроса в метрах той же сетки;
+# оси — километры от точки запроса
+def render_heatmap(cells, cell_size, origin, title, vmax=100, label="Рейтинг"):
+    import numpy as np
+
+    xs = [cx for cx, _, _ in cells]
+    ys = [cy for _, cy, _ in cells]
+    x0, y0 = min(xs), min(ys)
+    grid = np.full((max(ys) - y0 + 1, max(xs) - x0 + 1), np.nan)
+    for cx, cy, value in cells:
+        grid[cy - y0, cx - x0] = value
+    qx, qy = origin
+    extent = [(x0 * cell_size - qx) / 1000, ((max(xs) + 1) * cell_size - qx) / 1000,
+              (y0 * cell_size - qy) / 1000, ((max(ys) + 1) * cell_size - qy) / 1000]
+
+    fig, ax = _figure((6, 5))
+    image = ax.imshow(np.ma.masked_invalid(grid), origin='lower', extent=extent,
+                      cmap='RdYlGn', vmin=0, vmax=vmax, interpolation='nearest')
+    ax.plot([0], [0], marker='*', color='black', markersize=12)
+    fig.colorbar(image, ax=ax, label=label)
+    ax.set_title(title)
+    ax.set_xlabel("км на восток")
+    ax.set_ylabel("км на север")
+    fig.tight_layout()
+    return _png(fig)
+
+
+class ChartRenderer:
+    def __init__(self, workers: int = CHART_WORKERS, max_pending: int = CHART_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._sem = None
+        self.stats = {"rendered": 0, "in_flight": 0, "waiting": 0, "errors": 0}
+
+    # Запуск пула заранее — до того, как в процессе появятся потоки БД.
+    # С fork все процессы создаются при первой задаче; её результат не ждём,
+    # чтобы импорт matplotlib в них шёл параллельно со стартом бота.
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_warmup,
+            )
+            self._executor.submit(int)
+        return self
+
+    async def render(self, func, *args):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_pending)
+        self.start()
+
+        self.stats["waiting"] += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+
+        self.stats["in_flight"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            name = getattr(func, 'func', func).__name__
+            with span(f"chart.{name}"):
+                result = await loop.run_in_executor(self._executor, func, *args)
+            self.stats["rendered"] += 1
+            return result
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["in_flight"] -= 1
+            self._sem.release()
+
+    # Несколько графиков параллельно; порядок результатов сохраняется
+    async def render_many(self, jobs):
+        return await asyncio.gather(*(self.render(func, *args) for func, *args in jobs))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
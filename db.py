@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import ThreadedConnectionPool
+
+from metrics import span
+
+# Пул соединений с БД.
+# psycopg2 — синхронный драйвер, поэтому запросы выполняются в потоках
+# (свой пул потоков по размеру пула соединений), а число одновременных запросов ограничено семафором,
+# чтобы при пиковой нагрузке хендлеры ждали в очереди, а не открывали новые
+# соединения. Очередь к соединениям приоритетная: запросы с PRIORITY_HIGH
+# (дешёвые ответы) получают соединение раньше ждущих PRIORITY_LOW (сравнения,
+# графики); приоритет задаёт вызывающий через contextvar priority (throttle.py).
+
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+DB_QUERY_TIMEOUT_MS = 5000     # statement_timeout на стороне PostgreSQL
+DB_ACQUIRE_TIMEOUT = 10        # сколько ждать свободное соединение, сек
+
+_conn_kwargs = {}
+_pool = None
+_pool_lock = threading.Lock()
+_sem = None
+_executor = None
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+priority = contextvars.ContextVar("db_priority", default=PRIORITY_HIGH)
+
+# Метрики пула
+db_pool_stats = {
+    "in_use": 0,          # соединений занято прямо сейчас
+    "waiting": 0,         # запросов ждут свободное соединение
+    "acquired": 0,        # всего выдано соединений
+    "acquire_timeouts": 0,
+    "query_errors": 0,
+    "reconnects": 0,      # отброшено «мёртвых» соединений
+    "wait_time_total": 0.0,
+}
+
+
+def configure_db(host: str, dbname: str, user: str, password: str,
+                 minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+    global _conn_kwargs, _sem, DB_POOL_MIN, DB_POOL_MAX
+    _conn_kwargs = dict(
+        host=host,
+        dbname=dbname,
+        user=user,
+        password=password,
+        options=f"-c statement_timeout={DB_QUERY_TIMEOUT_MS}",
+    )
+    DB_POOL_MIN = minconn
+    DB_POOL_MAX = maxconn
+    _sem = None
+    close_db_executor()
+
+
+class PriorityGate:
+    # Семафор, который освободившееся место отдаёт ожидающему с наименьшим
+    # значением приоритета, при равных — тому, кто ждёт дольше
+    def __init__(self, limit: int):
+        self.free = limit
+        self._waiters = []            # куча (приоритет, номер, future)
+        self._seq = itertools.count()
+
+    async def acquire(self, prio: int = PRIORITY_HIGH):
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        entry = (prio, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                self.release()        # место уже выдано — отдать следующему
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            fut = heapq.heappop(self._waiters)[2]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.free += 1
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **_conn_kwargs)
+    return _pool
+
+
+def _get_sem() -> PriorityGate:
+    global _sem
+    if _sem is None:
+        _sem = PriorityGate(DB_POOL_MAX)
+    return _sem
+
+
+def _is_alive(conn) -> bool:
+    # Дешёвая проверка без запроса к серверу
+    return not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_UNKNOWN
+
+
+def _checkout():
+    pool = _get_pool()
+    conn = pool.getconn()
+    if not _is_alive(conn):
+        db_pool_stats["reconnects"] += 1
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    conn.autocommit = True
+    return conn
+
+
+# Соединение, которое уже закрыл сервер (перезапуск PostgreSQL, таймаут простоя),
+# на клиенте выглядит живым и падает на первом же запросе. С retry (только для
+# запросов на чтение — повтор записи может выполнить её дважды) запрос тогда
+# повторяется на другом соединении; после перезапуска сервера мертвы все
+# простаивающие соединения пула, поэтому попыток — по размеру пула. Ошибки на
+# живом соединении (statement_timeout и т. п.) не повторяются.
+def _run(func, retry: bool, *args):
+    pool = _get_pool()
+    for attempt in range(DB_POOL_MAX + 1):
+        conn = _checkout()
+        broken = False
+        try:
+            return func(conn, *args)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            if retry and conn.closed and attempt < DB_POOL_MAX:
+                db_pool_stats["reconnects"] += 1
+                logging.warning("Соединение с БД разорвано сервером, запрос повторяется")
+                continue
+            raise
+        finally:
+            pool.putconn(conn, close=broken or not _is_alive(conn))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+    return _executor
+
+
+def _release(sem: PriorityGate):
+    db_pool_stats["in_use"] -= 1
+    sem.release()
+
+
+# Выполнить func(conn, *args) на соединении из пула, не блокируя event loop.
+# retry=True — только для запросов на чтение (см. _run).
+# Место в очереди освобождается, когда поток вернул соединение, а не когда
+# отменили ожидающую корутину: иначе очередь пропустила бы больше DB_POOL_MAX
+# запросов и пул ответил бы PoolError.
+async def db_call(func, *args, retry: bool = False):
+    sem = _get_sem()
+    db_pool_stats["waiting"] += 1
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(sem.acquire(priority.get()), DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        db_pool_stats["acquire_timeouts"] += 1
+        raise
+    finally:
+        db_pool_stats["waiting"] -= 1
+        db_pool_stats["wait_time_total"] += time.monotonic() - started
+
+    db_pool_stats["in_use"] += 1
+    db_pool_stats["acquired"] += 1
+    loop = asyncio.get_running_loop()
+
+    def done(_):
+        try:
+            loop.call_soon_threadsafe(_release, sem)
+        except RuntimeError:      # цикл событий уже закрыт
+            pass
+
+    ctx = contextvars.copy_context()
+    try:
+        job = _get_executor().submit(ctx.run, _run, func, retry, *args)
+    except BaseException:
+        _release(sem)
+        raise
+    job.add_done_callback(done)
+    try:
+        with span(f"db.{func.__name__.lstrip('_')}"):
+            return await asyncio.wrap_future(job)
+    except psycopg2.Error:
+        db_pool_stats["query_errors"] += 1
+        raise
+
+
+# Проверка доступности БД (например, при старте бота)
+async def db_healthcheck() -> bool:
+    def ping(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+            return cur.fetchone()[0] == 1
+
+    try:
+        return await db_call(ping, retry=True)
+    except Exception as e:
+        logging.warning("DB healthcheck failed: %s", e)
+        return False
+
+
+def close_db_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def close_db_pool():
+    global _pool
+    close_db_executor()
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
@@ -0,0 +1,356 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import Counter, OrderedDict
+
+import aiohttp
+
+# Геокодинг адресов через Nominatim с кэшем.
+# Одна общая aiohttp-сессия на процесс, LRU-кэш с TTL (по желанию сохраняется
+# на диск), нормализация адреса для ключа кэша и склейка одинаковых запросов,
+# которые пришли одновременно, в один запрос к Nominatim. Все запросы к
+# Nominatim процесса идут через один RateLimiter (правила Nominatim — не чаще
+# 1 запроса в секунду), а задания с множеством адресов (bulk.py) ограничивают
+# число своих запросов UpstreamBudget.
+# Перед Nominatim адрес ищется в локальном индексе адресов из таблицы building
+# (LocalGeocoder) — без сетевых запросов.
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "GeoBot"
+
+GEOCODE_CACHE_SIZE = 10000
+GEOCODE_CACHE_TTL = 7 * 24 * 3600     # найденные адреса, сек
+GEOCODE_MISS_TTL = 3600               # «не найдено», сек
+GEOCODE_TIMEOUT = 10
+NOMINATIM_RATE_PER_SEC = 1.0      # на всё приложение; процессы webhook делят его поровну
+
+LOCAL_MIN_SIMILARITY = 0.6        # порог сходства названия улицы по триграммам
+
+# Слова, которые не отличают один адрес от другого
+ADDRESS_STOPWORDS = {
+    'россия', 'рф', 'москва', 'г', 'город', 'ул', 'улица', 'д', 'дом',
+}
+
+# Сокращения, приводимые к одной форме
+ADDRESS_SYNONYMS = {
+    'пр': 'проспект', 'пр-т': 'проспект', 'просп': 'проспект', 'пр-кт': 'проспект',
+    'пер': 'переулок', 'ш': 'шоссе', 'б-р': 'бульвар', 'бул': 'бульвар',
+    'пл': 'площадь', 'наб': 'набережная', 'проезд': 'проезд', 'пр-д': 'проезд',
+    'корпус': 'к', 'корп': 'к', 'строение': 'с', 'стр': 'с',
+}
+
+
+# Ключ кэша: регистр, ё/е, пунктуация и лишние пробелы не важны
+def normalize_address(addr: str) -> str:
+    addr = addr.lower().replace('ё', 'е')
+    addr = re.sub(r'[^\w\s/-]', ' ', addr)
+    return re.sub(r'\s+', ' ', addr).strip()
+
+
+# Ключ локального индекса: без «Москва», «ул.», «д.», сокращения раскрыты
+def address_tokens(addr: str):
+    tokens = []
+    for t in normalize_address(addr).split():
+        t = ADDRESS_SYNONYMS.get(t, t)
+        if t not in ADDRESS_STOPWORDS:
+            tokens.append(t)
+    return tokens
+
+
+def _trigrams(key: str):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LocalGeocoder:
+    # Индекс адресов домов. Улица ищется точно или нечётко по триграммам
+    # (по списку уникальных улиц), номер дома/корпуса/строения — только точно,
+    # чтобы не вернуть соседний дом.
+    def __init__(self, rows):
+        # rows: dict с ключами building_id, name (адрес), geom_lat, geom_lon
+        ids, names, lats, lons = [], [], [], []
+        for row in rows:
+            ids.append(row['building_id'])
+            names.append(row['name'])
+            lats.append(row['geom_lat'])
+            lons.append(row['geom_lon'])
+        self._build(ids, names, lats, lons)
+
+    # Из колонок (списки, массивы numpy, StringColumn снимка) без записи на дом:
+    # в индексе улиц хранится только номер строки
+    @classmethod
+    def from_columns(cls, building_ids, names, lats, lons):
+        index = cls.__new__(cls)
+        index._build(building_ids, names, lats, lons)
+        return index
+
+    def _build(self, building_ids, names, lats, lons):
+        self.building_ids = building_ids
+        self.lats = lats
+        self.lons = lons
+        self.streets = {}       # улица -> {номера: номер строки}
+        self.street_keys = []
+        self.street_trigrams = []
+        postings = {}
+        for row in range(len(names)):
+            name = names[row]
+            if not name:
+                continue
+            street, numbers = self._split(address_tokens(name))
+            if not street:
+                continue
+            houses = self.streets.get(street)
+            if houses is None:
+                houses = self.streets[street] = {}
+                i = len(self.street_keys)
+                self.street_keys.append(street)
+                trigrams = _trigrams(street)
+                self.street_trigrams.append(len(trigrams))
+                for tg in trigrams:
+                    postings.setdefault(tg, []).append(i)
+            houses.setdefault(numbers, row)
+        self.postings = postings
+        self.size = sum(len(h) for h in self.streets.values())
+        self.stats = {"exact": 0, "fuzzy": 0, "misses": 0}
+
+    def _house(self, row: int):
+        return float(self.lats[row]), float(self.lons[row]), int(self.building_ids[row])
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _split(tokens):
+        street = ' '.join(t for t in tokens if not any(ch.isdigit() for ch in t) and t not in ('к', 'с'))
+        numbers = tuple(t for t in tokens if any(ch.isdigit() for ch in t) or t in ('к', 'с'))
+        return street, numbers
+
+    # (lat, lon, building_id) или None
+    def lookup(self, addr: str):
+        street, numbers = self._split(address_tokens(addr))
+        if not street or not numbers:
+            self.stats["misses"] += 1
+            return None
+
+        houses = self.streets.get(street)
+        if houses is not None and numbers in houses:
+            self.stats["exact"] += 1
+            return self._house(houses[numbers])
+
+        query = _trigrams(street)
+        counts = Counter()
+        for tg in query:
+            counts.update(self.postings.get(tg, ()))
+
+        # Число общих триграмм ещё не сходство: длинная улица делит с запросом
+        # много триграмм при низком сходстве. Кандидаты сортируются по сходству.
+        candidates = sorted(
+            ((2 * common / (len(query) + self.street_trigrams[i]), i)
+             for i, common in counts.most_common(10)),
+            key=lambda c: -c[0])
+        for sim, i in candidates:
+            if sim < LOCAL_MIN_SIMILARITY:
+                continue
+            found = self.streets[self.street_keys[i]].get(numbers)
+            if found is not None:
+                self.stats["fuzzy"] += 1
+                return self._house(found)
+
+        self.stats["misses"] += 1
+        return None
+
+
+class GeocodeCache:
+    def __init__(self, maxsize: int = GEOCODE_CACHE_SIZE, ttl: float = GEOCODE_CACHE_TTL,
+                 miss_ttl: float = GEOCODE_MISS_TTL, path: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.path = path
+        self._data = OrderedDict()   # key -> (expires_at, (lat, lon) | None)
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._data)
+
+    # (найдено в кэше, значение)
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def put(self, key: str, value):
+        ttl = self.ttl if value is not None else self.miss_ttl
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    # Непросроченные записи файла: key -> (expires_at, value)
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Не удалось прочитать кэш геокодинга %s: %s", self.path, e)
+            return {}
+        now = time.time()
+        return {key: (expires_at, tuple(value) if value else None)
+                for key, expires_at, value in items if expires_at >= now}
+
+    def load(self):
+        self._data.update(sorted(self._read().items(), key=lambda kv: kv[1][0]))
+
+    # Файл кэша пишут несколько процессов (рабочие процессы webhook): под
+    # блокировкой записи файла сливаются со своими (новее — та, что дольше
+    # живёт), затем файл атомарно подменяется своим временным файлом.
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self._read()
+            for key, item in self._data.items():
+                if key not in merged or merged[key][0] < item[0]:
+                    merged[key] = item
+            items = sorted(merged.items(), key=lambda kv: kv[1][0])[-self.maxsize:]
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump([(k, exp, v) for k, (exp, v) in items], f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+
+class RateLimiter:
+    # Не чаще rate запросов в секунду: каждый вызов wait() занимает следующий
+    # свободный интервал и ждёт его начала
+    def __init__(self, rate: float = NOMINATIM_RATE_PER_SEC):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self.stats = {"waited": 0, "wait_s": 0.0}
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            self.stats["waited"] += 1
+            self.stats["wait_s"] += slot - now
+            await asyncio.sleep(slot - now)
+
+
+class UpstreamBudget:
+    # Сколько запросов к Nominatim может сделать одно задание
+    def __init__(self, limit: int):
+        self.left = limit
+        self.refused = 0      # адресов, не отправленных в Nominatim из-за лимита
+
+    def take(self) -> bool:
+        if self.left <= 0:
+            self.refused += 1
+            return False
+        self.left -= 1
+        return True
+
+
+class Geocoder:
+    def __init__(self, cache: GeocodeCache = None, local: LocalGeocoder = None,
+                 limiter: RateLimiter = None):
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.local = local
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self._session = None
+        self._inflight = {}   # key -> asyncio.Task
+        self.stats = {"local_hits": 0, "hits": 0, "misses": 0, "coalesced": 0, "upstream_errors": 0,
+                      "over_budget": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=GEOCODE_TIMEOUT),
+            )
+        return self._session
+
+    async def _fetch(self, addr: str):
+        params = {"format": "json", "q": addr, "limit": 1}
+        await self.limiter.wait()
+        async with self._get_session().get(NOMINATIM_URL, params=params) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            if not data:
+                return None
+            return float(data[0]['lat']), float(data[0]['lon'])
+
+    # budget — лимит запросов к Nominatim для задания (None — без лимита)
+    async def geocode(self, addr: str, budget: UpstreamBudget = None):
+        local = self.local
+        if local is not None:
+            found = local.lookup(addr)
+            if found is not None:
+                self.stats["local_hits"] += 1
+                return found[0], found[1]
+
+        key = normalize_address(addr)
+        found, value = self.cache.get(key)
+        if found:
+            self.stats["hits"] += 1
+            return value
+
+        # Такой же адрес уже геокодируется — ждём тот же результат
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task)
+
+        if budget is not None and not budget.take():
+            self.stats["over_budget"] += 1
+            return None
+
+        self.stats["misses"] += 1
+        # Запрос к Nominatim идёт отдельной задачей: если запросивший первым
+        # отменён, остальные ожидающие всё равно получат результат
+        task = asyncio.ensure_future(self._resolve(addr, key))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    async def _resolve(self, addr: str, key: str):
+        try:
+            value = await self._fetch(addr)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats["upstream_errors"] += 1
+            logging.warning("Ошибка геокодинга '%s': %s", addr, e)
+            return None
+        # Кэшируем и «не найдено», но ошибки Nominatim — нет
+        self.cache.put(key, value)
+        return value
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ожидающих может не быть — не ругаться в лог
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self.cache.save()
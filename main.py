@@ -1,31 +1,59 @@
 import logging
 import asyncio
 import re
-import math
+import hashlib
 import os
-import aiohttp
-import psycopg2
+import tempfile
+from collections import OrderedDict
+from functools import partial
 from aiogram.types.input_media_photo import InputMediaPhoto
+from psycopg2.errors import UndefinedTable
 from psycopg2.extras import RealDictCursor
-import matplotlib.pyplot as plt
-import numpy as np
 
 from aiogram import Bot, Dispatcher, Router
 from aiogram.enums import ParseMode
 from aiogram.types import (
     Message, CallbackQuery,
     ReplyKeyboardMarkup, KeyboardButton,
-    InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+    InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, FSInputFile, Update
 )
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.client.default import DefaultBotProperties
 
+from db import configure_db, db_call, db_healthcheck, close_db_pool, db_pool_stats
+from geocoder import NOMINATIM_RATE_PER_SEC, Geocoder, GeocodeCache, LocalGeocoder, RateLimiter
+from state import make_state_store
+from charts import ChartRenderer, render_distribution, render_values, render_series, render_heatmap
+from webhook import WEBHOOK_WORKERS, consume, run_webhook
+from bulk import BulkStats, rate_many, write_results
+from cards import BUILDING_COLUMNS, card_radius, card_head, card_objects, card_distance, render_card
+from search import (
+    SEARCH_DEFAULT_RADIUS, SEARCH_MAX_RADIUS, HEATMAP_DEFAULT_RADIUS, HEATMAP_MAX_RADIUS,
+    SCORE_LABELS, SCORE_MAX, parse_area_query, top_near, format_top, query_cells
+)
+import metrics
+import webhook
+from metrics import span, HandlerMetricsMiddleware, TelegramMetricsMiddleware, start_metrics_server
+from throttle import ThrottleMiddleware, SingleFlight
+
 # ПАРАМЕТРЫ
-API_TOKEN = ''
+API_TOKEN = os.getenv('API_TOKEN', '')
 DB_HOST = ''
 DB_NAME = ''
 DB_USER = ''
 DB_PASSWORD = ''
+GEOCODE_CACHE_PATH = 'geocode_cache.json'  # пусто — кэш только в памяти
+STATE_DB_PATH = ''            # файл SQLite для состояния пользователей, например bot_state.sqlite3; пусто — в памяти
+SNAPSHOT_PATH = ''            # каталог снимка домов (snapshot.py); пусто — индекс грузится из БД
+WEBHOOK_URL = ''              # внешний адрес бота, например https://bot.example.com; пусто — long polling
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ''
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100           # /metrics; в webhook-режиме рабочий процесс i слушает METRICS_PORT + i; 0 — выключено
+METRICS_LOG = False           # писать каждый замер JSON-строкой в лог "metrics"
 
 logging.basicConfig(level=logging.INFO)
 
@@ -40,151 +68,479 @@ router = Router()
 dp = Dispatcher(bot=bot)
 dp.include_router(router)
 
-# Хранилище последних 5 запросов на пользователя
-user_queries = {}  # user_id -> list[(lat, lon, radius, address)]
-
-def add_user_query(user_id: int, lat: float, lon: float, radius: float, address: str):
-    if user_id not in user_queries:
-        user_queries[user_id] = []
-    user_queries[user_id].insert(0, (lat, lon, radius, address))
-    if len(user_queries[user_id]) > 5:
-        user_queries[user_id].pop()
-
-# Подключение к БД
-def get_db_connection():
-    return psycopg2.connect(
-        host=DB_HOST,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD
-    )
+# Метрики: время хендлеров, этапов и запросов к Telegram (см. metrics.py)
+metrics.configure(log_spans=METRICS_LOG)
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(TelegramMetricsMiddleware())
+metrics_runner = None
+
+# Ограничение частоты запросов пользователя и склейка повторов (см. throttle.py).
+# Тяжёлые хендлеры тратят больше токенов и ждут БД после дешёвых ответов.
+HEAVY_HANDLERS = {'distribution_cmd', 'heatmap_cmd', 'bulk_cmd'}
+
+def classify_update(event, data):
+    handler = getattr(data.get("handler"), "callback", None)
+    name = getattr(handler, "__name__", "")
+    if not isinstance(event, Message):
+        return False, ('callback', event.data) if getattr(event, 'data', None) else None
+    if event.location is not None:
+        key = ('location', event.location.latitude, event.location.longitude)
+    elif event.document is not None:
+        key = ('document', event.document.file_unique_id)
+    else:
+        key = ('text', ' '.join((event.text or '').lower().split()))
+    # Номера домов из истории в universal_input — это сравнение
+    heavy = name in HEAVY_HANDLERS or (name == 'universal_input' and parse_indices(event.text or '') is not None)
+    return heavy, key
+
+throttle = ThrottleMiddleware(classify_update)
+router.message.middleware(throttle)
+router.callback_query.middleware(throttle)
+
+# Одинаковые запросы разных пользователей в полёте выполняются один раз
+shared = SingleFlight()
+
+# Хранилище последних 5 запросов и шага сравнения на пользователя (см. state.py).
+# Создаётся в startup(), а не при импорте: бенчмарки и рабочие процессы webhook
+# импортируют main и не должны открывать файл состояния в текущем каталоге.
+user_state = None
+
+# Запись истории: (lat, lon, radius, address, building_id); building_id — найденный
+# дом (None, если не найден) — по нему сравнение берёт дом из result_cache
+async def add_user_query(user_id: int, lat: float, lon: float, radius: float, address: str,
+                         building_id: int = None):
+    await user_state.add_query(user_id, (lat, lon, radius, address, building_id))
+
+# Сколько ближайших по индексу домов пересортировывать по точному расстоянию
+NEAREST_CANDIDATES = 16
+
+# Объекты дальше этого радиуса не хранятся в building_amenities (см. sql/building_amenities.sql)
+AMENITY_MAX_RADIUS = 2000
+
+# Шаг гистограммы «Распределение», баллов
+DISTRIBUTION_BIN = 10
+
+# Как часто проверять, не пересчитан ли building_ratings (сек)
+INDEX_REFRESH_INTERVAL = 60
+
+# Подключение к БД (пул соединений, см. db.py)
+configure_db(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+# In-memory индекс домов (см. spatial_index.py); None — ищем через БД
+building_index = None
+building_index_version = None
+
+# Найденные дома вместе с объектами в радиусе: (building_id, радиус) -> запись.
+# Повторный запрос того же дома и сравнение из истории обходятся без БД.
+# Сбрасывается вместе с view_cache при пересчёте рейтинга.
+RESULT_CACHE_SIZE = 5000
+result_cache = OrderedDict()
+result_cache_stats = {"hits": 0, "misses": 0}
+
+# Предрасчитанные карточки домов (см. cards.py): (building_id, радиус) -> (head, objects).
+# cards_available сбрасывается, если таблицы building_cards ещё нет. Кэш
+# очищается при смене ratings_version: rebuild_ratings.py меняет её и тогда,
+# когда пересобраны только карточки (объекты рядом изменились, рейтинг — нет).
+CARD_CACHE_SIZE = 20000
+card_cache = OrderedDict()
+card_cache_stats = {"hits": 0, "misses": 0, "db_hits": 0, "db_misses": 0}
+cards_available = True
+
+# Текущая версия рейтинга и кэш ответов, которые меняются только при его
+# пересчёте (Топ-10, распределение): name -> {version, digest, ...}
+ratings_version = None
+view_cache = {}
+view_cache_stats = {"hits": 0, "misses": 0}
+
 
 # Запрос информации о доме (включает дополнительные статистические данные)
-def query_building_info(lat: float, lon: float, radius: float):
-    if radius <= 0:
-        radius = 1000
+async def query_building_info(lat: float, lon: float, radius: float):
+    with span("query_building_info"):
+        return await shared.run(('house', lat, lon, radius), _lookup_building, lat, lon, radius)
+
+async def _lookup_building(lat: float, lon: float, radius: float):
+    index = building_index
+    if index is None:
+        row = await db_call(_query_building_info, lat, lon, radius, retry=True)
+        if row:
+            cache_result(radius, row)
+        return row
+
+    with span("nearest.index"):
+        row = index.nearest_record(lat, lon)
+    if not row:
+        return None
+    cached = cached_result(row['building_id'], radius)
+    if cached is not None:
+        row['objects'] = cached['objects']
+        return row
+    row['objects'] = await db_call(_query_objects, row['building_id'], radius, retry=True)
+    cache_result(radius, row)
+    return row
 
-    conn = get_db_connection()
+# Дома из истории запросов одним пакетом: найденные раньше берутся из кэша,
+# остальные с известным building_id — одним запросом к БД вместе с объектами,
+# записи без building_id — заново по координатам. Порядок сохраняется, None — не найден.
+async def query_history_entries(entries):
+    results = [None] * len(entries)
+    missing = []      # (позиция, building_id, радиус)
+    by_coords = []    # позиции записей без building_id
+    for i, entry in enumerate(entries):
+        building_id = entry[4] if len(entry) > 4 else None
+        if building_id is None:
+            by_coords.append(i)
+            continue
+        results[i] = cached_result(building_id, entry[2])
+        if results[i] is None:
+            missing.append((i, building_id, _result_key(building_id, entry[2])[1]))
+
+    async def fetch_missing():
+        if not missing:
+            return
+        rows = await db_call(_query_buildings, [m[1] for m in missing], [m[2] for m in missing], retry=True)
+        for i, building_id, r_int in missing:
+            row = rows.get((building_id, r_int))
+            if row is not None:
+                cache_result(r_int, row)
+                results[i] = dict(row)
+
+    async def fetch_by_coords(i):
+        lat, lon, radius = entries[i][:3]
+        results[i] = await query_building_info(lat, lon, radius)
+
+    await asyncio.gather(fetch_missing(), *(fetch_by_coords(i) for i in by_coords))
+    return results
+
+def _result_key(building_id, radius: float):
+    return building_id, int(radius) if radius > 0 else 1000
+
+def cached_result(building_id, radius: float):
+    key = _result_key(building_id, radius)
+    row = result_cache.get(key)
+    if row is None:
+        result_cache_stats["misses"] += 1
+        return None
+    result_cache_stats["hits"] += 1
+    result_cache.move_to_end(key)
+    return dict(row)
+
+def cache_result(radius: float, row):
+    key = _result_key(row['building_id'], radius)
+    result_cache[key] = dict(row)
+    result_cache.move_to_end(key)
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        result_cache.popitem(last=False)
+
+# Предрасчитанная карточка (head, objects) или None
+def _query_card(conn, building_id: int, radius: int):
+    cur = conn.cursor()
+    cur.execute("SELECT head, objects FROM building_cards WHERE building_id = %s AND radius = %s;",
+                (building_id, radius))
+    row = cur.fetchone()
+    cur.close()
+    return row
+
+async def get_card(building_id: int, radius: int):
+    global cards_available
+    key = (building_id, radius)
+    card = card_cache.get(key)
+    if card is not None:
+        card_cache_stats["hits"] += 1
+        card_cache.move_to_end(key)
+        return card
+    card_cache_stats["misses"] += 1
+    if not cards_available:
+        return None
+    try:
+        card = await db_call(_query_card, building_id, radius, retry=True)
+    except UndefinedTable:
+        logging.warning("Таблица building_cards не найдена, карточки собираются на лету")
+        cards_available = False
+        return None
+    if card is None:
+        card_cache_stats["db_misses"] += 1
+        return None
+    card_cache_stats["db_hits"] += 1
+    card = tuple(card)
+    card_cache[key] = card
+    while len(card_cache) > CARD_CACHE_SIZE:
+        card_cache.popitem(last=False)
+    return card
+
+def _query_building_info(conn, lat: float, lon: float, radius: float):
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    q = """
-    SELECT b.building_id,
-           b.address AS name,
-           ROUND(br.total_score::numeric,2) AS total_score,
-           ROUND(br.social_score::numeric,2) AS social_score,
-           ROUND(br.quality_score::numeric,2) AS quality_score,
-           ROUND(br.transport_score::numeric,2) AS transport_score,
-           b.build_year,
-           b.floors_number,
-           b.is_emergency,
-           b.square,
-           b.apartments_number,
-           b.building_type_id,
-           b.living_area,
-           b.not_living_area,
-           b.is_cultural_heritage,
-           b.latitude,
-           b.longitude,
-           ST_Distance(
-               b.geom::geography,
-               ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography
-           ) AS dist,
-           ST_X(b.geom) AS geom_lon,
-           ST_Y(b.geom) AS geom_lat
-    FROM building b
-    JOIN building_ratings br ON br.building_id = b.building_id
-    ORDER BY ST_Distance(
-             b.geom::geography,
-             ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography)
-    LIMIT 1;
+    r_int = int(radius) if radius > 0 else 1000
+    precomputed = r_int <= AMENITY_MAX_RADIUS
+
+    # KNN-поиск по GiST-индексу на building.geog (см. sql/spatial_indexes.sql):
+    # берём NEAREST_CANDIDATES ближайших кандидатов и точно пересортировываем.
+    # Объекты в радиусе приходят тем же запросом из building_amenities.
+    objects_col = f""",
+           ({AMENITIES_SUBQUERY.format(building_id='n.building_id', radius='%s')}) AS objects""" if precomputed else ""
+    q = f"""
+    WITH pt AS (
+        SELECT ST_SetSRID(ST_MakePoint(%s, %s),4326)::geography AS geog
+    ),
+    candidates AS (
+        SELECT b.building_id
+        FROM building b, pt
+        ORDER BY b.geog <-> pt.geog
+        LIMIT %s
+    ),
+    nearest AS (
+        SELECT {BUILDING_COLUMNS},
+               ST_Distance(b.geog, pt.geog) AS dist
+        FROM candidates c
+        JOIN building b ON b.building_id = c.building_id
+        JOIN building_ratings br ON br.building_id = b.building_id
+        CROSS JOIN pt
+        ORDER BY dist
+        LIMIT 1
+    )
+    SELECT n.*{objects_col}
+    FROM nearest n;
     """
-    cur.execute(q, (lon, lat, lon, lat))
+    params = (lon, lat, NEAREST_CANDIDATES) + ((r_int,) if precomputed else ())
+    cur.execute(q, params)
     row = cur.fetchone()
+    cur.close()
     if not row:
-        cur.close()
-        conn.close()
         return None
 
-    building_id = row['building_id']
+    if not precomputed:
+        row['objects'] = _query_objects_live(conn, row['building_id'], r_int)
+    return row
+
+# Объекты в радиусе из предрасчитанной таблицы: один индексный запрос
+AMENITIES_SUBQUERY = """
+        SELECT COALESCE(json_agg(json_build_object('type', a.type, 'name', a.name)
+                                 ORDER BY a.type, a.name), '[]'::json)
+        FROM building_amenities a
+        WHERE a.building_id = {building_id} AND a.dist <= {radius}"""
+
+def _query_objects(conn, building_id: int, radius: float):
     r_int = int(radius) if radius > 0 else 1000
+    if r_int > AMENITY_MAX_RADIUS:
+        return _query_objects_live(conn, building_id, r_int)
+
+    cur = conn.cursor()
+    cur.execute(AMENITIES_SUBQUERY.format(building_id='%s', radius='%s') + ";", (building_id, r_int))
+    obs = cur.fetchone()[0]
+    cur.close()
+    return obs
+
+# Несколько домов с объектами в радиусе одним запросом: {(building_id, радиус): запись}
+def _query_buildings(conn, building_ids, radii):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    amenities = AMENITIES_SUBQUERY.format(building_id='b.building_id', radius='r.radius')
+    cur.execute(f"""
+        SELECT {BUILDING_COLUMNS},
+               r.radius AS query_radius,
+               ({amenities}) AS objects
+        FROM unnest(%s::bigint[], %s::int[]) AS r(building_id, radius)
+        JOIN building b ON b.building_id = r.building_id
+        JOIN building_ratings br ON br.building_id = b.building_id;
+    """, (list(building_ids), list(radii)))
+    rows = {}
+    for row in cur.fetchall():
+        r_int = row.pop('query_radius')
+        if r_int > AMENITY_MAX_RADIUS:
+            row['objects'] = _query_objects_live(conn, row['building_id'], r_int)
+        rows[(row['building_id'], r_int)] = row
+    cur.close()
+    return rows
+
+# Живой пространственный запрос — для радиусов больше AMENITY_MAX_RADIUS
+def _query_objects_live(conn, building_id: int, r_int: int):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
 
     oq = """
     WITH center AS (
-        SELECT geom::geography AS geog
+        SELECT geog
         FROM building
         WHERE building_id = %s
     )
     SELECT 'Школа' AS type, s.name
     FROM school s, center
-    WHERE ST_DWithin(center.geog, s.geom::geography, %s)
+    WHERE ST_DWithin(center.geog, s.geog, %s)
 
     UNION ALL
     SELECT 'Детский сад' AS type, k.name
     FROM kindergarten k, center
-    WHERE ST_DWithin(center.geog, k.geom::geography, %s)
+    WHERE ST_DWithin(center.geog, k.geog, %s)
 
     UNION ALL
     SELECT 'Больница' AS type, h.name
     FROM hospital h, center
-    WHERE ST_DWithin(center.geog, h.geom::geography, %s)
+    WHERE ST_DWithin(center.geog, h.geog, %s)
 
     UNION ALL
     SELECT 'Парк' AS type, p.name
     FROM park p, center
-    WHERE ST_DWithin(center.geog, p.geom::geography, %s)
+    WHERE ST_DWithin(center.geog, p.geog, %s)
     ORDER BY type, name;
     """
     cur.execute(oq, (building_id, r_int, r_int, r_int, r_int))
     obs = cur.fetchall()
+    cur.close()
+    return obs
 
+# Загрузка всех домов с оценками для in-memory индекса
+def _query_all_buildings(conn):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f"""
+    SELECT {BUILDING_COLUMNS}
+    FROM building b
+    JOIN building_ratings br ON br.building_id = b.building_id;
+    """)
+    rows = cur.fetchall()
     cur.close()
-    conn.close()
+    return rows
 
-    row['objects'] = obs
-    return row
+# Версия рейтинга (обновляется в конце sql/building_ratings.sql)
+def _query_ratings_version(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT built_at FROM ratings_version WHERE id = 1;")
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+# В базе, созданной до появления таблицы ratings_version, версии нет (None):
+# индекс всё равно загружается, кэши просто не сбрасываются по версии
+async def fetch_ratings_version():
+    try:
+        return await db_call(_query_ratings_version, retry=True)
+    except UndefinedTable:
+        return None
+
+def set_ratings_version(version):
+    global ratings_version, cards_available
+    if version != ratings_version:
+        ratings_version = version
+        view_cache.clear()
+        result_cache.clear()
+        card_cache.clear()
+        cards_available = True
+
+async def reload_building_index():
+    global building_index, building_index_version
+    # numpy загружается только вместе с индексом
+    from spatial_index import BuildingIndex
+    from snapshot import load_snapshot
+
+    version = await fetch_ratings_version()
+    set_ratings_version(version)
+    # Снимок той же версии рейтинга читается через mmap без запроса всех домов;
+    # без версии в БД его актуальность не проверить — дома берутся из БД
+    use_snapshot = SNAPSHOT_PATH and version is not None
+    snap = await asyncio.to_thread(load_snapshot, SNAPSHOT_PATH, version) if use_snapshot else None
+    # Рядом — локальный геокодер по адресам тех же домов; из снимка он строится
+    # прямо по колонкам, без записи на каждый дом
+    if snap is not None:
+        building_index = await asyncio.to_thread(BuildingIndex.from_snapshot, snap)
+        b = snap.buildings
+        local = await asyncio.to_thread(LocalGeocoder.from_columns,
+                                        b['building_id'], b['name'], b['geom_lat'], b['geom_lon'])
+    else:
+        rows = await db_call(_query_all_buildings, retry=True)
+        building_index = await asyncio.to_thread(BuildingIndex, rows)
+        local = await asyncio.to_thread(LocalGeocoder, rows)
+    building_index_version = version
+    geocoder.local = local
+    logging.info("Индекс домов загружен%s: %d домов, %d адресов, версия рейтинга %s",
+                 " из снимка" if snap is not None else "", len(building_index), len(geocoder.local), version)
+
+# Фоновое обновление индекса и кэша ответов после пересчёта building_ratings
+async def ratings_refresher():
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_INTERVAL)
+        try:
+            version = await fetch_ratings_version()
+            set_ratings_version(version)
+            if version != building_index_version:
+                await reload_building_index()
+        except Exception as e:
+            logging.warning("Не удалось обновить индекс домов: %s", e)
+
+# Графики рисуются в отдельных процессах (см. charts.py)
+chart_renderer = ChartRenderer()
+
+# Поля карточки, которые сравниваются (ключ, подпись)
+COMPARE_FIELDS = [
+    ("total_score", "Общий рейтинг"),
+    ("social_score", "Соц. оценка"),
+    ("quality_score", "Качество"),
+    ("transport_score", "Транспорт"),
+    ("build_year", "Год постройки"),
+    ("floors_number", "Этажей"),
+    ("square", "Площадь"),
+    ("apartments_number", "Квартир"),
+    ("living_area", "Жилая пл."),
+    ("not_living_area", "Нежилая пл.")
+]
+
+# Оценки на общем графике сравнения (одна шкала); остальные поля — по графику на поле
+COMPARE_SCORE_FIELDS = COMPARE_FIELDS[:4]
+
+# Сколько домов можно сравнить за раз, сколько фото в одном альбоме Telegram
+# и длина подписи к нему
+COMPARE_MAX = 5
+MEDIA_GROUP_SIZE = 10
+CAPTION_MAX = 1024
+
+def comparison_plot_job(results, names):
+    labels = [label for _, label in COMPARE_SCORE_FIELDS]
+    series = [[float(res.get(key, 0) or 0) for key, _ in COMPARE_SCORE_FIELDS] for res in results]
+    render = partial(render_series, figsize=(10, 5), rotation=45, ha='right', legend=False, label_len=20)
+    return (render, labels, series, names, "Сравнение домов по оценкам")
+
+# Итог сравнения для подписи альбома: оценки каждого дома и лучший дом
+def comparison_summary(names, results) -> str:
+    scores = [float(res['total_score']) for res in results]
+    best = [i + 1 for i, score in enumerate(scores) if score == max(scores)]
+    if len(best) == len(scores):
+        verdict = "➡ Рейтинги домов равны."
+    elif len(best) == 1:
+        verdict = f"➡ Лучше всех дом [{best[0]}]."
+    else:
+        verdict = "➡ Лучший рейтинг у домов " + ", ".join(f"[{i}]" for i in best) + "."
+
+    # Длинные адреса укорачиваются, чтобы подпись уложилась в CAPTION_MAX
+    name_len = 120
+    while True:
+        lines = ["Сравнение:"]
+        for i, (name, res) in enumerate(zip(names, results)):
+            short = name if len(name) <= name_len else name[:name_len - 1] + "…"
+            lines += [
+                f"[{i+1}] {short}",
+                f"  Рейтинг: {res['total_score']}; соц: {res['social_score']}, "
+                f"качество: {res['quality_score']}, транспорт: {res['transport_score']}",
+            ]
+        lines.append(verdict)
+        text = "\n".join(lines)
+        if len(text) <= CAPTION_MAX or name_len <= 20:
+            return text[:CAPTION_MAX]
+        name_len //= 2
+
+# Геокодинг адреса через Nominatim (с кэшем, см. geocoder.py)
+geocoder = Geocoder(GeocodeCache(path=GEOCODE_CACHE_PATH or None))
 
-def generate_comparison_plot(res1, res2, addr1, addr2):
-    categories = [
-        'total_score', 'social_score', 'quality_score', 'transport_score',
-        'build_year', 'floors_number', 'square', 'apartments_number',
-        'living_area', 'not_living_area'
-    ]
-    labels = [
-        'Общий рейтинг', 'Соц. оценка', 'Качество', 'Транспорт',
-        'Год постройки', 'Этажей', 'Площадь', 'Квартир',
-        'Жилая пл.', 'Нежилая пл.'
-    ]
-    vals1 = [float(res1.get(c, 0) or 0) for c in categories]
-    vals2 = [float(res2.get(c, 0) or 0) for c in categories]
-
-    x = np.arange(len(labels))
-    width = 0.35
-
-    plt.figure(figsize=(10, 5))
-    plt.bar(x - width/2, vals1, width, label=addr1[:20], color='skyblue')
-    plt.bar(x + width/2, vals2, width, label=addr2[:20], color='salmon')
-    plt.xticks(x, labels, rotation=45, ha='right')
-    plt.title("Сравнение домов по показателям")
-    plt.tight_layout()
-
-    fname = "house_comparison.png"
-    plt.savefig(fname)
-    plt.close()
-    return fname
-    
-# Геокодинг адреса через Nominatim
 async def geocode_address(addr: str):
-    url = f"https://nominatim.openstreetmap.org/search?format=json&q={addr}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers={"User-Agent": "GeoBot"}) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
-            if not data:
-                return None
-            lat = float(data[0]['lat'])
-            lon = float(data[0]['lon'])
-            return lat, lon
+    with span("geocode"):
+        return await geocoder.geocode(addr)
+
+metrics.register("db_pool", db_pool_stats)
+metrics.register("geocoder", geocoder.stats)
+metrics.register("nominatim_limiter", lambda: geocoder.limiter.stats)
+metrics.register("local_geocoder", lambda: geocoder.local.stats if geocoder.local is not None else {})
+metrics.register("charts", chart_renderer.stats)
+metrics.register("result_cache", lambda: dict(result_cache_stats, size=len(result_cache)))
+metrics.register("view_cache", view_cache_stats)
+metrics.register("throttle", throttle.stats)
+metrics.register("single_flight", shared.stats)
+metrics.register("card_cache", lambda: dict(card_cache_stats, size=len(card_cache)))
 
 # Основная клавиатура
 def main_menu_kb() -> ReplyKeyboardMarkup:
@@ -193,6 +549,7 @@ def main_menu_kb() -> ReplyKeyboardMarkup:
         [KeyboardButton(text="Отправить локацию", request_location=True)],
         [KeyboardButton(text="Сравнить дома"), KeyboardButton(text="Мои запросы")],
         [KeyboardButton(text="Топ-10"), KeyboardButton(text="Распределение")],
+        [KeyboardButton(text="Лучшие рядом"), KeyboardButton(text="Карта рейтинга")],
         [KeyboardButton(text="О рейтинге"), KeyboardButton(text="О нас")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
@@ -204,6 +561,7 @@ async def cmd_start(message: Message):
     await message.answer(
         "Привет! Я бот для оценки домов!\n"
         "Введи координаты `<lat>, <lon>, <radius>` или адрес `адрес: ...`,\n"
+        "пришли файл со списком координат или адресов (по одному в строке)\n"
         "или нажми кнопки ниже.",
         reply_markup=main_menu_kb()
     )
@@ -232,8 +590,9 @@ async def handle_location(message: Message):
     lon = loc.longitude
     radius = 1000  # Можно сделать настраиваемым
     user_id = message.from_user.id
-    add_user_query(user_id, lat, lon, radius, f"локация: {lat},{lon}, r={radius}")
-    await process_house_and_objects(message, lat, lon, radius)
+    res = await process_house_and_objects(message, lat, lon, radius)
+    await add_user_query(user_id, lat, lon, radius, f"локация: {lat},{lon}, r={radius}",
+                         res['building_id'] if res else None)
 
 
 @router.message(lambda msg: msg.text == "О рейтинге")
@@ -255,86 +614,256 @@ async def about_us(message: Message):
 @router.message(lambda msg: msg.text == "Мои запросы")
 async def my_requests_cmd(message: Message):
     user_id = message.from_user.id
-    hist = user_queries.get(user_id, [])
+    hist = await user_state.get_history(user_id)
     if not hist:
         await message.answer("История запросов пуста.")
         return
     lines = ["Ваши последние запросы:"]
-    for i, (lat, lon, r, addr) in enumerate(hist):
+    for i, (lat, lon, r, addr, *_) in enumerate(hist):
         lines.append(f"{i+1}. {addr}, r={r}")
     await message.answer("\n".join(lines))
 
-@router.message(lambda msg: msg.text == "Топ-10")
-async def top10_cmd(message: Message):
-    conn = get_db_connection()
+# Топ-10 из предрасчитанной таблицы (см. sql/rating_aggregates.sql)
+def _query_top10(conn):
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT b.building_id,
-               b.address,
-               ROUND(br.total_score::numeric,2) AS total_score
-        FROM building b
-        JOIN building_ratings br ON br.building_id = b.building_id
-        ORDER BY br.total_score DESC
-        LIMIT 10;
-    """)
+    try:
+        cur.execute("""
+            SELECT building_id, address, total_score
+            FROM rating_leaderboard
+            WHERE scope = 'city' AND scope_id = 0 AND direction = 'top' AND rank <= 10
+            ORDER BY rank;
+        """)
+    except UndefinedTable:
+        cur.execute("""
+            SELECT b.building_id,
+                   b.address,
+                   ROUND(br.total_score::numeric,2) AS total_score
+            FROM building b
+            JOIN building_ratings br ON br.building_id = b.building_id
+            ORDER BY br.total_score DESC
+            LIMIT 10;
+        """)
     rows = cur.fetchall()
     cur.close()
-    conn.close()
+    return rows
 
+# Гистограмма общего рейтинга с шагом DISTRIBUTION_BIN: [(начало интервала, домов)]
+def _query_total_histogram(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT bin_start, buildings
+            FROM rating_histogram
+            WHERE component = 'total' AND bin_width = %s
+            ORDER BY bin_start;
+        """, (DISTRIBUTION_BIN,))
+    except UndefinedTable:
+        cur.execute("""
+            SELECT LEAST(floor(total_score / %s)::int, 100 / %s - 1) * %s AS bin_start, COUNT(*)
+            FROM building_ratings
+            WHERE total_score BETWEEN 0 AND 100
+            GROUP BY 1
+            ORDER BY 1;
+        """, (DISTRIBUTION_BIN, DISTRIBUTION_BIN, DISTRIBUTION_BIN))
+    data = [(int(row[0]), int(row[1])) for row in cur.fetchall()]
+    cur.close()
+    return data
+
+def _digest(data) -> str:
+    return hashlib.sha1(repr(data).encode()).hexdigest()
+
+# Закэшированный ответ для текущей версии рейтинга или None
+def cached_view(name: str):
+    item = view_cache.get(name)
+    if item is not None and ratings_version is not None and item['version'] == ratings_version:
+        view_cache_stats["hits"] += 1
+        return item
+    view_cache_stats["misses"] += 1
+    return None
+
+# Сохранить ответ; если данные не изменились (тот же digest), отдаём прежний
+def store_view(name: str, version, digest: str, **payload):
+    item = view_cache.get(name)
+    if item is None or item['digest'] != digest:
+        item = dict(payload, digest=digest)
+    item['version'] = version
+    view_cache[name] = item
+    return item
+
+async def build_top10():
+    version = ratings_version
+    rows = await db_call(_query_top10, retry=True)
     if not rows:
-        await message.answer("Нет данных.")
-        return
+        return None
 
     lines = ["Топ-10 домов по рейтингу:"]
     for row in rows:
         lines.append(f"- {row['address']} => {row['total_score']}")
-    await message.answer("\n".join(lines))
+    text = "\n".join(lines)
+    return store_view('top10', version, _digest(text), text=text)
+
+@router.message(lambda msg: msg.text == "Топ-10")
+async def top10_cmd(message: Message):
+    item = cached_view('top10')
+    if item is None:
+        item = await shared.run('top10', build_top10)
+        if item is None:
+            await message.answer("Нет данных.")
+            return
+
+    await message.answer(item['text'])
+
+async def build_distribution():
+    version = ratings_version
+    data = await db_call(_query_total_histogram, retry=True)
+    if not data:
+        return None
+
+    digest = _digest(data)
+    prev = view_cache.get('distribution')
+    if prev is not None and prev['digest'] == digest:
+        return store_view('distribution', version, digest)
+    png = await chart_renderer.render(render_distribution, data, DISTRIBUTION_BIN)
+    return store_view('distribution', version, digest, png=png, file_id=None)
 
 @router.message(lambda msg: msg.text == "Распределение")
 async def distribution_cmd(message: Message):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT total_score FROM building_ratings;")
-    data = [float(row[0]) for row in cur.fetchall()]
-    cur.close()
-    conn.close()
+    item = cached_view('distribution')
+    if item is None:
+        item = await shared.run('distribution', build_distribution)
+        if item is None:
+            await message.answer("Нет данных.")
+            return
 
-    if not data:
-        await message.answer("Нет данных.")
+    # Уже загруженный в Telegram график отправляем по file_id
+    if item['file_id']:
+        try:
+            await message.answer_photo(photo=item['file_id'], caption="Распределение рейтингов")
+            return
+        except TelegramBadRequest:
+            item['file_id'] = None
+
+    photo = BufferedInputFile(item['png'], filename="distribution.png")
+    sent = await message.answer_photo(
+        photo=photo,
+        caption="Распределение рейтингов"
+    )
+    item['file_id'] = sent.photo[-1].file_id
+
+# Пакетная оценка: файл со строками «lat, lon» или адресами (см. bulk.py).
+# Подпись «json» — результат в JSON, иначе CSV.
+BULK_MAX_FILE_SIZE = 1024 * 1024
+bulk_jobs = asyncio.Semaphore(2)
+
+@router.message(lambda msg: msg.document is not None)
+async def bulk_cmd(message: Message):
+    doc = message.document
+    # Размер неизвестен — файл не принимается: проверить его до загрузки нечем
+    if doc.file_size is None or doc.file_size > BULK_MAX_FILE_SIZE:
+        await message.answer(f"Файл слишком большой (больше {BULK_MAX_FILE_SIZE // 1024} КБ).")
         return
+    fmt = 'json' if (message.caption or '').strip().lower() == 'json' else 'csv'
+    await message.answer("Обрабатываю файл...")
+
+    async with bulk_jobs:
+        # Загрузка пишется сразу во временный файл и читается из него построчно,
+        # результат — в другой временный файл: в памяти файл целиком не держится
+        src_fd, src_path = tempfile.mkstemp(suffix='.txt')
+        fd, path = tempfile.mkstemp(suffix='.' + fmt)
+        os.close(src_fd)
+        os.close(fd)
+        stats = BulkStats()
+        try:
+            await bot.download(doc, destination=src_path)
+            with open(src_path, encoding='utf-8-sig', errors='replace') as lines, \
+                    open(path, 'w', encoding='utf-8', newline='') as out:
+                await write_results(rate_many(lines, geocoder, building_index, stats=stats), out, fmt)
+            if not stats.rows:
+                await message.answer("В файле нет строк с координатами или адресами.")
+                return
+            await message.answer_document(FSInputFile(path, filename=f"ratings.{fmt}"), caption=stats.summary())
+        finally:
+            os.remove(src_path)
+            os.remove(path)
+
+# Лучшие дома рядом и тепловая карта (см. search.py)
+@router.message(lambda msg: msg.text == "Лучшие рядом")
+async def ask_search(message: Message):
+    await message.answer(
+        "Введите `лучшие: <lat>, <lon>[, радиус]` и, если нужно, условия:\n"
+        "`по=соц|качество|транспорт`, `год>=1990`, `год<=2010`, `этажи>=5`, `этажи<=12`,\n"
+        "`тип=<ID>`, `без аварийных`, `k=5`.\n"
+        f"Радиус по умолчанию {SEARCH_DEFAULT_RADIUS} м, не больше {SEARCH_MAX_RADIUS} м.",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+@router.message(lambda msg: msg.text == "Карта рейтинга")
+async def ask_heatmap(message: Message):
+    await message.answer(
+        "Введите `карта: <lat>, <lon>[, радиус]` и, если нужно, `по=соц|качество|транспорт`.\n"
+        f"Радиус по умолчанию {HEATMAP_DEFAULT_RADIUS} м, не больше {HEATMAP_MAX_RADIUS} м.",
+        parse_mode=ParseMode.MARKDOWN
+    )
 
-    plt.figure(figsize=(6,4))
-    plt.hist(data, bins=10, range=(0,100), color='skyblue', edgecolor='black')
-    plt.title("Распределение рейтингов")
-    plt.xlabel("Рейтинг")
-    plt.ylabel("Количество домов")
+@router.message(lambda msg: msg.text and msg.text.lower().startswith("лучшие:"))
+async def search_cmd(message: Message):
+    try:
+        query = parse_area_query(message.text, SEARCH_DEFAULT_RADIUS, SEARCH_MAX_RADIUS)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    rows = await top_near(building_index, query)
+    if not rows:
+        await message.answer("В этом радиусе подходящих домов нет.")
+        return
+    await message.answer(format_top(rows, query))
 
-    fname = "distribution.png"
-    plt.savefig(fname)
-    plt.close()
+async def build_heatmap(query):
+    origin, size, cells = await query_cells(query)
+    if not cells:
+        return None
+    score = query['score']
+    title = f"Медиана: {SCORE_LABELS[score]}, ячейка {size} м"
+    return await chart_renderer.render(
+        partial(render_heatmap, vmax=SCORE_MAX[score], label=SCORE_LABELS[score].capitalize()),
+        cells, size, origin, title
+    )
 
-    photo = FSInputFile(fname)
+@router.message(lambda msg: msg.text and msg.text.lower().startswith("карта:"))
+async def heatmap_cmd(message: Message):
+    try:
+        query = parse_area_query(message.text, HEATMAP_DEFAULT_RADIUS, HEATMAP_MAX_RADIUS)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    key = ('heatmap', query['lat'], query['lon'], query['radius'], query['score'])
+    try:
+        png = await shared.run(key, build_heatmap, query)
+    except UndefinedTable:
+        await message.answer("Карта рейтинга ещё не построена.")
+        return
+    if png is None:
+        await message.answer("Нет данных.")
+        return
     await message.answer_photo(
-        photo=photo,
-        caption="Распределение рейтингов"
+        photo=BufferedInputFile(png, filename="heatmap.png"),
+        caption=f"Карта рейтинга, радиус {int(query['radius'])} м"
     )
-    os.remove(fname)
 
 @router.message(lambda msg: msg.text == "Сравнить дома")
 async def compare_cmd(message: Message):
     user_id = message.from_user.id
-    hist = user_queries.get(user_id, [])
+    hist = await user_state.get_history(user_id)
     if not hist:
         await message.answer("История запросов пуста.")
         return
-    lines = ["Выберите первый дом (введите число):"]
-    for i, (lat, lon, r, addr) in enumerate(hist):
+    lines = [f"Выберите дома для сравнения (до {COMPARE_MAX}) — номера через пробел,"
+             " или один номер, чтобы выбрать второй дом следующим сообщением:"]
+    for i, (lat, lon, r, addr, *_) in enumerate(hist):
         lines.append(f"{i+1}. {addr}")
-    lines.append("Например, 1")
+    lines.append("Например, 1 3 или 1")
 
-    if not hasattr(dp, 'cache_data'):
-        dp.cache_data = {}
-    dp.cache_data[f"compare_state_{user_id}"] = 'choose_first'
+    await user_state.set_compare_state(user_id, 'choose_first')
     await message.answer("\n".join(lines))
 
 
@@ -343,24 +872,27 @@ async def universal_input(message: Message):
     user_id = message.from_user.id
     text = message.text.strip()
 
-    if not hasattr(dp, 'cache_data'):
-        dp.cache_data = {}
-    state = dp.cache_data.get(f"compare_state_{user_id}")
+    state = await user_state.get_compare_state(user_id)
 
     if state == 'choose_first':
-        try:
-            idx = int(text) - 1
-        except:
+        idxs = parse_indices(text)
+        if idxs is None:
             await message.answer("Неверный формат. Введите число.")
             return
-        hist = user_queries.get(user_id, [])
-        if idx < 0 or idx >= len(hist):
+        hist = await user_state.get_history(user_id)
+        if any(idx < 0 or idx >= len(hist) for idx in idxs):
             await message.answer("Нет такого индекса.")
             return
 
-        dp.cache_data[f"compare_state_{user_id}"] = ("first", idx)
+        if len(idxs) > 1:
+            await user_state.set_compare_state(user_id, None)
+            await compare_houses(message, [hist[idx] for idx in idxs])
+            return
+
+        idx = idxs[0]
+        await user_state.set_compare_state(user_id, ("first", idx))
         lines = ["Выберите второй дом:"]
-        for i, (la, lo, rr, ad) in enumerate(hist):
+        for i, (la, lo, rr, ad, *_) in enumerate(hist):
             if i != idx:
                 lines.append(f"{i+1}. {ad}")
         await message.answer("\n".join(lines))
@@ -368,105 +900,21 @@ async def universal_input(message: Message):
 
     elif isinstance(state, tuple) and state[0] == 'first':
         first_idx = state[1]
-        try:
-            idx2 = int(text) - 1
-        except:
+        idxs = parse_indices(text)
+        if idxs is None:
             await message.answer("Неверный формат. Введите число.")
             return
-        hist = user_queries.get(user_id, [])
-        if idx2 < 0 or idx2 >= len(hist) or idx2 == first_idx:
+        hist = await user_state.get_history(user_id)
+        if any(idx < 0 or idx >= len(hist) or idx == first_idx for idx in idxs):
             await message.answer("Нет такого индекса.")
             return
-
-        dp.cache_data[f"compare_state_{user_id}"] = None
-
-        (lat1, lon1, r1, addr1) = hist[first_idx]
-        (lat2, lon2, r2, addr2) = hist[idx2]
-        res1 = query_building_info(lat1, lon1, r1)
-        res2 = query_building_info(lat2, lon2, r2)
-        if not res1 or not res2:
-            await message.answer("Один из домов не найден.")
+        # Первый дом уже выбран — вместе с ним не больше COMPARE_MAX
+        if len(idxs) + 1 > COMPARE_MAX:
+            await message.answer(f"Можно сравнить до {COMPARE_MAX} домов: выберите не больше {COMPARE_MAX - 1}.")
             return
-        # Список параметров для сравнения (по ключам и подписям)
-        fields = [
-            ("total_score", "Общий рейтинг"),
-            ("social_score", "Соц. оценка"),
-            ("quality_score", "Качество"),
-            ("transport_score", "Транспорт"),
-            ("build_year", "Год постройки"),
-            ("floors_number", "Этажей"),
-            ("square", "Площадь"),
-            ("apartments_number", "Квартир"),
-            ("living_area", "Жилая пл."),
-            ("not_living_area", "Нежилая пл.")
-        ]
-
-        # Отправка текстового сравнения
-        lines = ["📊 *Сравнение домов по параметрам:*"]
-        for key, label in fields:
-            v1 = res1.get(key, 'нет данных')
-            v2 = res2.get(key, 'нет данных')
-            lines.append(f"- {label}: {v1} vs {v2}")
-        await message.answer("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
-
-        # Генерация и отправка графиков по каждому параметру
-        media = []
-        temp_files = []
-
-        for key, label in fields:
-            v1 = res1.get(key)
-            v2 = res2.get(key)
-            if v1 is None or v2 is None:
-                continue
-            try:
-                v1 = float(v1)
-                v2 = float(v2)
-            except:
-                continue
-
-            # Генерация графика
-            plt.figure(figsize=(4, 3))
-            plt.bar(["Дом 1", "Дом 2"], [v1, v2], color=["skyblue", "salmon"])
-            plt.title(label)
-            plt.tight_layout()
-            fname = f"compare_{key}.png"
-            plt.savefig(fname)
-            plt.close()
-            temp_files.append(fname)
-
-            media.append(InputMediaPhoto(media=FSInputFile(fname), caption=f"Сравнение по: {label}"))
-
-        # Отправка альбома
-        if media:
-            await message.answer_media_group(media)
-
-        # Удаление файлов
-        for fname in temp_files:
-            os.remove(fname)
-
-        fname = generate_comparison_plot(res1, res2, addr1, addr2)
-        photo = FSInputFile(fname)
-        await message.answer_photo(photo, caption="Сравнительная аналитика")
-        os.remove(fname)
-
-        lines = [
-            "Сравнение:",
-            f"[1] {addr1}",
-            f"  Рейтинг: {res1['total_score']}",
-            f"  Соц: {res1['social_score']}, Качество: {res1['quality_score']}, Транспорт: {res1['transport_score']}\n",
-            f"[2] {addr2}",
-            f"  Рейтинг: {res2['total_score']}",
-            f"  Соц: {res2['social_score']}, Качество: {res2['quality_score']}, Транспорт: {res2['transport_score']}"
-        ]
-        f1 = float(res1['total_score'])
-        f2 = float(res2['total_score'])
-        if f1 > f2:
-            lines.append("➡ Первый дом лучше.")
-        elif f1 < f2:
-            lines.append("➡ Второй дом лучше.")
-        else:
-            lines.append("➡ Рейтинги домов равны.")
-        await message.answer("\n".join(lines))
+
+        await user_state.set_compare_state(user_id, None)
+        await compare_houses(message, [hist[idx] for idx in [first_idx] + idxs])
         return
 
     if text.lower().startswith("адрес:"):
@@ -481,8 +929,9 @@ async def universal_input(message: Message):
             return
         lat, lon = geo
         r = 1000
-        add_user_query(user_id, lat, lon, r, f"адрес: {addr}")
-        await process_house_and_objects(message, lat, lon, r)
+        res = await process_house_and_objects(message, lat, lon, r)
+        await add_user_query(user_id, lat, lon, r, f"адрес: {addr}",
+                             res['building_id'] if res else None)
         return
 
     coords = re.split(r'\s*,\s*|\s+', text)
@@ -494,8 +943,9 @@ async def universal_input(message: Message):
             radius = 1000
             if len(coords) == 3:
                 radius = float(coords[2])
-            add_user_query(user_id, lat, lon, radius, f"coords: {lat},{lon}, r={radius}")
-            await process_house_and_objects(message, lat, lon, radius)
+            res = await process_house_and_objects(message, lat, lon, radius)
+            await add_user_query(user_id, lat, lon, radius, f"coords: {lat},{lon}, r={radius}",
+                                 res['building_id'] if res else None)
         except Exception as e:
             await message.answer("Неверный формат координат.")
     else:
@@ -504,120 +954,137 @@ async def universal_input(message: Message):
             "Чтобы начать заново, введите /start."
         )
 
-async def process_house_and_objects(message: Message, lat: float, lon: float, radius: float):
-    await message.answer("Ищу ближайший дом...")
-    res = query_building_info(lat, lon, radius)
-    if not res:
-        await message.answer("Дом не найден.")
+# Номера домов из истории: «1», «1 3», «1, 3, 4» -> индексы без повторов; None — не номера
+def parse_indices(text: str):
+    parts = [p for p in re.split(r'[\s,;]+', text) if p]
+    try:
+        idxs = [int(p) - 1 for p in parts]
+    except ValueError:
+        return None
+    idxs = list(dict.fromkeys(idxs))
+    if not idxs or len(idxs) > COMPARE_MAX:
+        return None
+    return idxs
+
+# Сравнение нескольких домов из истории: дома одним запросом, графики
+# параллельно в пуле, все графики — одним альбомом с итогом в подписи
+async def compare_houses(message: Message, entries):
+    names = [entry[3] for entry in entries]
+    results = await query_history_entries(entries)
+    if not all(results):
+        await message.answer("Один из домов не найден.")
         return
 
-    dist = math.dist([lat, lon], [res['geom_lat'], res['geom_lon']]) * 111000
-    lines = [
-        f"🏠 *Дом:* {res['name']} (ID: {res['building_id']})",
-        f"⭐ *Рейтинг:* {res['total_score']} / 100",
-        "",
-        "🏗 *Характеристики:*",
-        f"- Год постройки: {res['build_year']}",
-        f"- Этажей: {res['floors_number']}",
-        f"- Аварийный: {'Да' if res['is_emergency'] else 'Нет'}",
-        f"- Общая площадь: {res.get('square', 'нет данных')}",
-        f"- Количество квартир: {res.get('apartments_number', 'нет данных')}",
-        f"- Тип здания (ID): {res.get('building_type_id', 'нет данных')}",
-        f"- Жилая площадь: {res.get('living_area', 'нет данных')}",
-        f"- Нежилая площадь: {res.get('not_living_area', 'нет данных')}",
-        f"- Культурное наследие: {'Да' if res.get('is_cultural_heritage') else 'Нет'}",
-        f"- Координаты в БД: {res.get('latitude', 'нет данных')}, {res.get('longitude', 'нет данных')}",
-        "",
-        "📊 *Оценки по категориям:*",
-        f"- Соц: {res['social_score']}",
-        f"- Качество: {res['quality_score']}",
-        f"- Транспорт: {res['transport_score']}",
-        "",
-        f"📍 Отклонение координат: {dist:.2f} м",
-        "",
-        f"Объекты в радиусе {int(radius)} м:"
-    ]
-    objs = res['objects']
-    if objs:
-        for o in objs:
-            lines.append(f"- {o['type']}: {o['name']}")
-    else:
-        lines.append("Объекты не найдены.")
-
+    # Отправка текстового сравнения
+    lines = ["📊 *Сравнение домов по параметрам:*"]
+    for key, label in COMPARE_FIELDS:
+        lines.append(f"- {label}: " + " vs ".join(str(res.get(key, 'нет данных')) for res in results))
     await message.answer("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
 
-def save_chart(categories, vals1, vals2, addr1, addr2, title, filename):
-    import numpy as np
-    x = np.arange(len(categories))
-    width = 0.35
-
-    fig, ax = plt.subplots(figsize=(6,4))
-    ax.bar(x - width/2, vals1, width, label=addr1[:10], color='skyblue')
-    ax.bar(x + width/2, vals2, width, label=addr2[:10], color='salmon')
-
-    ax.set_title(title)
-    ax.set_xticks(x)
-    ax.set_xticklabels(categories, rotation=25)
-    ax.legend()
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
-
-async def send_comparison_charts(message: Message, res1, res2, addr1, addr2):
-    charts = [
-        ("Рейтинг", ["Общий", "Соц", "Качество", "Транспорт"],
-         [res1['total_score'], res1['social_score'], res1['quality_score'], res1['transport_score']],
-         [res2['total_score'], res2['social_score'], res2['quality_score'], res2['transport_score']],
-         "chart_ratings.png"),
-
-        ("Характеристики", ["Год постройки", "Этажей"],
-         [res1['build_year'], res1['floors_number']],
-         [res2['build_year'], res2['floors_number']],
-         "chart_basic.png"),
-
-        ("Площади", ["Общая", "Жилая", "Нежилая"],
-         [res1.get('square') or 0, res1.get('living_area') or 0, res1.get('not_living_area') or 0],
-         [res2.get('square') or 0, res2.get('living_area') or 0, res2.get('not_living_area') or 0],
-         "chart_areas.png"),
-
-        ("Квартиры", ["Квартир"],
-         [res1.get('apartments_number') or 0],
-         [res2.get('apartments_number') or 0],
-         "chart_apts.png")
+    # Общий график оценок и графики по остальным параметрам
+    jobs = [comparison_plot_job(results, names)]
+    captions = [("house_comparison.png", comparison_summary(names, results))]
+    for key, label in COMPARE_FIELDS[len(COMPARE_SCORE_FIELDS):]:
+        try:
+            values = [float(res[key]) for res in results]
+        except (KeyError, TypeError, ValueError):
+            continue
+        jobs.append((render_values, label, values))
+        captions.append((f"compare_{key}.png", f"Сравнение по: {label}"))
+    jobs, captions = jobs[:MEDIA_GROUP_SIZE], captions[:MEDIA_GROUP_SIZE]
+
+    pngs = await chart_renderer.render_many(jobs)
+    media = [
+        InputMediaPhoto(media=BufferedInputFile(png, filename=fname), caption=caption)
+        for png, (fname, caption) in zip(pngs, captions)
     ]
+    await message.answer_media_group(media)
 
-    for title, labels, vals1, vals2, fname in charts:
-        save_chart(labels, vals1, vals2, addr1, addr2, f"Сравнение: {title}", fname)
-        photo = FSInputFile(fname)
-        await message.answer_photo(photo=photo, caption=f"{title}")
-        os.remove(fname)
-
-async def send_comparison_text(message: Message, res1, res2):
-    def format_pair(label, key):
-        v1 = res1.get(key, "нет данных")
-        v2 = res2.get(key, "нет данных")
-        return f"{label}: {v1} vs {v2}"
-
-    lines = [
-        "📊 *Сравнительная сводка:*",
-        format_pair("Общий рейтинг", "total_score"),
-        format_pair("Социальная оценка", "social_score"),
-        format_pair("Качество", "quality_score"),
-        format_pair("Транспорт", "transport_score"),
-        "",
-        format_pair("Год постройки", "build_year"),
-        format_pair("Этажей", "floors_number"),
-        format_pair("Площадь общая", "square"),
-        format_pair("Квартир", "apartments_number"),
-        format_pair("Жилая площадь", "living_area"),
-        format_pair("Нежилая площадь", "not_living_area")
-    ]
-    await message.answer("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+async def process_house_and_objects(message: Message, lat: float, lon: float, radius: float):
+    await message.answer("Ищу ближайший дом...")
+
+    # Быстрый путь: дом по индексу в памяти + готовая карточка
+    index = building_index
+    r_card = card_radius(radius)
+    if index is not None and r_card is not None:
+        with span("nearest.index"):
+            rec = index.nearest_record(lat, lon)
+        if not rec:
+            await message.answer("Дом не найден.")
+            return None
+        card = await get_card(rec['building_id'], r_card)
+        if card is not None:
+            text = render_card(*card, card_distance(lat, lon, rec))
+            await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+            return rec
+
+    res = await query_building_info(lat, lon, radius)
+    if not res:
+        await message.answer("Дом не найден.")
+        return None
+
+    text = render_card(card_head(res), card_objects(res['objects'], radius), card_distance(lat, lon, res))
+    await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+    return res
 
 # Запуск
 
+async def startup():
+    global metrics_runner, user_state
+    user_state = make_state_store(STATE_DB_PATH or None)
+    chart_renderer.start()
+    if METRICS_PORT:
+        port = METRICS_PORT + (webhook.worker_index or 0)
+        try:
+            metrics_runner = await start_metrics_server(METRICS_HOST, port)
+        except OSError as e:
+            logging.warning("Не удалось запустить сервер метрик на порту %s: %s", port, e)
+    if not await db_healthcheck():
+        logging.warning("База данных недоступна, запросы будут завершаться с ошибкой")
+    try:
+        await reload_building_index()
+    except Exception as e:
+        logging.warning("Индекс домов не загружен, поиск пойдёт через БД: %s", e)
+    return asyncio.create_task(ratings_refresher())
+
+async def shutdown(refresher):
+    refresher.cancel()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await geocoder.close()
+    chart_renderer.close()
+    user_state.close()
+    close_db_pool()
+
+async def handle_update(data: dict):
+    await dp.feed_update(bot, Update.model_validate(data, context={"bot": bot}))
+
+# Рабочий процесс webhook-режима (см. webhook.py). Лимит запросов к Nominatim
+# общий на бота, поэтому делится между процессами.
+async def webhook_worker(updates, workers: int):
+    geocoder.limiter = RateLimiter(NOMINATIM_RATE_PER_SEC / workers)
+    refresher = await startup()
+    try:
+        stats = await consume(updates, handle_update)
+        logging.info("Рабочий процесс остановлен: %s", stats)
+    finally:
+        await shutdown(refresher)
+        await bot.session.close()
+
 async def main():
-    await dp.start_polling(bot)
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+        await bot.session.close()
+        await run_webhook(webhook_worker, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+                          workers=WEBHOOK_WORKERS, secret_token=WEBHOOK_SECRET or None,
+                          worker_args=(WEBHOOK_WORKERS,))
+        return
+
+    refresher = await startup()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown(refresher)
 
 if __name__ == '__main__':
     asyncio.run(main())
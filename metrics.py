@@ -0,0 +1,166 @@
+import contextvars
+import json
+import logging
+import time
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Метрики и трассировка горячего пути бота.
+# span("stage") замеряет время участка (геокодинг, поиск дома, объекты,
+# графики, отправка в Telegram) и кладёт его в гистограмму этапа; хендлеры
+# замеряются middleware целиком. Счётчики других модулей (пул БД, кэши,
+# пул графиков) подключаются через register() и отдаются как gauge.
+# Всё публикуется в текстовом формате Prometheus на /metrics; по желанию
+# каждый замер пишется отдельной JSON-строкой в лог "metrics".
+
+METRICS_PREFIX = "estate_bot"
+
+# Границы корзин гистограмм, сек
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Идентификатор обновления, в рамках которого идёт замер (для структурного лога)
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+log = logging.getLogger("metrics")
+_log_spans = False
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # последняя — +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, ok: bool = True):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        if not ok:
+            self.errors += 1
+
+
+# Гистограммы: семейство ('stage' / 'handler') -> имя -> Histogram
+histograms = {"stage": {}, "handler": {}}
+
+# Внешние счётчики: префикс -> dict или функция, возвращающая dict
+_sources = {}
+
+
+def configure(log_spans: bool = False):
+    global _log_spans
+    _log_spans = log_spans
+
+
+def register(prefix: str, source):
+    _sources[prefix] = source
+
+
+def observe(family: str, name: str, seconds: float, ok: bool = True):
+    hist = histograms[family].get(name)
+    if hist is None:
+        hist = histograms[family][name] = Histogram()
+    hist.observe(seconds, ok)
+    if _log_spans:
+        log.info(json.dumps({
+            "trace": trace_id.get(), family: name, "ms": round(seconds * 1000, 2), "ok": ok,
+        }, ensure_ascii=False))
+
+
+class span:
+    # with span("geocode"): ...  или  async with span("geocode"): ...
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe("stage", self.name, time.perf_counter() - self.started, exc_type is None)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+# Время хендлеров целиком; вешается на router.message / router.callback_query
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        obj = data.get("handler")
+        name = getattr(getattr(obj, "callback", None), "__name__", "unknown")
+        update = data.get("event_update")
+        token = trace_id.set(getattr(update, "update_id", None))
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await handler(event, data)
+            ok = True
+            return result
+        finally:
+            observe("handler", name, time.perf_counter() - started, ok)
+            trace_id.reset(token)
+
+
+# Время запросов к Telegram Bot API по методам; вешается на bot.session.middleware
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+def _fmt(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+# Текст в формате Prometheus
+def render() -> str:
+    lines = []
+    for family, items in histograms.items():
+        metric = f"{METRICS_PREFIX}_{family}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for name, hist in sorted(items.items()):
+            cumulative = 0
+            for bound, count in zip(hist.buckets + (float("inf"),), hist.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{{family}="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{family}="{name}"}} {hist.sum!r}')
+            lines.append(f'{metric}_count{{{family}="{name}"}} {hist.count}')
+        errors = f"{METRICS_PREFIX}_{family}_errors_total"
+        lines.append(f"# TYPE {errors} counter")
+        for name, hist in sorted(items.items()):
+            lines.append(f'{errors}{{{family}="{name}"}} {hist.errors}')
+
+    for prefix, source in _sources.items():
+        values = source() if callable(source) else source
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = f"{METRICS_PREFIX}_{prefix}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request: web.Request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+# HTTP-сервер с /metrics; возвращает runner, чтобы остановить его при выходе
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
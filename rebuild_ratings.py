@@ -0,0 +1,308 @@
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from cards import BUILDING_COLUMNS, CARD_RADII, card_head, card_objects
+
+# Пересчёт building_ratings по компонентам (см. sql/building_ratings_pipeline.sql).
+#
+#   python rebuild_ratings.py --dsn "dbname=estate" --full --workers 8
+#   python rebuild_ratings.py --dsn "dbname=estate"          # только очередь dirty
+#   python rebuild_ratings.py --dsn "dbname=estate" --snapshot snapshot   # и обновить снимок
+#
+# Город делится на пространственные части (по geohash), каждая компонента
+# считается для всех частей параллельно в отдельных сессиях, затем итог
+# атомарно подменяет building_ratings (полный режим) или заменяет строки
+# изменённых домов (инкрементальный режим). После этого по новым оценкам
+# собираются карточки домов для бота (sql/building_cards.sql) — в
+# инкрементальном режиме ещё и для домов из очереди building_cards_dirty
+# (объекты рядом добавлены, перемещены или переименованы), и в одной
+# транзакции ставятся карточки, агрегаты и новая версия рейтинга. С --snapshot
+# затем выгружается колоночный снимок для быстрой загрузки бота (snapshot.py).
+
+COMPONENTS = ['edu', 'med', 'parks', 'transport', 'quality']
+
+# Индексы по оценкам (sql/spatial_indexes.sql), пересоздаются при полной перестройке
+SCORE_INDEXES = ['total_score', 'social_score', 'quality_score', 'transport_score']
+
+# Дом с оценками и всеми объектами до 2000 м — из него собираются карточки всех радиусов
+CARDS_QUERY = f"""
+    SELECT {BUILDING_COLUMNS},
+           (SELECT COALESCE(json_agg(json_build_object('type', a.type, 'name', a.name, 'dist', a.dist)
+                                     ORDER BY a.type, a.name), '[]'::json)
+            FROM building_amenities a
+            WHERE a.building_id = b.building_id) AS objects
+    FROM building b
+    JOIN building_ratings br ON br.building_id = b.building_id
+    WHERE b.building_id = ANY(%s);
+"""
+
+logging.basicConfig(level=logging.INFO)
+
+
+def connect(dsn: str):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+# Разбиение домов на пространственно компактные части
+def partition_all(conn, parts: int):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT array_agg(building_id)
+        FROM (
+            SELECT building_id, ntile(%s) OVER (ORDER BY ST_GeoHash(geom, 8)) AS part
+            FROM building
+        ) t
+        GROUP BY part;
+    """, (parts,))
+    chunks = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return chunks
+
+
+def partition_ids(ids, parts: int):
+    size = max(1, -(-len(ids) // parts))
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def dirty_ids(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT building_id FROM building_ratings_dirty ORDER BY building_id;")
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return ids
+
+
+# Дома, карточки которых устарели без изменения рейтинга (sql/building_cards.sql)
+def dirty_card_ids(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('building_cards_dirty') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        cur.close()
+        return []
+    cur.execute("SELECT building_id FROM building_cards_dirty ORDER BY building_id;")
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return ids
+
+
+# Посчитать компоненту для всех частей параллельно; вернуть время, сек
+def run_component(pool, conns, component: str, chunks):
+    # Части раздаются сессиям по кругу; одна сессия — один поток
+    per_conn = [chunks[i::len(conns)] for i in range(len(conns))]
+
+    def worker(i):
+        cur = conns[i].cursor()
+        for chunk in per_conn[i]:
+            cur.execute(f"SELECT ratings_stage_{component}(%s);", (chunk,))
+        cur.close()
+
+    started = time.monotonic()
+    list(pool.map(worker, range(len(conns))))
+    return time.monotonic() - started
+
+
+def swap_full(conn, started_at):
+    cur = conn.cursor()
+    cur.execute("BEGIN;")
+    cur.execute("DROP TABLE IF EXISTS building_ratings_next;")
+    cur.execute("""
+        CREATE TABLE building_ratings_next AS
+        SELECT * FROM ratings_combine(NULL);
+    """)
+    cur.execute("CREATE UNIQUE INDEX building_ratings_next_building_id_idx ON building_ratings_next (building_id);")
+    for column in SCORE_INDEXES:
+        cur.execute(f"CREATE INDEX building_ratings_next_{column}_idx "
+                    f"ON building_ratings_next ({column} DESC NULLS LAST);")
+    cur.execute("DROP TABLE IF EXISTS building_ratings;")
+    cur.execute("ALTER TABLE building_ratings_next RENAME TO building_ratings;")
+    cur.execute("ALTER INDEX building_ratings_next_building_id_idx RENAME TO building_ratings_building_id_idx;")
+    for column in SCORE_INDEXES:
+        cur.execute(f"ALTER INDEX building_ratings_next_{column}_idx RENAME TO building_ratings_{column}_idx;")
+    cur.execute("DELETE FROM building_ratings_dirty WHERE queued_at <= %s;", (started_at,))
+    cur.execute("COMMIT;")
+    cur.close()
+
+
+def apply_incremental(conn, ids, started_at):
+    cur = conn.cursor()
+    cur.execute("BEGIN;")
+    cur.execute("DELETE FROM building_ratings WHERE building_id = ANY(%s);", (ids,))
+    cur.execute("""
+        INSERT INTO building_ratings (building_id, social_score, quality_score, transport_score, total_score)
+        SELECT * FROM ratings_combine(%s);
+    """, (ids,))
+    # Дома, попавшие в очередь во время пересчёта, останутся до следующего запуска
+    cur.execute("DELETE FROM building_ratings_dirty WHERE building_id = ANY(%s) AND queued_at <= %s;",
+                (ids, started_at))
+    cur.execute("COMMIT;")
+    cur.close()
+
+
+def prepare_cards(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('building_cards') IS NOT NULL AND to_regclass('building_cards_dirty') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        cur.close()
+        logging.warning("Таблицы building_cards нет (sql/building_cards.sql), карточки не собираются")
+        return False
+    cur.execute("DROP TABLE IF EXISTS building_cards_next;")
+    cur.execute("CREATE TABLE building_cards_next (LIKE building_cards INCLUDING ALL);")
+    cur.close()
+    return True
+
+
+# Карточки домов всех частей -> building_cards_next, параллельно по сессиям; время, сек
+def build_cards(pool, conns, chunks):
+    per_conn = [chunks[i::len(conns)] for i in range(len(conns))]
+
+    def worker(i):
+        cur = conns[i].cursor(cursor_factory=RealDictCursor)
+        for chunk in per_conn[i]:
+            cur.execute(CARDS_QUERY, (chunk,))
+            rows = []
+            for house in cur.fetchall():
+                head = card_head(house)
+                for radius in CARD_RADII:
+                    objs = [o for o in house['objects'] if o['dist'] <= radius]
+                    rows.append((house['building_id'], radius, head, card_objects(objs, radius)))
+            execute_values(cur, "INSERT INTO building_cards_next (building_id, radius, head, objects) VALUES %s;",
+                           rows, page_size=1000)
+        cur.close()
+
+    started = time.monotonic()
+    list(pool.map(worker, range(len(conns))))
+    return time.monotonic() - started
+
+
+def install_cards(cur, ids, started_at):
+    if ids is None:
+        cur.execute("DROP TABLE building_cards;")
+        cur.execute("ALTER TABLE building_cards_next RENAME TO building_cards;")
+        cur.execute("ALTER INDEX building_cards_next_pkey RENAME TO building_cards_pkey;")
+        cur.execute("DELETE FROM building_cards_dirty WHERE queued_at <= %s;", (started_at,))
+    else:
+        cur.execute("DELETE FROM building_cards WHERE building_id = ANY(%s);", (ids,))
+        cur.execute("INSERT INTO building_cards SELECT * FROM building_cards_next;")
+        cur.execute("DROP TABLE building_cards_next;")
+        cur.execute("DELETE FROM building_cards_dirty WHERE building_id = ANY(%s) AND queued_at <= %s;",
+                    (ids, started_at))
+
+
+# Карточки (ids — изменённые дома, None — все), агрегаты и версия — одной транзакцией
+def finish_rebuild(conn, ids, cards: bool, started_at):
+    cur = conn.cursor()
+    cur.execute("BEGIN;")
+    if cards:
+        install_cards(cur, ids, started_at)
+    # Гистограммы и топы для бота (sql/rating_aggregates.sql). Без них версия
+    # всё равно обновляется, иначе бот не узнает о новом рейтинге.
+    cur.execute("SELECT to_regprocedure('refresh_rating_aggregates()') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT refresh_rating_aggregates();")
+    else:
+        logging.warning("Функции refresh_rating_aggregates нет (sql/rating_aggregates.sql), агрегаты не обновлены")
+    # Как в sql/building_ratings.sql — на случай базы, созданной до появления версии
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ratings_version (
+          id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+          built_at timestamptz NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("""
+        INSERT INTO ratings_version (id, built_at) VALUES (1, now())
+        ON CONFLICT (id) DO UPDATE SET built_at = EXCLUDED.built_at;
+    """)
+    cur.execute("COMMIT;")
+    cur.close()
+
+
+def rebuild(dsn: str, full: bool, workers: int, snapshot_path: str = None):
+    main_conn = connect(dsn)
+    cur = main_conn.cursor()
+    cur.execute("SELECT now();")
+    started_at = cur.fetchone()[0]
+
+    if full:
+        cur.execute("TRUNCATE building_ratings_stage;")
+        chunks = card_chunks = partition_all(main_conn, workers * 4)
+        total = sum(len(c) for c in chunks)
+        card_ids = None
+    else:
+        ids = dirty_ids(main_conn)
+        # Карточки: дома с новым рейтингом и дома с изменившимися объектами рядом
+        card_ids = sorted(set(ids) | set(dirty_card_ids(main_conn)))
+        if not card_ids:
+            logging.info("Очередь пересчёта пуста")
+            main_conn.close()
+            return {}
+        cur.execute("DELETE FROM building_ratings_stage WHERE building_id = ANY(%s);", (ids,))
+        chunks = partition_ids(ids, workers * 4) if ids else []
+        card_chunks = partition_ids(card_ids, workers * 4)
+        total = len(ids)
+    cur.close()
+
+    logging.info("Пересчёт %d домов (%s), карточек: %d, частей: %d, сессий: %d",
+                 total, "полный" if full else "инкрементальный",
+                 total if full else len(card_ids), len(card_chunks), workers)
+
+    timings = {}
+    conns = [connect(dsn) for _ in range(min(workers, len(card_chunks)))]
+    try:
+        with ThreadPoolExecutor(max_workers=len(conns)) as pool:
+            if chunks:
+                for component in COMPONENTS:
+                    timings[component] = run_component(pool, conns, component, chunks)
+                    logging.info("  %-10s %8.2f с", component, timings[component])
+
+                started = time.monotonic()
+                if full:
+                    swap_full(main_conn, started_at)
+                else:
+                    apply_incremental(main_conn, ids, started_at)
+                timings['swap'] = time.monotonic() - started
+                logging.info("  %-10s %8.2f с", 'swap', timings['swap'])
+
+            cards = prepare_cards(main_conn)
+            if cards:
+                timings['cards'] = build_cards(pool, conns, card_chunks)
+                logging.info("  %-10s %8.2f с", 'cards', timings['cards'])
+    finally:
+        for conn in conns:
+            conn.close()
+
+    started = time.monotonic()
+    finish_rebuild(main_conn, card_ids, cards, started_at)
+    timings['finish'] = time.monotonic() - started
+    logging.info("  %-10s %8.2f с", 'finish', timings['finish'])
+
+    if snapshot_path:
+        from snapshot import export
+
+        started = time.monotonic()
+        export(main_conn, snapshot_path)
+        timings['snapshot'] = time.monotonic() - started
+        logging.info("  %-10s %8.2f с", 'snapshot', timings['snapshot'])
+
+    main_conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--full", action="store_true", help="пересчитать все дома")
+    parser.add_argument("--workers", type=int, default=4, help="параллельных сессий")
+    parser.add_argument("--snapshot", help="каталог снимка для бота (snapshot.py)")
+    args = parser.parse_args()
+    rebuild(args.dsn, args.full, args.workers, args.snapshot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import re
+
+from psycopg2.extras import RealDictCursor
+
+from db import db_call
+from metrics import span
+
+# Поиск по области: «лучшие дома рядом» и тепловая карта рейтинга.
+#
+#   лучшие: 55.75, 37.62, 1500 по=транспорт год>=1990 этажи<=9 тип=2 без аварийных k=5
+#   карта: 55.75, 37.62, 3000 по=соц
+#
+# Лучшие дома ищутся по in-memory индексу (BuildingIndex.top_k), без индекса —
+# одним запросом к БД (ST_DWithin по building.geog, сортировка по оценке,
+# индексы из sql/spatial_indexes.sql). Тепловая карта читает готовые ячейки
+# rating_cells (sql/rating_aggregates.sql), которые считаются вместе с
+# остальными агрегатами после пересчёта рейтинга.
+
+SEARCH_DEFAULT_RADIUS = 1000
+SEARCH_MAX_RADIUS = 5000
+SEARCH_DEFAULT_K = 10
+SEARCH_MAX_K = 20
+
+HEATMAP_DEFAULT_RADIUS = 3000
+HEATMAP_MAX_RADIUS = 15000
+# Размер ячейки по радиусу карты: (радиус до, ячейка), м
+HEATMAP_CELL_SIZES = [(1500, 250), (5000, 500), (HEATMAP_MAX_RADIUS, 1000)]
+
+# Оценки, по которым можно искать: слово в запросе -> колонка
+SCORES = {
+    'общий': 'total_score', 'рейтинг': 'total_score', 'total': 'total_score',
+    'соц': 'social_score', 'социальный': 'social_score', 'social': 'social_score',
+    'качество': 'quality_score', 'quality': 'quality_score',
+    'транспорт': 'transport_score', 'transport': 'transport_score',
+}
+SCORE_LABELS = {
+    'total_score': "общий рейтинг", 'social_score': "соц. оценка",
+    'quality_score': "качество", 'transport_score': "транспорт",
+}
+# Максимум каждой оценки (как в sql/rating_aggregates.sql)
+SCORE_MAX = {'total_score': 100, 'social_score': 30, 'quality_score': 30, 'transport_score': 40}
+
+# Фильтр в запросе -> (ключ в filters, колонка, оператор SQL)
+_FILTERS = {
+    ('год', '>='): ('min_year', 'b.build_year', '>='),
+    ('год', '<='): ('max_year', 'b.build_year', '<='),
+    ('этажи', '>='): ('min_floors', 'b.floors_number', '>='),
+    ('этажи', '<='): ('max_floors', 'b.floors_number', '<='),
+    ('тип', '='): ('building_type', 'b.building_type_id', '='),
+}
+
+_OPTION_RE = re.compile(r'\b(по|k|год|этажи|тип)\s*(>=|<=|=)\s*([\w.]+)', re.IGNORECASE)
+_NO_EMERGENCY_RE = re.compile(r'без\s+аварийных', re.IGNORECASE)
+
+TOP_NEAR_QUERY = """
+SELECT b.building_id,
+       b.address AS name,
+       ROUND(br.total_score::numeric,2) AS total_score,
+       ROUND(br.social_score::numeric,2) AS social_score,
+       ROUND(br.quality_score::numeric,2) AS quality_score,
+       ROUND(br.transport_score::numeric,2) AS transport_score,
+       b.build_year,
+       b.floors_number,
+       b.is_emergency,
+       b.building_type_id,
+       ST_Distance(b.geog, q.geog) AS dist
+FROM (SELECT ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s),4326)::geography AS geog) q
+JOIN building b ON ST_DWithin(b.geog, q.geog, %(radius)s)
+JOIN building_ratings br ON br.building_id = b.building_id
+WHERE br.{score} IS NOT NULL{filters}
+ORDER BY br.{score} DESC, dist
+LIMIT %(k)s;
+"""
+
+# Точка запроса в метрах сетки rating_cells
+ORIGIN_QUERY = """
+SELECT ST_X(p.xy), ST_Y(p.xy)
+FROM (SELECT ST_Transform(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s),4326), 32637) AS xy) p;
+"""
+
+CELLS_QUERY = """
+SELECT cx, cy, {prefix}_p50
+FROM rating_cells
+WHERE cell_size = %(size)s
+  AND cx BETWEEN floor((%(qx)s - %(radius)s) / %(size)s) AND floor((%(qx)s + %(radius)s) / %(size)s)
+  AND cy BETWEEN floor((%(qy)s - %(radius)s) / %(size)s) AND floor((%(qy)s + %(radius)s) / %(size)s);
+"""
+
+
+# «лучшие: lat, lon[, радиус] [опции]» / «карта: ...» -> параметры поиска.
+# Ошибки формата — ValueError с текстом для пользователя.
+def parse_area_query(text: str, default_radius: float, max_radius: float):
+    body = text.split(':', 1)[1] if ':' in text else ''
+    query = {'score': 'total_score', 'k': SEARCH_DEFAULT_K, 'filters': {}}
+
+    if _NO_EMERGENCY_RE.search(body):
+        query['filters']['no_emergency'] = True
+        body = _NO_EMERGENCY_RE.sub(' ', body)
+
+    for name, op, value in _OPTION_RE.findall(body):
+        name = name.lower()
+        if name == 'по':
+            if value.lower() not in SCORES:
+                raise ValueError("Неизвестная оценка: " + value + ". Можно: общий, соц, качество, транспорт.")
+            query['score'] = SCORES[value.lower()]
+        elif name == 'k':
+            if not value.isdigit() or not 1 <= int(value) <= SEARCH_MAX_K:
+                raise ValueError(f"k — число от 1 до {SEARCH_MAX_K}.")
+            query['k'] = int(value)
+        elif (name, op) in _FILTERS:
+            if not value.isdigit():
+                raise ValueError(f"Неверное значение фильтра: {name}{op}{value}.")
+            query['filters'][_FILTERS[name, op][0]] = int(value)
+        else:
+            raise ValueError(f"Неизвестный фильтр: {name}{op}{value}.")
+    body = _OPTION_RE.sub(' ', body)
+
+    parts = [p for p in re.split(r'[\s,;]+', body) if p]
+    try:
+        numbers = [float(p) for p in parts]
+    except ValueError:
+        raise ValueError("Неверный формат координат.")
+    if len(numbers) not in (2, 3):
+        raise ValueError("Неверный формат координат.")
+    query['lat'], query['lon'] = numbers[0], numbers[1]
+    query['radius'] = numbers[2] if len(numbers) == 3 else default_radius
+    if not 0 < query['radius'] <= max_radius:
+        raise ValueError(f"Радиус — от 1 до {max_radius} м.")
+    return query
+
+
+def _query_top_near(conn, lat: float, lon: float, radius: float, k: int, score: str, filters: dict):
+    conditions = []
+    params = {'lat': lat, 'lon': lon, 'radius': radius, 'k': k}
+    for key, column, op in _FILTERS.values():
+        if filters.get(key) is not None:
+            conditions.append(f" AND {column} {op} %({key})s")
+            params[key] = filters[key]
+    if filters.get('no_emergency'):
+        conditions.append(" AND b.is_emergency IS NOT TRUE")
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(TOP_NEAR_QUERY.format(score=score, filters="".join(conditions)), params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+# Лучшие дома в радиусе: по индексу, если он загружен, иначе из БД
+async def top_near(index, query):
+    args = (query['lat'], query['lon'], query['radius'], query['k'], query['score'], query['filters'])
+    if index is not None:
+        with span("search.index"):
+            return index.top_k(*args)
+    return await db_call(_query_top_near, *args, retry=True)
+
+
+def format_top(rows, query) -> str:
+    score = query['score']
+    lines = [f"Лучшие дома в радиусе {int(query['radius'])} м по оценке «{SCORE_LABELS[score]}»:"]
+    for i, row in enumerate(rows, 1):
+        details = [f"{int(row['dist'])} м"]
+        if row.get('build_year'):
+            details.append(f"{row['build_year']} г.")
+        if row.get('floors_number'):
+            details.append(f"{row['floors_number']} эт.")
+        lines.append(f"{i}. {row['name']} — {row[score]} ({', '.join(details)})")
+    return "\n".join(lines)
+
+
+def cell_size_for(radius: float) -> int:
+    return next(size for limit, size in HEATMAP_CELL_SIZES if radius <= limit)
+
+
+# Ячейки тепловой карты вокруг точки: (origin, cell_size, [(cx, cy, медиана оценки), ...])
+def _query_cells(conn, lat: float, lon: float, radius: float, score: str):
+    size = cell_size_for(radius)
+    cur = conn.cursor()
+    cur.execute(ORIGIN_QUERY, {'lat': lat, 'lon': lon})
+    qx, qy = cur.fetchone()
+    cur.execute(CELLS_QUERY.format(prefix=score[:-len('_score')]),
+                {'size': size, 'qx': qx, 'qy': qy, 'radius': radius})
+    cells = [row for row in cur.fetchall() if row[2] is not None]
+    cur.close()
+    return (qx, qy), size, cells
+
+
+async def query_cells(query):
+    return await db_call(_query_cells, query['lat'], query['lon'], query['radius'], query['score'], retry=True)
@@ -0,0 +1,307 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+
+import numpy as np
+
+# Колоночный снимок домов, оценок и объектов инфраструктуры для быстрой
+# загрузки без построчного чтения через RealDictCursor.
+# Выгрузка идёт через COPY в одной транзакции REPEATABLE READ вместе с версией
+# рейтинга; каждая колонка пишется отдельным .npy-файлом, строки — тройкой
+# <колонка>.data.npy (байты UTF-8 подряд) + <колонка>.offsets.npy +
+# <колонка>.null.npy (маска NULL).
+# Загрузка открывает файлы через mmap без копирования: массивы координат и
+# оценок сразу идут в BuildingIndex.from_snapshot, записи домов собираются
+# по одной при обращении в том же виде, что и строки запроса из БД. Объекты
+# инфраструктуры (с вместимостью парковок) нужны для расчёта рейтинга без БД:
+# rating_engine.load_from_snapshot.
+#
+#   python snapshot.py export --dsn "dbname=estate" -o snapshot
+#   python snapshot.py info snapshot
+#
+# Бот берёт индекс из снимка, если задан SNAPSHOT_PATH и версия снимка совпадает
+# с ratings_version; rebuild_ratings.py --snapshot обновляет снимок после пересчёта.
+
+SNAPSHOT_FORMAT = 2
+NULL = r'\N'
+
+# Колонки домов: (имя, вид, выражение SQL). Виды:
+#   id    — int64;  float — float64, NULL -> NaN;  int — float64 с NaN, в записи int;
+#   score — float64 с NaN, в записи Decimal с двумя знаками (как ROUND(::numeric,2));
+#   bool  — int8: -1 NULL / 0 / 1;  str — строка
+BUILDING_FIELDS = [
+    ('building_id', 'id', 'b.building_id'),
+    ('name', 'str', 'b.address'),
+    ('total_score', 'score', 'ROUND(br.total_score::numeric,2)'),
+    ('social_score', 'score', 'ROUND(br.social_score::numeric,2)'),
+    ('quality_score', 'score', 'ROUND(br.quality_score::numeric,2)'),
+    ('transport_score', 'score', 'ROUND(br.transport_score::numeric,2)'),
+    ('build_year', 'int', 'b.build_year'),
+    ('floors_number', 'int', 'b.floors_number'),
+    ('is_emergency', 'bool', 'b.is_emergency'),
+    ('square', 'float', 'b.square'),
+    ('apartments_number', 'int', 'b.apartments_number'),
+    ('building_type_id', 'int', 'b.building_type_id'),
+    ('living_area', 'float', 'b.living_area'),
+    ('not_living_area', 'float', 'b.not_living_area'),
+    ('is_cultural_heritage', 'bool', 'b.is_cultural_heritage'),
+    ('latitude', 'float', 'b.latitude'),
+    ('longitude', 'float', 'b.longitude'),
+    ('geom_lon', 'float', 'ST_X(b.geom)'),
+    ('geom_lat', 'float', 'ST_Y(b.geom)'),
+]
+
+# Объекты инфраструктуры: (таблица, подпись, ключ, название, вместимость)
+AMENITY_SOURCES = [
+    ('school', 'Школа', 'school_id', 'name', 'NULL'),
+    ('kindergarten', 'Детский сад', 'kindergarten_id', 'name', 'NULL'),
+    ('hospital', 'Больница', 'hospital_id', 'name', 'NULL'),
+    ('park', 'Парк', 'park_id', 'name', 'NULL'),
+    ('metro', 'Метро', 'metro_id', 'name', 'NULL'),
+    ('public_transport_stop', 'Остановка', 'stop_id', 'name', 'NULL'),
+    ('parking', 'Парковка', 'parking_id', 'NULL', 'car_capacity'),
+]
+AMENITY_FIELDS = [
+    ('kind', 'kind', None),
+    ('amenity_id', 'id', None),
+    ('lat', 'float', None),
+    ('lon', 'float', None),
+    ('name', 'str', None),
+    ('car_capacity', 'float', None),
+]
+
+BUILDINGS_QUERY = (
+    "SELECT " + ", ".join(sql for _, _, sql in BUILDING_FIELDS) +
+    " FROM building b JOIN building_ratings br ON br.building_id = b.building_id"
+    " ORDER BY b.building_id"
+)
+
+AMENITIES_QUERY = " UNION ALL ".join(
+    f"SELECT {kind}, {key}, ST_Y(geog::geometry), ST_X(geog::geometry), {name}, {capacity}"
+    f" FROM {table} WHERE geog IS NOT NULL"
+    for kind, (table, _, key, name, capacity) in enumerate(AMENITY_SOURCES)
+)
+
+
+# COPY запроса во временный CSV-файл; возвращает путь
+def _copy_csv(cur, query: str, directory: str) -> str:
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, NULL '{NULL}')", f)
+    return path
+
+
+def _convert(kind: str, values):
+    if kind in ('id', 'kind'):
+        return np.array([int(v) for v in values], dtype=np.int64 if kind == 'id' else np.int8)
+    if kind in ('float', 'int', 'score'):
+        return np.array([math.nan if v == NULL else float(v) for v in values], dtype=np.float64)
+    if kind == 'bool':
+        return np.array([-1 if v == NULL else int(v == 't') for v in values], dtype=np.int8)
+    raise ValueError(kind)
+
+
+def _write_strings(directory: str, name: str, values):
+    nulls = np.array([v == NULL for v in values], dtype=bool)
+    encoded = [b'' if null else v.encode('utf-8') for v, null in zip(values, nulls)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, f"{name}.data.npy"), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{name}.null.npy"), nulls)
+
+
+# CSV -> колонки .npy в directory; возвращает число строк
+def _write_table(csv_path: str, fields, directory: str) -> int:
+    os.makedirs(directory)
+    columns = [[] for _ in fields]
+    with open(csv_path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            for column, value in zip(columns, row):
+                column.append(value)
+    for (name, kind, _), values in zip(fields, columns):
+        if kind == 'str':
+            _write_strings(directory, name, values)
+        else:
+            np.save(os.path.join(directory, f"{name}.npy"), _convert(kind, values))
+    return len(columns[0])
+
+
+# Выгрузка снимка в каталог path. Новый снимок собирается рядом и подменяет
+# старый переименованием; процессы, уже открывшие старый, читают его до конца.
+def export(conn, path: str) -> dict:
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    tmp = tempfile.mkdtemp(prefix='.snapshot-', dir=parent)
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+        cur.execute("SELECT built_at FROM ratings_version WHERE id = 1;")
+        row = cur.fetchone()
+        buildings_csv = _copy_csv(cur, BUILDINGS_QUERY, tmp)
+        amenities_csv = _copy_csv(cur, AMENITIES_QUERY, tmp)
+        cur.execute("COMMIT;")
+        cur.close()
+
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'version': str(row[0]) if row else None,
+            'created_at': time.time(),
+            'buildings': _write_table(buildings_csv, BUILDING_FIELDS, os.path.join(tmp, 'buildings')),
+            'amenities': _write_table(amenities_csv, AMENITY_FIELDS, os.path.join(tmp, 'amenities')),
+            'building_fields': [[name, kind] for name, kind, _ in BUILDING_FIELDS],
+            'amenity_kinds': [table for table, *_ in AMENITY_SOURCES],
+            'amenity_types': [label for _, label, *_ in AMENITY_SOURCES],
+        }
+        os.remove(buildings_csv)
+        os.remove(amenities_csv)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        old = None
+        if os.path.exists(path):
+            old = tempfile.mkdtemp(prefix='.snapshot-old-', dir=parent)
+            os.replace(path, os.path.join(old, 'snapshot'))
+        os.replace(tmp, path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+        return meta
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+class StringColumn:
+    def __init__(self, data, offsets, nulls):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Строка или None для NULL
+    def __getitem__(self, i: int):
+        if self.nulls[i]:
+            return None
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+
+def _load_table(directory: str, fields, mmap_mode):
+    columns = {}
+    for name, kind in fields:
+        if kind == 'str':
+            columns[name] = StringColumn(
+                np.load(os.path.join(directory, f"{name}.data.npy"), mmap_mode=mmap_mode),
+                np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode=mmap_mode),
+                np.load(os.path.join(directory, f"{name}.null.npy"), mmap_mode=mmap_mode),
+            )
+        else:
+            columns[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+    return columns
+
+
+def _value(kind: str, column, i: int):
+    v = column[i]
+    if kind == 'str':
+        return v
+    if kind == 'id':
+        return int(v)
+    if kind == 'bool':
+        return None if v < 0 else bool(v)
+    if math.isnan(v):
+        return None
+    if kind == 'int':
+        return int(v)
+    if kind == 'score':
+        return Decimal(f"{v:.2f}")
+    return float(v)
+
+
+# Загруженный снимок; как последовательность — записи домов (dict)
+class Snapshot:
+    def __init__(self, path: str, mmap: bool = True):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат снимка: {self.meta.get('format')}")
+        mmap_mode = 'r' if mmap else None
+        self.fields = [tuple(f) for f in self.meta['building_fields']]
+        self.buildings = _load_table(os.path.join(path, 'buildings'), self.fields, mmap_mode)
+        self.amenities = _load_table(os.path.join(path, 'amenities'),
+                                     [(name, kind) for name, kind, _ in AMENITY_FIELDS], mmap_mode)
+        self.amenity_kinds = self.meta['amenity_kinds']
+        self.amenity_types = self.meta['amenity_types']
+
+    @property
+    def version(self):
+        return self.meta['version']
+
+    def __len__(self):
+        return self.meta['buildings']
+
+    def __getitem__(self, i: int) -> dict:
+        return {name: _value(kind, self.buildings[name], i) for name, kind in self.fields}
+
+
+# Снимок из path, если он есть и его версия совпадает с version; иначе None
+def load_snapshot(path: str, version=None):
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        logging.info("Снимка %s нет", path)
+        return None
+    try:
+        snap = Snapshot(path)
+    except ValueError as e:
+        logging.info("Снимок %s не подходит: %s", path, e)
+        return None
+    if version is not None and snap.version != str(version):
+        logging.info("Снимок %s устарел: версия %s, рейтинг %s", path, snap.version, version)
+        return None
+    return snap
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Колоночный снимок домов и оценок")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_export = sub.add_parser('export', help="выгрузить снимок из БД")
+    p_export.add_argument('--dsn', required=True)
+    p_export.add_argument('-o', '--output', default='snapshot')
+    p_info = sub.add_parser('info', help="загрузить снимок и показать время загрузки")
+    p_info.add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'export':
+        import psycopg2
+
+        conn = psycopg2.connect(args.dsn)
+        conn.autocommit = True
+        started = time.perf_counter()
+        try:
+            meta = export(conn, args.output)
+        finally:
+            conn.close()
+        logging.info("Снимок %s: %d домов, %d объектов, версия %s, %.1f с", args.output,
+                     meta['buildings'], meta['amenities'], meta['version'], time.perf_counter() - started)
+    else:
+        from spatial_index import BuildingIndex
+
+        started = time.perf_counter()
+        snap = Snapshot(args.path)
+        loaded = time.perf_counter()
+        index = BuildingIndex.from_snapshot(snap)
+        built = time.perf_counter()
+        print(f"version={snap.version} buildings={len(snap)} amenities={snap.meta['amenities']}")
+        print(f"load {1000 * (loaded - started):.1f} ms, index {1000 * (built - loaded):.1f} ms, "
+              f"total {1000 * (built - started):.1f} ms ({len(index)} домов)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import math
+
+import numpy as np
+
+# In-memory индекс домов для поиска ближайшего дома без запроса к БД.
+# Координаты переводятся в локальную равнопромежуточную проекцию (метры),
+# дома раскладываются по квадратной сетке, ячейки хранятся в CSR-виде:
+# отсортированный массив ключей ячеек + смещения в массиве индексов домов.
+# Индекс строится из записей (строки запроса из БД) или без копирования из
+# колонок снимка (from_snapshot, см. snapshot.py).
+
+CELL_SIZE_M = 250
+M_PER_DEG_LAT = 110574.0
+M_PER_DEG_LON_EQUATOR = 111320.0
+
+
+class BuildingIndex:
+    def __init__(self, records, cell_size: float = CELL_SIZE_M):
+        # records: список dict с ключами geom_lat/geom_lon + любые атрибуты дома
+        self.records = list(records)
+        self.cell_size = cell_size
+        n = len(self.records)
+
+        self.building_ids = np.fromiter((r['building_id'] for r in self.records), dtype=np.int64, count=n)
+        self.lat = np.fromiter((float(r['geom_lat']) for r in self.records), dtype=np.float64, count=n)
+        self.lon = np.fromiter((float(r['geom_lon']) for r in self.records), dtype=np.float64, count=n)
+        self.scores = {
+            key: np.fromiter((float(r.get(key) or 0) for r in self.records), dtype=np.float32, count=n)
+            for key in ('total_score', 'social_score', 'quality_score', 'transport_score')
+        }
+        # Атрибуты для фильтров поиска; нет данных — NaN / -1
+        self.attrs = {
+            key: np.fromiter((float(r[key]) if r.get(key) is not None else np.nan for r in self.records),
+                             dtype=np.float64, count=n)
+            for key in ('build_year', 'floors_number')
+        }
+        self.attrs['building_type_id'] = np.fromiter(
+            (r.get('building_type_id') if r.get('building_type_id') is not None else -1 for r in self.records),
+            dtype=np.int64, count=n)
+        self.attrs['is_emergency'] = np.fromiter((bool(r.get('is_emergency')) for r in self.records),
+                                                 dtype=bool, count=n)
+        self._build(cell_size)
+
+    # Индекс по колонкам снимка; записи домов собираются из снимка при обращении
+    @classmethod
+    def from_snapshot(cls, snapshot, cell_size: float = CELL_SIZE_M):
+        b = snapshot.buildings
+        index = cls.__new__(cls)
+        index.records = snapshot
+        index.cell_size = cell_size
+        index.building_ids = b['building_id']
+        index.lat = b['geom_lat']
+        index.lon = b['geom_lon']
+        index.scores = {
+            key: np.nan_to_num(b[key], nan=0.0)
+            for key in ('total_score', 'social_score', 'quality_score', 'transport_score')
+        }
+        index.attrs = {
+            'build_year': b['build_year'],
+            'floors_number': b['floors_number'],
+            'building_type_id': np.nan_to_num(b['building_type_id'], nan=-1).astype(np.int64),
+            'is_emergency': b['is_emergency'] == 1,
+        }
+        index._build(cell_size)
+        return index
+
+    def _build(self, cell_size: float):
+        n = len(self.building_ids)
+        if n == 0:
+            return
+
+        self.lat0 = float(self.lat.mean())
+        self.lon0 = float(self.lon.mean())
+        self.kx = M_PER_DEG_LON_EQUATOR * math.cos(math.radians(self.lat0))
+        self.ky = M_PER_DEG_LAT
+        self.x, self.y = self.project(self.lat, self.lon)
+
+        self.x_min = float(self.x.min())
+        self.y_min = float(self.y.min())
+        cx = ((self.x - self.x_min) // cell_size).astype(np.int64)
+        cy = ((self.y - self.y_min) // cell_size).astype(np.int64)
+        self.nx = int(cx.max()) + 1
+        self.ny = int(cy.max()) + 1
+
+        keys = cx * self.ny + cy
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.cell_starts = np.unique(keys[self.order], return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], n)
+
+    def __len__(self):
+        return len(self.records)
+
+    def project(self, lat, lon):
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    def _cell_members(self, cx: int, cy: int):
+        if cx < 0 or cy < 0 or cx >= self.nx or cy >= self.ny:
+            return None
+        key = cx * self.ny + cy
+        pos = np.searchsorted(self.cell_keys, key)
+        if pos >= len(self.cell_keys) or self.cell_keys[pos] != key:
+            return None
+        return self.order[self.cell_starts[pos]:self.cell_ends[pos]]
+
+    def _ring(self, cx: int, cy: int, r: int):
+        if r == 0:
+            return [(cx, cy)]
+        cells = []
+        for dx in range(-r, r + 1):
+            cells.append((cx + dx, cy - r))
+            cells.append((cx + dx, cy + r))
+        for dy in range(-r + 1, r):
+            cells.append((cx - r, cy + dy))
+            cells.append((cx + r, cy + dy))
+        return cells
+
+    # Ближайший дом: (позиция в индексе, расстояние в метрах)
+    def nearest(self, lat: float, lon: float):
+        if not self.records:
+            return None
+        qx, qy = self.project(lat, lon)
+        cx = int((qx - self.x_min) // self.cell_size)
+        cy = int((qy - self.y_min) // self.cell_size)
+
+        # Точка вне сетки — простой перебор (он всё равно векторный)
+        if cx < 0 or cy < 0 or cx >= self.nx or cy >= self.ny:
+            d = np.hypot(self.x - qx, self.y - qy)
+            i = int(d.argmin())
+            return i, float(d[i])
+
+        best_i, best_d = -1, math.inf
+        max_r = max(self.nx, self.ny)
+        for r in range(max_r + 1):
+            members = [m for m in (self._cell_members(x, y) for x, y in self._ring(cx, cy, r)) if m is not None]
+            if members:
+                idx = np.concatenate(members)
+                d = np.hypot(self.x[idx] - qx, self.y[idx] - qy)
+                j = int(d.argmin())
+                if d[j] < best_d:
+                    best_i, best_d = int(idx[j]), float(d[j])
+            # Все дома за пределами колец 0..r дальше, чем r * cell_size
+            if best_d <= r * self.cell_size:
+                break
+        return best_i, best_d
+
+    # Запись о ближайшем доме в том же формате, что и запрос к БД
+    def nearest_record(self, lat: float, lon: float):
+        found = self.nearest(lat, lon)
+        if found is None:
+            return None
+        i, dist = found
+        rec = dict(self.records[i])
+        rec['dist'] = dist
+        return rec
+
+    # Все дома в радиусе: (позиции в индексе, расстояния в метрах)
+    def within(self, lat: float, lon: float, radius: float):
+        if not self.records:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        qx, qy = self.project(lat, lon)
+        x0 = max(0, int((qx - radius - self.x_min) // self.cell_size))
+        x1 = min(self.nx - 1, int((qx + radius - self.x_min) // self.cell_size))
+        y0 = max(0, int((qy - radius - self.y_min) // self.cell_size))
+        y1 = min(self.ny - 1, int((qy + radius - self.y_min) // self.cell_size))
+        members = [m for m in (self._cell_members(x, y)
+                               for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)) if m is not None]
+        if not members:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        idx = np.concatenate(members)
+        d = np.hypot(self.x[idx] - qx, self.y[idx] - qy)
+        inside = d <= radius
+        return idx[inside], d[inside]
+
+    # Лучшие k домов в радиусе по оценке score с фильтрами (см. search.py):
+    # записи с полем dist, по убыванию оценки
+    def top_k(self, lat: float, lon: float, radius: float, k: int = 10,
+              score: str = 'total_score', filters: dict = None):
+        idx, d = self.within(lat, lon, radius)
+        filters = filters or {}
+        mask = np.ones(len(idx), dtype=bool)
+        year = self.attrs['build_year'][idx]
+        floors = self.attrs['floors_number'][idx]
+        if filters.get('min_year') is not None:
+            mask &= year >= filters['min_year']
+        if filters.get('max_year') is not None:
+            mask &= year <= filters['max_year']
+        if filters.get('min_floors') is not None:
+            mask &= floors >= filters['min_floors']
+        if filters.get('max_floors') is not None:
+            mask &= floors <= filters['max_floors']
+        if filters.get('building_type') is not None:
+            mask &= self.attrs['building_type_id'][idx] == filters['building_type']
+        if filters.get('no_emergency'):
+            mask &= ~self.attrs['is_emergency'][idx]
+        idx, d = idx[mask], d[mask]
+
+        values = self.scores[score][idx]
+        if len(idx) > k:
+            part = np.argpartition(-values, k - 1)[:k]
+            idx, d, values = idx[part], d[part], values[part]
+        # По убыванию оценки, при равенстве — ближе
+        order = np.lexsort((d, -values))
+        result = []
+        for j in order:
+            rec = dict(self.records[int(idx[j])])
+            rec['dist'] = float(d[j])
+            result.append(rec)
+        return result
@@ -0,0 +1,116 @@
+-- Предрасчитанные объекты инфраструктуры рядом с домами.
+-- Бот берёт список объектов в радиусе из этой таблицы одним индексным
+-- запросом вместо четырёх ST_DWithin по school/kindergarten/hospital/park.
+-- Хранятся объекты не дальше 2000 м (AMENITY_MAX_RADIUS в main.py);
+-- для большего радиуса бот делает живой пространственный запрос.
+
+DROP TABLE IF EXISTS building_amenities;
+CREATE TABLE building_amenities (
+  building_id   integer NOT NULL,
+  amenity_type  text    NOT NULL,   -- имя исходной таблицы
+  amenity_id    integer NOT NULL,
+  type          text    NOT NULL,   -- подпись для карточки дома
+  name          text,
+  dist          real    NOT NULL,   -- метры
+  PRIMARY KEY (amenity_type, amenity_id, building_id)
+);
+
+DROP FUNCTION IF EXISTS building_amenities_bucket(double precision);
+
+INSERT INTO building_amenities
+SELECT b.building_id, 'school', s.school_id, 'Школа', s.name,
+       ST_Distance(b.geog, s.geog)
+FROM building b JOIN school s ON ST_DWithin(b.geog, s.geog, 2000)
+UNION ALL
+SELECT b.building_id, 'kindergarten', k.kindergarten_id, 'Детский сад', k.name,
+       ST_Distance(b.geog, k.geog)
+FROM building b JOIN kindergarten k ON ST_DWithin(b.geog, k.geog, 2000)
+UNION ALL
+SELECT b.building_id, 'hospital', h.hospital_id, 'Больница', h.name,
+       ST_Distance(b.geog, h.geog)
+FROM building b JOIN hospital h ON ST_DWithin(b.geog, h.geog, 2000)
+UNION ALL
+SELECT b.building_id, 'park', p.park_id, 'Парк', p.name,
+       ST_Distance(b.geog, p.geog)
+FROM building b JOIN park p ON ST_DWithin(b.geog, p.geog, 2000);
+
+CREATE INDEX building_amenities_lookup_idx ON building_amenities (building_id, dist);
+ANALYZE building_amenities;
+
+-- Инкрементальное обновление: при изменении объекта пересчитываются только
+-- его строки. Аргументы триггера: имя таблицы, подпись, имя колонки id.
+CREATE OR REPLACE FUNCTION building_amenities_sync() RETURNS trigger AS $$
+DECLARE
+  kind   text := TG_ARGV[0];
+  label  text := TG_ARGV[1];
+  id_col text := TG_ARGV[2];
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM building_amenities
+    WHERE amenity_type = kind
+      AND amenity_id = (to_jsonb(OLD) ->> id_col)::int;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.geog IS NOT NULL THEN
+    INSERT INTO building_amenities
+    SELECT b.building_id, kind, (to_jsonb(NEW) ->> id_col)::int, label, NEW.name,
+           ST_Distance(b.geog, NEW.geog)
+    FROM building b
+    WHERE ST_DWithin(b.geog, NEW.geog, 2000);
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS school_building_amenities ON school;
+CREATE TRIGGER school_building_amenities
+AFTER INSERT OR UPDATE OF name, geog OR DELETE ON school
+FOR EACH ROW EXECUTE FUNCTION building_amenities_sync('school', 'Школа', 'school_id');
+
+DROP TRIGGER IF EXISTS kindergarten_building_amenities ON kindergarten;
+CREATE TRIGGER kindergarten_building_amenities
+AFTER INSERT OR UPDATE OF name, geog OR DELETE ON kindergarten
+FOR EACH ROW EXECUTE FUNCTION building_amenities_sync('kindergarten', 'Детский сад', 'kindergarten_id');
+
+DROP TRIGGER IF EXISTS hospital_building_amenities ON hospital;
+CREATE TRIGGER hospital_building_amenities
+AFTER INSERT OR UPDATE OF name, geog OR DELETE ON hospital
+FOR EACH ROW EXECUTE FUNCTION building_amenities_sync('hospital', 'Больница', 'hospital_id');
+
+DROP TRIGGER IF EXISTS park_building_amenities ON park;
+CREATE TRIGGER park_building_amenities
+AFTER INSERT OR UPDATE OF name, geog OR DELETE ON park
+FOR EACH ROW EXECUTE FUNCTION building_amenities_sync('park', 'Парк', 'park_id');
+
+-- Изменились координаты дома: его строки пересчитываются по всем четырём
+-- таблицам объектов, удалённый дом убирается из таблицы.
+CREATE OR REPLACE FUNCTION building_amenities_sync_building() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM building_amenities WHERE building_id = OLD.building_id;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.geog IS NOT NULL THEN
+    INSERT INTO building_amenities
+    SELECT NEW.building_id, 'school', s.school_id, 'Школа', s.name, ST_Distance(NEW.geog, s.geog)
+    FROM school s WHERE ST_DWithin(NEW.geog, s.geog, 2000)
+    UNION ALL
+    SELECT NEW.building_id, 'kindergarten', k.kindergarten_id, 'Детский сад', k.name, ST_Distance(NEW.geog, k.geog)
+    FROM kindergarten k WHERE ST_DWithin(NEW.geog, k.geog, 2000)
+    UNION ALL
+    SELECT NEW.building_id, 'hospital', h.hospital_id, 'Больница', h.name, ST_Distance(NEW.geog, h.geog)
+    FROM hospital h WHERE ST_DWithin(NEW.geog, h.geog, 2000)
+    UNION ALL
+    SELECT NEW.building_id, 'park', p.park_id, 'Парк', p.name, ST_Distance(NEW.geog, p.geog)
+    FROM park p WHERE ST_DWithin(NEW.geog, p.geog, 2000);
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS building_building_amenities ON building;
+CREATE TRIGGER building_building_amenities
+AFTER INSERT OR UPDATE OF geom, geog, building_id OR DELETE ON building
+FOR EACH ROW EXECUTE FUNCTION building_amenities_sync_building();
@@ -0,0 +1,73 @@
+-- Предрасчитанные карточки домов для бота (см. cards.py).
+-- Заполняется rebuild_ratings.py после пересчёта рейтинга: для каждого дома
+-- и радиуса из CARD_RADII — готовый текст карточки без строки с отклонением
+-- координат (она зависит от точки запроса и добавляется ботом).
+-- Полный пересчёт собирает building_cards_next и подменяет таблицу,
+-- инкрементальный — заменяет строки домов из очередей building_ratings_dirty
+-- и building_cards_dirty (ниже).
+
+CREATE TABLE IF NOT EXISTS building_cards (
+  building_id integer  NOT NULL,
+  radius      smallint NOT NULL,   -- 500 / 1000 / 2000
+  head        text     NOT NULL,   -- дом, характеристики, оценки
+  objects     text     NOT NULL,   -- объекты в радиусе
+  PRIMARY KEY (building_id, radius)
+);
+
+-- Очередь домов, карточки которых нужно пересобрать. Очередь пересчёта
+-- рейтинга (building_ratings_dirty) сюда не подходит: она покрывает только
+-- радиусы формул (500/1000/2400 м) и не реагирует на переименование объекта,
+-- а в карточке перечислены все объекты до 2000 м с названиями и данные дома.
+-- rebuild_ratings.py пересобирает карточки домов из обеих очередей.
+CREATE TABLE IF NOT EXISTS building_cards_dirty (
+  building_id integer PRIMARY KEY,
+  queued_at   timestamptz NOT NULL DEFAULT now()
+);
+
+-- Объект добавлен, перемещён, переименован или удалён: все дома в 2000 м
+-- от старого и нового положения (радиус building_amenities).
+CREATE OR REPLACE FUNCTION building_cards_mark_dirty() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.geog IS NOT NULL THEN
+    INSERT INTO building_cards_dirty (building_id)
+    SELECT b.building_id FROM building b WHERE ST_DWithin(b.geog, OLD.geog, 2000)
+    ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.geog IS NOT NULL THEN
+    INSERT INTO building_cards_dirty (building_id)
+    SELECT b.building_id FROM building b WHERE ST_DWithin(b.geog, NEW.geog, 2000)
+    ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Изменились данные самого дома (адрес, площадь, координаты и т. п.)
+CREATE OR REPLACE FUNCTION building_cards_mark_building() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO building_cards_dirty (building_id)
+  VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.building_id ELSE NEW.building_id END)
+  ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS school_cards_dirty ON school;
+CREATE TRIGGER school_cards_dirty AFTER INSERT OR UPDATE OF name, geog OR DELETE ON school
+FOR EACH ROW EXECUTE FUNCTION building_cards_mark_dirty();
+
+DROP TRIGGER IF EXISTS kindergarten_cards_dirty ON kindergarten;
+CREATE TRIGGER kindergarten_cards_dirty AFTER INSERT OR UPDATE OF name, geog OR DELETE ON kindergarten
+FOR EACH ROW EXECUTE FUNCTION building_cards_mark_dirty();
+
+DROP TRIGGER IF EXISTS hospital_cards_dirty ON hospital;
+CREATE TRIGGER hospital_cards_dirty AFTER INSERT OR UPDATE OF name, geog OR DELETE ON hospital
+FOR EACH ROW EXECUTE FUNCTION building_cards_mark_dirty();
+
+DROP TRIGGER IF EXISTS park_cards_dirty ON park;
+CREATE TRIGGER park_cards_dirty AFTER INSERT OR UPDATE OF name, geog OR DELETE ON park
+FOR EACH ROW EXECUTE FUNCTION building_cards_mark_dirty();
+
+DROP TRIGGER IF EXISTS building_cards_dirty ON building;
+CREATE TRIGGER building_cards_dirty AFTER INSERT OR UPDATE OR DELETE ON building
+FOR EACH ROW EXECUTE FUNCTION building_cards_mark_building();
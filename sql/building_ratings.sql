@@ -41,23 +41,21 @@ parks AS (
 ),
   
 diversity AS (
-  SELECT b.building_id,
-    CASE 
-      WHEN ((CASE WHEN EXISTS (SELECT 1 FROM school s WHERE ST_DWithin(b.geog, s.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM kindergarten k WHERE ST_DWithin(b.geog, k.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM hospital h WHERE ST_DWithin(b.geog, h.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM park p WHERE ST_DWithin(b.geog, p.geog, 1000)) THEN 1 ELSE 0 END)) = 4 THEN 5
-      WHEN ((CASE WHEN EXISTS (SELECT 1 FROM school s WHERE ST_DWithin(b.geog, s.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM kindergarten k WHERE ST_DWithin(b.geog, k.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM hospital h WHERE ST_DWithin(b.geog, h.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM park p WHERE ST_DWithin(b.geog, p.geog, 1000)) THEN 1 ELSE 0 END)) = 3 THEN 3
-      WHEN ((CASE WHEN EXISTS (SELECT 1 FROM school s WHERE ST_DWithin(b.geog, s.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM kindergarten k WHERE ST_DWithin(b.geog, k.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM hospital h WHERE ST_DWithin(b.geog, h.geog, 500)) THEN 1 ELSE 0 END)
-         + (CASE WHEN EXISTS (SELECT 1 FROM park p WHERE ST_DWithin(b.geog, p.geog, 1000)) THEN 1 ELSE 0 END)) = 2 THEN 1
+  SELECT building_id,
+    CASE categories
+      WHEN 4 THEN 5
+      WHEN 3 THEN 3
+      WHEN 2 THEN 1
       ELSE 0
     END AS diversity_bonus
-  FROM building b
+  FROM (
+    SELECT b.building_id,
+           (CASE WHEN EXISTS (SELECT 1 FROM school s WHERE ST_DWithin(b.geog, s.geog, 500)) THEN 1 ELSE 0 END)
+         + (CASE WHEN EXISTS (SELECT 1 FROM kindergarten k WHERE ST_DWithin(b.geog, k.geog, 500)) THEN 1 ELSE 0 END)
+         + (CASE WHEN EXISTS (SELECT 1 FROM hospital h WHERE ST_DWithin(b.geog, h.geog, 500)) THEN 1 ELSE 0 END)
+         + (CASE WHEN EXISTS (SELECT 1 FROM park p WHERE ST_DWithin(b.geog, p.geog, 1000)) THEN 1 ELSE 0 END) AS categories
+    FROM building b
+  ) c
 ),
 social AS (
   SELECT b.building_id,
@@ -142,3 +140,11 @@ FROM building b
 LEFT JOIN social s ON b.building_id = s.building_id
 LEFT JOIN quality_total qt ON b.building_id = qt.building_id
 LEFT JOIN transport_total tt ON b.building_id = tt.building_id;
+
+-- Версия рейтинга: по ней бот узнаёт, что building_ratings пересчитан
+CREATE TABLE IF NOT EXISTS ratings_version (
+  id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  built_at timestamptz NOT NULL DEFAULT now()
+);
+INSERT INTO ratings_version (id, built_at) VALUES (1, now())
+ON CONFLICT (id) DO UPDATE SET built_at = EXCLUDED.built_at;
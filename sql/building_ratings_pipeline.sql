@@ -0,0 +1,233 @@
+-- Инкрементальный и параллельный пересчёт building_ratings.
+-- Формулы те же, что в building_ratings.sql, но каждая компонента
+-- (edu/med/parks/transport/quality) считается отдельной функцией для
+-- заданного набора домов. Пересчётом управляет rebuild_ratings.py:
+--   * полный пересчёт — город делится на части, части считаются в
+--     нескольких сессиях параллельно, результат собирается в
+--     building_ratings_next и атомарно подменяет building_ratings;
+--   * инкрементальный — пересчитываются только дома из очереди
+--     building_ratings_dirty, которую наполняют триггеры на таблицах
+--     инфраструктуры и на building.
+
+-- Промежуточные оценки по компонентам
+CREATE UNLOGGED TABLE IF NOT EXISTS building_ratings_stage (
+  building_id     integer PRIMARY KEY,
+  education_score double precision,
+  school_cnt      integer,
+  kind_cnt        integer,
+  med_score       double precision,
+  med_cnt         integer,
+  park_score      double precision,
+  park_cnt        integer,
+  quality_score   double precision,
+  transport_score double precision
+);
+
+-- Очередь домов, которые нужно пересчитать
+CREATE TABLE IF NOT EXISTS building_ratings_dirty (
+  building_id integer PRIMARY KEY,
+  queued_at   timestamptz NOT NULL DEFAULT now()
+);
+
+-- Образование (школы + сады)
+CREATE OR REPLACE FUNCTION ratings_stage_edu(ids integer[]) RETURNS void AS $$
+  INSERT INTO building_ratings_stage (building_id, education_score, school_cnt, kind_cnt)
+  SELECT b.building_id,
+         LEAST(LEAST(COALESCE(s.score, 0), 10) + LEAST(COALESCE(k.score, 0), 10), 10),
+         s.cnt, k.cnt
+  FROM building b
+  CROSS JOIN LATERAL (
+    SELECT SUM(GREATEST(0, 10 * (1 - ST_Distance(b.geog, s.geog)::float/500))) AS score, COUNT(*) AS cnt
+    FROM school s WHERE ST_DWithin(b.geog, s.geog, 500)
+  ) s
+  CROSS JOIN LATERAL (
+    SELECT SUM(GREATEST(0, 10 * (1 - ST_Distance(b.geog, k.geog)::float/500))) AS score, COUNT(*) AS cnt
+    FROM kindergarten k WHERE ST_DWithin(b.geog, k.geog, 500)
+  ) k
+  WHERE b.building_id = ANY(ids)
+  ON CONFLICT (building_id) DO UPDATE
+    SET education_score = EXCLUDED.education_score,
+        school_cnt = EXCLUDED.school_cnt,
+        kind_cnt = EXCLUDED.kind_cnt;
+$$ LANGUAGE sql;
+
+-- Медицина
+CREATE OR REPLACE FUNCTION ratings_stage_med(ids integer[]) RETURNS void AS $$
+  INSERT INTO building_ratings_stage (building_id, med_score, med_cnt)
+  SELECT b.building_id, LEAST(COALESCE(h.score, 0), 10), h.cnt
+  FROM building b
+  CROSS JOIN LATERAL (
+    SELECT SUM(GREATEST(0, 10 * (1 - ST_Distance(b.geog, h.geog)::float/500))) AS score, COUNT(*) AS cnt
+    FROM hospital h WHERE ST_DWithin(b.geog, h.geog, 500)
+  ) h
+  WHERE b.building_id = ANY(ids)
+  ON CONFLICT (building_id) DO UPDATE
+    SET med_score = EXCLUDED.med_score,
+        med_cnt = EXCLUDED.med_cnt;
+$$ LANGUAGE sql;
+
+-- Парки
+CREATE OR REPLACE FUNCTION ratings_stage_parks(ids integer[]) RETURNS void AS $$
+  INSERT INTO building_ratings_stage (building_id, park_score, park_cnt)
+  SELECT b.building_id, LEAST(COALESCE(p.score, 0), 5), p.cnt
+  FROM building b
+  CROSS JOIN LATERAL (
+    SELECT SUM(GREATEST(0, 5 * (1 - ST_Distance(b.geog, p.geog)::float/1000))) AS score, COUNT(*) AS cnt
+    FROM park p WHERE ST_DWithin(b.geog, p.geog, 1000)
+  ) p
+  WHERE b.building_id = ANY(ids)
+  ON CONFLICT (building_id) DO UPDATE
+    SET park_score = EXCLUDED.park_score,
+        park_cnt = EXCLUDED.park_cnt;
+$$ LANGUAGE sql;
+
+-- Качество недвижимости
+CREATE OR REPLACE FUNCTION ratings_stage_quality(ids integer[]) RETURNS void AS $$
+  INSERT INTO building_ratings_stage (building_id, quality_score)
+  SELECT b.building_id,
+         (CASE WHEN b.is_emergency THEN 0 ELSE 10 END)
+         + CASE
+             WHEN b.floors_number BETWEEN 3 AND 9 THEN 10
+             WHEN b.floors_number < 3 THEN 10 * b.floors_number / 3.0
+             WHEN b.floors_number > 9 THEN GREATEST(0, 10 - (b.floors_number - 9) * (10.0/6))
+           END
+         + CASE
+             WHEN (EXTRACT(YEAR FROM CURRENT_DATE) - b.build_year) <= 5 THEN 10
+             WHEN (EXTRACT(YEAR FROM CURRENT_DATE) - b.build_year) >= 30 THEN 0
+             ELSE 10 * (30 - (EXTRACT(YEAR FROM CURRENT_DATE) - b.build_year)) / 25.0
+           END
+  FROM building b
+  WHERE b.building_id = ANY(ids)
+  ON CONFLICT (building_id) DO UPDATE
+    SET quality_score = EXCLUDED.quality_score;
+$$ LANGUAGE sql;
+
+-- Транспортная доступность
+CREATE OR REPLACE FUNCTION ratings_stage_transport(ids integer[]) RETURNS void AS $$
+  INSERT INTO building_ratings_stage (building_id, transport_score)
+  SELECT b.building_id,
+         (
+           SELECT CASE
+                    WHEN MIN(ST_Distance(b.geog, m.geog)) < 2400 THEN 10 * (1 - MIN(ST_Distance(b.geog, m.geog))/2400.0)
+                    ELSE 0
+                  END
+           FROM metro m
+           WHERE ST_DWithin(b.geog, m.geog, 5000)
+         )
+         + (
+           SELECT CASE
+                    WHEN COUNT(*) >= 5 THEN 10
+                    ELSE 10 * COUNT(*) / 5.0
+                  END
+           FROM public_transport_stop pts
+           WHERE ST_DWithin(b.geog, pts.geog, 1000)
+         )
+         + (
+           SELECT CASE
+                    WHEN d < 2000 THEN 10
+                    WHEN d > 18000 THEN 0
+                    ELSE 10 * (1 - (d - 2000) / 16000.0)
+                  END
+           FROM (SELECT ST_Distance(b.geog, ST_SetSRID(ST_MakePoint(37.617734,55.752004),4326)::geography) AS d) c
+         )
+         + (
+           SELECT LEAST(SUM(
+             CASE
+               WHEN ST_Distance(b.geog, p2.geog) < 500
+                 THEN LEAST((p2.car_capacity/50.0)*10, 10) * (1 - ST_Distance(b.geog, p2.geog)/500.0)
+               ELSE 0
+             END
+           ), 10)
+           FROM parking p2
+           WHERE ST_DWithin(b.geog, p2.geog, 500)
+         )
+  FROM building b
+  WHERE b.building_id = ANY(ids)
+  ON CONFLICT (building_id) DO UPDATE
+    SET transport_score = EXCLUDED.transport_score;
+$$ LANGUAGE sql;
+
+-- Итоговые оценки из промежуточных (та же сборка, что в building_ratings.sql)
+CREATE OR REPLACE FUNCTION ratings_combine(ids integer[])
+RETURNS TABLE (building_id integer, social_score double precision, quality_score double precision,
+               transport_score double precision, total_score double precision) AS $$
+  SELECT st.building_id,
+         LEAST(x.social, 30),
+         LEAST(st.quality_score, 30),
+         LEAST(st.transport_score, 40),
+         LEAST(x.social, 30) + LEAST(st.quality_score, 30) + LEAST(st.transport_score, 40)
+  FROM building_ratings_stage st
+  JOIN building b ON b.building_id = st.building_id
+  CROSS JOIN LATERAL (
+    SELECT COALESCE(st.education_score, 0) + COALESCE(st.med_score, 0) + COALESCE(st.park_score, 0)
+           + CASE ((st.school_cnt > 0)::int + (st.kind_cnt > 0)::int
+                   + (st.med_cnt > 0)::int + (st.park_cnt > 0)::int)
+               WHEN 4 THEN 5
+               WHEN 3 THEN 3
+               WHEN 2 THEN 1
+               ELSE 0
+             END AS social
+  ) x
+  WHERE ids IS NULL OR st.building_id = ANY(ids);
+$$ LANGUAGE sql STABLE;
+
+-- Триггеры очереди пересчёта. Аргумент — радиус влияния объекта, м.
+CREATE OR REPLACE FUNCTION building_ratings_mark_dirty() RETURNS trigger AS $$
+DECLARE
+  radius double precision := TG_ARGV[0]::double precision;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.geog IS NOT NULL THEN
+    INSERT INTO building_ratings_dirty (building_id)
+    SELECT b.building_id FROM building b WHERE ST_DWithin(b.geog, OLD.geog, radius)
+    ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.geog IS NOT NULL THEN
+    INSERT INTO building_ratings_dirty (building_id)
+    SELECT b.building_id FROM building b WHERE ST_DWithin(b.geog, NEW.geog, radius)
+    ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION building_ratings_mark_building() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO building_ratings_dirty (building_id)
+  VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.building_id ELSE NEW.building_id END)
+  ON CONFLICT (building_id) DO UPDATE SET queued_at = now();
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS school_ratings_dirty ON school;
+CREATE TRIGGER school_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON school
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('500');
+
+DROP TRIGGER IF EXISTS kindergarten_ratings_dirty ON kindergarten;
+CREATE TRIGGER kindergarten_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON kindergarten
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('500');
+
+DROP TRIGGER IF EXISTS hospital_ratings_dirty ON hospital;
+CREATE TRIGGER hospital_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON hospital
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('500');
+
+DROP TRIGGER IF EXISTS park_ratings_dirty ON park;
+CREATE TRIGGER park_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON park
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('1000');
+
+DROP TRIGGER IF EXISTS metro_ratings_dirty ON metro;
+CREATE TRIGGER metro_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON metro
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('2400');
+
+DROP TRIGGER IF EXISTS public_transport_stop_ratings_dirty ON public_transport_stop;
+CREATE TRIGGER public_transport_stop_ratings_dirty AFTER INSERT OR UPDATE OF geog OR DELETE ON public_transport_stop
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('1000');
+
+DROP TRIGGER IF EXISTS parking_ratings_dirty ON parking;
+CREATE TRIGGER parking_ratings_dirty AFTER INSERT OR UPDATE OF geog, car_capacity OR DELETE ON parking
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_dirty('500');
+
+DROP TRIGGER IF EXISTS building_ratings_dirty ON building;
+CREATE TRIGGER building_ratings_dirty
+AFTER INSERT OR UPDATE OF geog, is_emergency, floors_number, build_year OR DELETE ON building
+FOR EACH ROW EXECUTE FUNCTION building_ratings_mark_building();
@@ -0,0 +1,152 @@
+-- Предрасчитанные агрегаты для бота: гистограммы оценок, топ/антитоп домов
+-- и квадратная сетка по городу для тепловой карты (search.py).
+-- Бот читает отсюда несколько десятков строк вместо всей building_ratings.
+-- refresh_rating_aggregates() вызывается после пересчёта рейтинга
+-- (rebuild_ratings.py делает это сам, после building_ratings.sql — вручную).
+
+CREATE TABLE IF NOT EXISTS rating_histogram (
+  component  text    NOT NULL,   -- total / social / quality / transport
+  bin_width  integer NOT NULL,   -- 1 / 5 / 10
+  bin_start  integer NOT NULL,
+  buildings  integer NOT NULL,
+  PRIMARY KEY (component, bin_width, bin_start)
+);
+
+CREATE TABLE IF NOT EXISTS rating_leaderboard (
+  scope       text    NOT NULL,  -- city / building_type
+  scope_id    integer NOT NULL,  -- 0 для city, иначе building_type_id
+  direction   text    NOT NULL,  -- top / bottom
+  rank        integer NOT NULL,
+  building_id integer NOT NULL,
+  address     text,
+  total_score numeric,
+  PRIMARY KEY (scope, scope_id, direction, rank)
+);
+
+-- Ячейки сетки cell_size x cell_size метров в UTM 37N (EPSG:32637):
+-- ячейка (cx, cy) покрывает [cx*cell_size, (cx+1)*cell_size) по x и так же по y.
+-- lat / lon — центр ячейки.
+CREATE TABLE IF NOT EXISTS rating_cells (
+  cell_size integer NOT NULL,    -- 250 / 500 / 1000
+  cx        integer NOT NULL,
+  cy        integer NOT NULL,
+  buildings integer NOT NULL,
+  lat       double precision NOT NULL,
+  lon       double precision NOT NULL,
+  total_mean     real,
+  total_p25      real,
+  total_p50      real,
+  total_p75      real,
+  social_mean    real,
+  social_p25     real,
+  social_p50     real,
+  social_p75     real,
+  quality_mean   real,
+  quality_p25    real,
+  quality_p50    real,
+  quality_p75    real,
+  transport_mean real,
+  transport_p25  real,
+  transport_p50  real,
+  transport_p75  real,
+  PRIMARY KEY (cell_size, cx, cy)
+);
+
+CREATE OR REPLACE FUNCTION refresh_rating_aggregates(top_n integer DEFAULT 50) RETURNS void AS $$
+BEGIN
+  DELETE FROM rating_histogram;
+  -- Последний интервал включает правую границу, как в matplotlib hist
+  INSERT INTO rating_histogram (component, bin_width, bin_start, buildings)
+  SELECT c.component, w.width,
+         LEAST(floor(c.score / w.width)::int, c.max_score / w.width - 1) * w.width,
+         COUNT(*)
+  FROM (
+    SELECT 'total' AS component, total_score AS score, 100 AS max_score FROM building_ratings
+    UNION ALL
+    SELECT 'social', social_score, 30 FROM building_ratings
+    UNION ALL
+    SELECT 'quality', quality_score, 30 FROM building_ratings
+    UNION ALL
+    SELECT 'transport', transport_score, 40 FROM building_ratings
+  ) c
+  CROSS JOIN (VALUES (1), (5), (10)) w(width)
+  WHERE c.score BETWEEN 0 AND c.max_score
+  GROUP BY 1, 2, 3;
+
+  DELETE FROM rating_leaderboard;
+  INSERT INTO rating_leaderboard (scope, scope_id, direction, rank, building_id, address, total_score)
+  SELECT scope, scope_id, direction, rank, building_id, address, total_score
+  FROM (
+    SELECT 'city' AS scope, 0 AS scope_id, 'top' AS direction,
+           row_number() OVER (ORDER BY br.total_score DESC, b.building_id) AS rank,
+           b.building_id, b.address, ROUND(br.total_score::numeric, 2) AS total_score
+    FROM building b JOIN building_ratings br ON br.building_id = b.building_id
+    WHERE br.total_score IS NOT NULL
+    UNION ALL
+    SELECT 'city', 0, 'bottom',
+           row_number() OVER (ORDER BY br.total_score ASC, b.building_id),
+           b.building_id, b.address, ROUND(br.total_score::numeric, 2)
+    FROM building b JOIN building_ratings br ON br.building_id = b.building_id
+    WHERE br.total_score IS NOT NULL
+    UNION ALL
+    SELECT 'building_type', COALESCE(b.building_type_id, 0), 'top',
+           row_number() OVER (PARTITION BY b.building_type_id ORDER BY br.total_score DESC, b.building_id),
+           b.building_id, b.address, ROUND(br.total_score::numeric, 2)
+    FROM building b JOIN building_ratings br ON br.building_id = b.building_id
+    WHERE br.total_score IS NOT NULL
+    UNION ALL
+    SELECT 'building_type', COALESCE(b.building_type_id, 0), 'bottom',
+           row_number() OVER (PARTITION BY b.building_type_id ORDER BY br.total_score ASC, b.building_id),
+           b.building_id, b.address, ROUND(br.total_score::numeric, 2)
+    FROM building b JOIN building_ratings br ON br.building_id = b.building_id
+    WHERE br.total_score IS NOT NULL
+  ) t
+  WHERE rank <= top_n;
+
+  DELETE FROM rating_cells;
+  INSERT INTO rating_cells (cell_size, cx, cy, buildings,
+                            total_mean, total_p25, total_p50, total_p75,
+                            social_mean, social_p25, social_p50, social_p75,
+                            quality_mean, quality_p25, quality_p50, quality_p75,
+                            transport_mean, transport_p25, transport_p50, transport_p75,
+                            lat, lon)
+  SELECT g.*, ST_Y(c.center), ST_X(c.center)
+  FROM (
+    SELECT s.cell_size, s.cx, s.cy, COUNT(*) AS buildings,
+           AVG(s.total_score),
+           percentile_cont(0.25) WITHIN GROUP (ORDER BY s.total_score),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY s.total_score),
+           percentile_cont(0.75) WITHIN GROUP (ORDER BY s.total_score),
+           AVG(s.social_score),
+           percentile_cont(0.25) WITHIN GROUP (ORDER BY s.social_score),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY s.social_score),
+           percentile_cont(0.75) WITHIN GROUP (ORDER BY s.social_score),
+           AVG(s.quality_score),
+           percentile_cont(0.25) WITHIN GROUP (ORDER BY s.quality_score),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY s.quality_score),
+           percentile_cont(0.75) WITHIN GROUP (ORDER BY s.quality_score),
+           AVG(s.transport_score),
+           percentile_cont(0.25) WITHIN GROUP (ORDER BY s.transport_score),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY s.transport_score),
+           percentile_cont(0.75) WITHIN GROUP (ORDER BY s.transport_score)
+    FROM (
+      SELECT w.cell_size,
+             floor(ST_X(p.xy) / w.cell_size)::int AS cx,
+             floor(ST_Y(p.xy) / w.cell_size)::int AS cy,
+             br.total_score, br.social_score, br.quality_score, br.transport_score
+      FROM building b
+      JOIN building_ratings br ON br.building_id = b.building_id
+      CROSS JOIN LATERAL (SELECT ST_Transform(b.geom, 32637) AS xy) p
+      CROSS JOIN (VALUES (250), (500), (1000)) w(cell_size)
+      WHERE br.total_score IS NOT NULL AND b.geom IS NOT NULL
+    ) s
+    GROUP BY s.cell_size, s.cx, s.cy
+  ) g
+  CROSS JOIN LATERAL (
+    SELECT ST_Transform(ST_SetSRID(ST_MakePoint((g.cx + 0.5) * g.cell_size,
+                                                (g.cy + 0.5) * g.cell_size), 32637), 4326) AS center
+  ) c;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_rating_aggregates();
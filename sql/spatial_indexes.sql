@@ -0,0 +1,27 @@
+-- Пространственные индексы для KNN-поиска ближайшего дома (оператор <->)
+-- и для ST_DWithin-запросов по объектам инфраструктуры.
+-- Колонки geog (geography) используются и в building_ratings.sql.
+
+CREATE INDEX IF NOT EXISTS building_geog_gist ON building USING GIST (geog);
+CREATE INDEX IF NOT EXISTS building_geom_gist ON building USING GIST (geom);
+
+CREATE INDEX IF NOT EXISTS school_geog_gist ON school USING GIST (geog);
+CREATE INDEX IF NOT EXISTS kindergarten_geog_gist ON kindergarten USING GIST (geog);
+CREATE INDEX IF NOT EXISTS hospital_geog_gist ON hospital USING GIST (geog);
+CREATE INDEX IF NOT EXISTS park_geog_gist ON park USING GIST (geog);
+CREATE INDEX IF NOT EXISTS metro_geog_gist ON metro USING GIST (geog);
+CREATE INDEX IF NOT EXISTS public_transport_stop_geog_gist ON public_transport_stop USING GIST (geog);
+CREATE INDEX IF NOT EXISTS parking_geog_gist ON parking USING GIST (geog);
+
+CREATE UNIQUE INDEX IF NOT EXISTS building_ratings_building_id_idx ON building_ratings (building_id);
+
+-- Индексы по оценкам для поиска «лучшие дома рядом» (search.py) на больших
+-- радиусах, где выгоднее идти по убыванию оценки, чем по GiST. rebuild_ratings.py
+-- пересоздаёт их при полной перестройке (SCORE_INDEXES).
+CREATE INDEX IF NOT EXISTS building_ratings_total_score_idx ON building_ratings (total_score DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS building_ratings_social_score_idx ON building_ratings (social_score DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS building_ratings_quality_score_idx ON building_ratings (quality_score DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS building_ratings_transport_score_idx ON building_ratings (transport_score DESC NULLS LAST);
+
+ANALYZE building;
+ANALYZE building_ratings;
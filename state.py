@@ -0,0 +1,153 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Хранилище состояния пользователей: история запросов и шаг сравнения домов.
+# Запись на пользователя компактная: {"h": [[lat, lon, radius, address, building_id], ...], "c": состояние}.
+# Две реализации с одинаковым интерфейсом:
+#   MemoryStateStore — в памяти процесса, LRU + TTL;
+#   SQLiteStateStore — в локальном файле SQLite (WAL), общий для нескольких
+#                      процессов бота на одной машине, переживает перезапуск.
+
+HISTORY_SIZE = 5                  # последних запросов на пользователя
+STATE_TTL = 30 * 24 * 3600        # неактивные пользователи забываются, сек
+STATE_MAX_USERS = 100000
+
+
+def _empty():
+    return {"h": [], "c": None}
+
+
+def _decode_compare(state):
+    # JSON не различает list и tuple: ("first", idx) хранится как ["first", idx]
+    return tuple(state) if isinstance(state, list) else state
+
+
+class MemoryStateStore:
+    def __init__(self, ttl: float = STATE_TTL, max_users: int = STATE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._data = OrderedDict()   # user_id -> (updated_at, record)
+
+    def _get(self, user_id: int):
+        item = self._data.get(user_id)
+        if item is None:
+            return _empty()
+        updated_at, record = item
+        if updated_at + self.ttl < time.time():
+            del self._data[user_id]
+            return _empty()
+        return record
+
+    def _put(self, user_id: int, record):
+        self._data[user_id] = (time.time(), record)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_users:
+            self._data.popitem(last=False)
+
+    async def get_history(self, user_id: int):
+        return [tuple(e) for e in self._get(user_id)["h"]]
+
+    async def add_query(self, user_id: int, entry):
+        record = self._get(user_id)
+        record["h"] = ([list(entry)] + record["h"])[:HISTORY_SIZE]
+        self._put(user_id, record)
+
+    async def get_compare_state(self, user_id: int):
+        return self._get(user_id)["c"]
+
+    async def set_compare_state(self, user_id: int, state):
+        record = self._get(user_id)
+        record["c"] = state
+        self._put(user_id, record)
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore:
+    CLEANUP_EVERY = 1000              # записей между чистками устаревших
+
+    def __init__(self, path: str, ttl: float = STATE_TTL, max_users: int = STATE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id    INTEGER PRIMARY KEY,
+                data       TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS user_state_updated_at ON user_state (updated_at);")
+
+    def _get(self, user_id: int):
+        row = self._conn.execute(
+            "SELECT data FROM user_state WHERE user_id = ? AND updated_at >= ?;",
+            (user_id, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else _empty()
+
+    def _update(self, user_id: int, change):
+        with self._lock:
+            # BEGIN IMMEDIATE — чтобы другой процесс не перетёр запись между чтением и записью
+            self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                record = self._get(user_id)
+                change(record)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?);",
+                    (user_id, json.dumps(record, ensure_ascii=False, separators=(',', ':')), time.time()),
+                )
+                self._conn.execute("COMMIT;")
+            except BaseException:
+                self._conn.execute("ROLLBACK;")
+                raise
+            self._writes += 1
+            if self._writes % self.CLEANUP_EVERY == 0:
+                self._cleanup()
+
+    def _cleanup(self):
+        self._conn.execute("DELETE FROM user_state WHERE updated_at < ?;", (time.time() - self.ttl,))
+        self._conn.execute("""
+            DELETE FROM user_state WHERE user_id IN (
+                SELECT user_id FROM user_state ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+            );
+        """, (self.max_users,))
+
+    def _read(self, user_id: int):
+        with self._lock:
+            return self._get(user_id)
+
+    async def get_history(self, user_id: int):
+        record = await asyncio.to_thread(self._read, user_id)
+        return [tuple(e) for e in record["h"]]
+
+    async def add_query(self, user_id: int, entry):
+        def change(record):
+            record["h"] = ([list(entry)] + record["h"])[:HISTORY_SIZE]
+        await asyncio.to_thread(self._update, user_id, change)
+
+    async def get_compare_state(self, user_id: int):
+        record = await asyncio.to_thread(self._read, user_id)
+        return _decode_compare(record["c"])
+
+    async def set_compare_state(self, user_id: int, state):
+        def change(record):
+            record["c"] = state
+        await asyncio.to_thread(self._update, user_id, change)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def make_state_store(path: str = None):
+    return SQLiteStateStore(path) if path else MemoryStateStore()
@@ -0,0 +1,137 @@
+import asyncio
+import csv
+import io
+import json
+from decimal import Decimal
+
+import pytest
+
+import bulk
+from bulk import FIELDS, BulkStats, parse_line, rate_many, write_results
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("55.75, 37.61", {'lat': 55.75, 'lon': 37.61}),
+    ("  55.75;37.61  ", {'lat': 55.75, 'lon': 37.61}),
+    ("55.75 37.61 1000", {'lat': 55.75, 'lon': 37.61}),
+    ("-33.9, 151.2", {'lat': -33.9, 'lon': 151.2}),
+    ("Тверская, 7", {'query_address': "Тверская, 7"}),
+    ("Адрес: Тверская, 7", {'query_address': "Тверская, 7"}),
+    ("55.75, 37.61, abc", {'query_address': "55.75, 37.61, abc"}),
+])
+def test_parse_line(line, expected):
+    item = parse_line(3, line)
+    assert item == {'line': 3, 'query': line.strip(), **expected}
+
+
+@pytest.mark.parametrize("line", ["", "   ", "# комментарий", "  # 55.75, 37.61"])
+def test_parse_line_skips_blank_and_comments(line):
+    assert parse_line(1, line) is None
+
+
+class Index:
+    def nearest_record(self, lat, lon):
+        if lat > 60:
+            return None
+        return {'building_id': int(lat * 100), 'name': f"Дом {lat}", 'dist': 12.5,
+                'total_score': Decimal('70.25'), 'social_score': Decimal('20.00'),
+                'quality_score': Decimal('25.25'), 'transport_score': Decimal('25.00')}
+
+
+class Geocoder:
+    # Известные адреса — из словаря; к «Nominatim» — только в пределах бюджета
+    def __init__(self, known):
+        self.known = known
+        self.upstream = []
+
+    async def geocode(self, addr, budget=None):
+        if addr in self.known:
+            return self.known[addr]
+        if budget is not None and not budget.take():
+            return None
+        self.upstream.append(addr)
+        return None
+
+
+async def _collect(rows):
+    return [row async for row in rows]
+
+
+def test_rate_many_batches_and_statuses():
+    lines = ["# точки", "55.75, 37.61", "Тверская, 7", "", "61.0, 30.0", "Нет такого, 1", "55.70 37.50"]
+    stats = BulkStats()
+    geocoder = Geocoder({"Тверская, 7": (55.76, 37.60)})
+    rows = asyncio.run(_collect(rate_many(lines, geocoder, Index(), batch_size=2, stats=stats)))
+
+    assert [r['line'] for r in rows] == [2, 3, 5, 6, 7]
+    assert [r['status'] for r in rows] == ['ok', 'ok', 'not_found', 'not_geocoded', 'ok']
+    assert rows[1]['building_id'] == 5576 and (rows[1]['lat'], rows[1]['lon']) == (55.76, 37.60)
+    assert (stats.rows, stats.found, stats.not_found, stats.not_geocoded, stats.batches) == (5, 3, 1, 1, 3)
+
+
+def test_rate_many_limits_upstream_geocoding_per_file():
+    lines = [f"Улица {i}, 1" for i in range(5)]
+    stats = BulkStats()
+    geocoder = Geocoder({})
+    rows = asyncio.run(_collect(rate_many(lines, geocoder, Index(), batch_size=2, stats=stats, max_upstream=3)))
+    assert len(geocoder.upstream) == 3
+    assert stats.over_budget == 2
+    assert all(r['status'] == 'not_geocoded' for r in rows)
+
+
+def test_rate_many_queries_db_once_per_batch(monkeypatch):
+    calls = []
+
+    async def db_call(func, lons, lats, retry=False):
+        assert func is bulk._query_nearest_many and retry
+        calls.append(len(lons))
+        return [None] * len(lons)
+
+    monkeypatch.setattr(bulk, "db_call", db_call)
+    lines = [f"55.{i:02d}, 37.6" for i in range(7)]
+    rows = asyncio.run(_collect(rate_many(lines, batch_size=3)))
+    assert calls == [3, 3, 1]
+    assert [r['status'] for r in rows] == ['not_found'] * 7
+
+
+async def _rows(items):
+    for item in items:
+        yield item
+
+
+ROWS = [
+    {'line': 1, 'query': "55.75, 37.61", 'lat': 55.75, 'lon': 37.61, 'building_id': 7,
+     'address': "Тверская ул., д. 7", 'dist': 12.3456789, 'total_score': Decimal('70.25'),
+     'social_score': Decimal('20.00'), 'quality_score': Decimal('25.25'),
+     'transport_score': Decimal('25.00'), 'status': 'ok', 'query_address': None},
+    {'line': 2, 'query': "Нет такого, 1", 'query_address': "Нет такого, 1", 'status': 'not_geocoded'},
+]
+
+
+def test_write_results_csv():
+    out = io.StringIO()
+    assert asyncio.run(write_results(_rows(ROWS), out, 'csv')) == 2
+    out.seek(0)
+    rows = list(csv.DictReader(out))
+    assert list(rows[0]) == FIELDS
+    assert rows[0]['address'] == "Тверская ул., д. 7"
+    assert rows[0]['dist'] == '12.345679' and rows[0]['total_score'] == '70.25'
+    assert rows[1]['lat'] == '' and rows[1]['status'] == 'not_geocoded'
+
+
+def test_write_results_json():
+    out = io.StringIO()
+    assert asyncio.run(write_results(_rows(ROWS), out, 'json')) == 2
+    data = json.loads(out.getvalue())
+    assert [list(r) for r in data] == [FIELDS, FIELDS]
+    assert data[0]['total_score'] == 70.25 and data[0]['address'] == "Тверская ул., д. 7"
+    assert data[1]['building_id'] is None
+    # Пустой вход — всё равно корректный JSON
+    out = io.StringIO()
+    asyncio.run(write_results(_rows([]), out, 'json'))
+    assert json.loads(out.getvalue()) == []
+
+
+def test_write_results_unknown_format():
+    with pytest.raises(ValueError):
+        asyncio.run(write_results(_rows(ROWS), io.StringIO(), 'xml'))
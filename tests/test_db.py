@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import db
+
+
+class FakeConn:
+    def __init__(self, dead: bool):
+        self.dead = dead
+        self.closed = 0
+        self.autocommit = False
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+
+class FakePool:
+    # Простаивающие соединения, которые сервер уже закрыл, затем — новые живые
+    def __init__(self, dead: int):
+        self.idle = [FakeConn(True) for _ in range(dead)]
+        self.discarded = 0
+
+    def getconn(self):
+        return self.idle.pop() if self.idle else FakeConn(False)
+
+    def putconn(self, conn, close=False):
+        if close:
+            self.discarded += 1
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        pass
+
+
+def _query(conn):
+    if conn.dead:
+        conn.closed = 2
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    return "ok"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = FakePool(dead=3)
+    monkeypatch.setattr(db, "_pool", fake)
+    monkeypatch.setattr(db, "_sem", None)
+    yield fake
+    db.close_db_executor()
+
+
+def test_read_is_retried_on_connections_closed_by_server(pool):
+    assert asyncio.run(db.db_call(_query, retry=True)) == "ok"
+    assert pool.discarded == 3
+
+
+def test_without_retry_error_is_raised(pool):
+    with pytest.raises(psycopg2.OperationalError):
+        asyncio.run(db.db_call(_query))
+    assert pool.discarded == 1
+
+
+def test_cancelled_call_holds_its_slot_until_thread_returns(pool, monkeypatch):
+    monkeypatch.setattr(db, "DB_POOL_MAX", 1)
+    pool.idle = []
+    started, finish = threading.Event(), threading.Event()
+
+    def slow(conn):
+        started.set()
+        finish.wait(5)
+        return "slow"
+
+    async def scenario():
+        task = asyncio.create_task(db.db_call(slow))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Поток ещё держит соединение — место в очереди не освобождено
+        assert db._get_sem().free == 0
+        waiter = asyncio.create_task(db.db_call(_query))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        finish.set()
+        assert await waiter == "ok"
+        assert db._get_sem().free == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from geocoder import GeocodeCache, Geocoder, LocalGeocoder, normalize_address
+
+
+def _index(names):
+    return LocalGeocoder([
+        {'building_id': i, 'name': name, 'geom_lat': 55.7 + i / 100, 'geom_lon': 37.6}
+        for i, name in enumerate(names, 1)
+    ])
+
+
+def test_fuzzy_lookup_prefers_most_similar_street():
+    long_street = "Ленинский проспект дублер внешняя сторона, д. 5"
+    short_street = "Ленинский проспект, д. 5"
+    for names, expected_id in (([long_street, short_street], 2), ([short_street, long_street], 1)):
+        found = _index(names).lookup("Ленинскй проспект, 5")
+        assert found is not None
+        assert found[2] == expected_id
+
+
+def test_exact_lookup_and_house_number_mismatch():
+    index = _index(["Тверская ул., д. 7", "Тверская ул., д. 9"])
+    assert index.lookup("Москва, Тверская улица, 9")[2] == 2
+    assert index.lookup("Тверская, 11") is None
+
+
+def test_cache_save_merges_entries_of_other_processes(tmp_path):
+    path = str(tmp_path / "geocode_cache.json")
+    first, second = GeocodeCache(path=path), GeocodeCache(path=path)
+    first.put("тверская 7", (55.76, 37.61))
+    second.put("арбат 1", (55.75, 37.60))
+    second.put("нет такого", None)
+    first.save()
+    second.save()
+
+    loaded = GeocodeCache(path=path)
+    assert loaded.get("тверская 7") == (True, (55.76, 37.61))
+    assert loaded.get("арбат 1") == (True, (55.75, 37.60))
+    assert loaded.get("нет такого") == (True, None)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["geocode_cache.json", "geocode_cache.json.lock"]
+    assert len(json.loads((tmp_path / "geocode_cache.json").read_text(encoding="utf-8"))) == 3
+
+
+def test_cache_save_keeps_maxsize_longest_living(tmp_path):
+    path = str(tmp_path / "geocode_cache.json")
+    other = GeocodeCache(path=path, ttl=100)
+    other.put("старый", (1.0, 1.0))
+    other.save()
+    cache = GeocodeCache(path=None, maxsize=1, ttl=1000)
+    cache.path = path
+    cache.put("новый", (2.0, 2.0))
+    cache.save()
+    loaded = GeocodeCache(path=path)
+    assert loaded.get("новый") == (True, (2.0, 2.0))
+    assert loaded.get("старый") == (False, None)
+
+
+def test_leader_cancellation_does_not_fail_coalesced_geocode():
+    async def scenario():
+        geocoder = Geocoder(cache=GeocodeCache())
+        release = asyncio.Event()
+        fetched = []
+
+        async def fetch(addr):
+            fetched.append(addr)
+            await release.wait()
+            return 55.7, 37.6
+
+        geocoder._fetch = fetch
+        leader = asyncio.create_task(geocoder.geocode("Тверская, 7"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(geocoder.geocode("Тверская, 7"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == (55.7, 37.6)
+        assert fetched == ["Тверская, 7"]
+        assert geocoder.stats["coalesced"] == 1
+        # Результат попал в кэш, хотя запросивший первым уже отменён
+        assert geocoder.cache.get(normalize_address("Тверская, 7")) == (True, (55.7, 37.6))
+        assert not geocoder._inflight
+
+    asyncio.run(scenario())
@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+import pytest
+
+from rating_engine import AMENITY_KINDS, CITY_CENTER, RatingEngine, geo_distance
+
+# Сверка rating_engine.py с формулами sql/building_ratings.sql без БД:
+# эталон — построчный расчёт тех же формул, расстояние — формула Винсенти
+# на эллипсоиде WGS84 (как ST_Distance по geography).
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+YEAR = 2024
+
+
+def vincenty(lat1, lon1, lat2, lon2):
+    if (lat1, lon1) == (lat2, lon2):
+        return 0.0
+    u1 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat1)))
+    u2 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat2)))
+    lon = math.radians(lon2 - lon1)
+    lam = lon
+    for _ in range(200):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(math.cos(u2) * sin_lam,
+                               math.cos(u1) * math.sin(u2) - math.sin(u1) * math.cos(u2) * cos_lam)
+        cos_sigma = math.sin(u1) * math.sin(u2) + math.cos(u1) * math.cos(u2) * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = math.cos(u1) * math.cos(u2) * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sm = cos_sigma - 2 * math.sin(u1) * math.sin(u2) / cos2_alpha
+        c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        prev, lam = lam, lon + (1 - c) * WGS84_F * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sm + c * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+        if abs(lam - prev) < 1e-12:
+            break
+    u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta = b * sin_sigma * (cos_2sm + b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2) - b / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    return WGS84_B * a * (sigma - delta)
+
+
+# NULL из БД: None или NaN в массивах движка
+def _value(v):
+    return None if v is None or (isinstance(v, float) and math.isnan(v)) else v
+
+
+# LEAST в PostgreSQL пропускает NULL
+def _least(v, limit):
+    return limit if v is None else min(v, limit)
+
+
+# Оценки одного дома по формулам building_ratings.sql
+def reference_scores(house, amenities):
+    lat, lon = house['latitude'], house['longitude']
+
+    def near(kind, radius):
+        a = amenities[kind]
+        out = []
+        for i in range(len(a['latitude'])):
+            d = vincenty(lat, lon, a['latitude'][i], a['longitude'][i])
+            if d <= radius:
+                out.append((i, d))
+        return out
+
+    def decay(kind, radius, max_pts):
+        found = near(kind, radius)
+        return sum(max(0, max_pts * (1 - d / radius)) for _, d in found), len(found)
+
+    edu, school_cnt = decay('school', 500, 10)
+    kind, kind_cnt = decay('kindergarten', 500, 10)
+    med, med_cnt = decay('hospital', 500, 10)
+    park, park_cnt = decay('park', 1000, 5)
+    categories = (school_cnt > 0) + (kind_cnt > 0) + (med_cnt > 0) + (park_cnt > 0)
+    diversity = {4: 5, 3: 3, 2: 1}.get(categories, 0)
+    social = min(min(edu, 10) + min(kind, 10), 10) + min(med, 10) + min(park, 5) + diversity
+
+    # NULL этажности или года даёт NULL в CASE и в сумме quality_score
+    floors, year = _value(house['floors_number']), _value(house['build_year'])
+    if floors is None:
+        floors_score = None
+    elif 3 <= floors <= 9:
+        floors_score = 10
+    elif floors < 3:
+        floors_score = 10 * floors / 3.0
+    else:
+        floors_score = max(0, 10 - (floors - 9) * (10.0 / 6))
+    if year is None:
+        age_score = None
+    else:
+        age = YEAR - year
+        age_score = 10 if age <= 5 else 0 if age >= 30 else 10 * (30 - age) / 25.0
+    # CASE WHEN NULL THEN 0 ELSE 10 -> 10
+    avariness = 0 if house['is_emergency'] is not None and house['is_emergency'] else 10
+    quality = None if None in (floors_score, age_score) else avariness + floors_score + age_score
+
+    metro = near('metro', 5000)
+    nearest = min((d for _, d in metro), default=math.inf)
+    transport = 10 * (1 - nearest / 2400.0) if nearest < 2400 else 0
+    stops = len(near('public_transport_stop', 1000))
+    transport += 10 if stops >= 5 else 10 * stops / 5.0
+    dc = vincenty(lat, lon, *CITY_CENTER)
+    transport += 10 if dc < 2000 else 0 if dc > 18000 else 10 * (1 - (dc - 2000) / 16000.0)
+    parkings = near('parking', 500)
+    if parkings:
+        cap = amenities['parking']['car_capacity']
+        # LEAST(NULL, 10) = 10: парковка без вместимости даёт полные 10 баллов
+        transport += min(sum((10 if _value(cap[i]) is None else min(cap[i] / 50.0 * 10, 10)) * (1 - d / 500.0)
+                             for i, d in parkings if d < 500), 10)
+    else:
+        transport += 10
+
+    social, quality, transport = min(social, 30), _least(quality, 30), min(transport, 40)
+    return {'social_score': social, 'quality_score': quality, 'transport_score': transport,
+            'total_score': social + quality + transport}
+
+
+# Точка на расстоянии dist, м, от (lat, lon) по азимуту bearing (для плоского
+# смещения на коротких расстояниях хватает, дальше уточняется по vincenty)
+def _offset(lat, lon, dist, bearing):
+    lat2 = lat + dist * math.cos(bearing) / 111_200
+    lon2 = lon + dist * math.sin(bearing) / (111_200 * math.cos(math.radians(lat)))
+    for _ in range(5):
+        scale = dist / vincenty(lat, lon, lat2, lon2)
+        lat2 = lat + (lat2 - lat) * scale
+        lon2 = lon + (lon2 - lon) * scale
+    return lat2, lon2
+
+
+@pytest.mark.parametrize("lat", [55.55, 55.92])
+@pytest.mark.parametrize("dist", [500, 1000, 2400, 5000, 25000])
+def test_geo_distance_matches_vincenty(lat, dist):
+    lat2, lon2 = _offset(lat, 37.6, dist, 0.7)
+    assert abs(float(geo_distance(lat, 37.6, lat2, lon2)) - vincenty(lat, 37.6, lat2, lon2)) < 0.05
+
+
+def test_scores_match_sql_formulas_near_city_edges():
+    rnd = np.random.default_rng(7)
+    houses = [(55.55, 37.45), (55.92, 37.75), (55.752, 37.618), (55.6, 37.8),
+              (55.7, 37.55), (55.8, 37.5), (55.65, 37.7)]
+    amenities = {kind: {'latitude': [], 'longitude': []} for kind in AMENITY_KINDS}
+    radii = {'school': 500, 'kindergarten': 500, 'hospital': 500, 'park': 1000,
+             'metro': 2400, 'public_transport_stop': 1000, 'parking': 500}
+    for lat, lon in houses:
+        for kind, radius in radii.items():
+            # Объекты в метре по обе стороны порога и случайно в радиусе
+            for dist in (radius - 1, radius + 1, *rnd.uniform(0, radius, 2)):
+                alat, alon = _offset(lat, lon, dist, rnd.uniform(0, 2 * math.pi))
+                amenities[kind]['latitude'].append(alat)
+                amenities[kind]['longitude'].append(alon)
+    capacity = [int(c) for c in rnd.integers(5, 300, len(amenities['parking']['latitude']))]
+    # У каждой четвёртой парковки вместимость не заполнена (NULL)
+    amenities['parking']['car_capacity'] = [None if i % 4 == 2 else c for i, c in enumerate(capacity)]
+
+    buildings = {
+        'building_id': np.arange(len(houses)),
+        'latitude': np.array([h[0] for h in houses]),
+        'longitude': np.array([h[1] for h in houses]),
+        # Последние три дома — с NULL в этажности, годе постройки и признаке аварийности
+        'is_emergency': np.array([False, True, False, False, False, True, None], dtype=object),
+        'floors_number': np.array([5.0, 2.0, 17.0, 9.0, np.nan, 12.0, 4.0]),
+        'build_year': np.array([2021.0, 1990.0, 2010.0, 1950.0, 2000.0, np.nan, 2015.0]),
+    }
+    out = RatingEngine(buildings, {k: {c: np.asarray(v, dtype=np.float64) for c, v in a.items()}
+                                   for k, a in amenities.items()}, year=YEAR).score()
+
+    for i in range(len(houses)):
+        house = {k: v[i] for k, v in buildings.items()}
+        expected = reference_scores(house, amenities)
+        for column, value in expected.items():
+            assert out[column][i] == pytest.approx(value, abs=0.01), (i, column)
+    # NULL этажности или года -> quality_score = 30; NULL аварийности -> 10 баллов
+    assert list(out['quality_score'][4:6]) == [30, 30]
+    assert out['quality_score'][6] == pytest.approx(10 + 10 + 10 * (30 - 9) / 25.0)
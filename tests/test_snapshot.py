@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+
+from geocoder import LocalGeocoder
+from snapshot import AMENITY_SOURCES, BUILDING_FIELDS, NULL, Snapshot, export, load_snapshot
+from spatial_index import BuildingIndex
+
+BUILT_AT = datetime(2026, 10, 1, 3, 0, tzinfo=timezone.utc)
+
+# Строки COPY в порядке BUILDING_FIELDS; NULL — как в CSV выгрузке PostgreSQL
+BUILDINGS = [
+    [1, 'Тверская ул., д. 7', '71.25', '25.00', '28.40', '17.85', 1965, 9, 'f', '5400.5', 120, 2,
+     '4100', '300', 'f', '55.7601', '37.6087', '37.6087', '55.7601'],
+    [2, 'Ленинский проспект, д. 5, к. 1', NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL,
+     NULL, NULL, 't', '55.7080', '37.5880', '37.5880', '55.7080'],
+    [3, NULL, '40.00', '10.00', '20.00', '10.00', 2020, 17, 't', '900', 40, 1,
+     '800', '0', NULL, '55.65', '37.70', '37.70', '55.65'],
+]
+AMENITIES = [
+    [0, 10, '55.761', '37.61', 'Школа № 1', NULL],
+    [6, 20, '55.708', '37.589', NULL, '120'],
+]
+
+
+class FakeCursor:
+    def __init__(self, built_at):
+        self.built_at = built_at
+
+    def execute(self, sql):
+        pass
+
+    def fetchone(self):
+        return (self.built_at,)
+
+    def copy_expert(self, sql, f):
+        rows = BUILDINGS if 'FROM building b' in sql else AMENITIES
+        csv.writer(f).writerows(rows)
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, built_at=BUILT_AT):
+        self.built_at = built_at
+
+    def cursor(self):
+        return FakeCursor(self.built_at)
+
+
+def test_export_load_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot")
+    meta = export(FakeConn(), path)
+    assert (meta['buildings'], meta['amenities']) == (3, 2)
+
+    snap = load_snapshot(path, BUILT_AT)
+    assert snap is not None
+    assert len(snap) == 3
+    first = snap[0]
+    assert first['building_id'] == 1 and first['name'] == 'Тверская ул., д. 7'
+    assert first['total_score'] == Decimal('71.25')
+    assert (first['build_year'], first['floors_number'], first['is_emergency']) == (1965, 9, False)
+    # NULL возвращаются как None, как из RealDictCursor
+    assert snap[1]['total_score'] is None and snap[1]['is_emergency'] is None
+    assert snap[1]['is_cultural_heritage'] is True
+    assert snap[2]['name'] is None
+    assert [f[0] for f in snap.fields] == [name for name, _, _ in BUILDING_FIELDS]
+
+    assert snap.amenity_kinds == [table for table, *_ in AMENITY_SOURCES]
+    assert list(snap.amenities['kind']) == [0, 6]
+    assert snap.amenities['name'][1] is None
+    assert np.isnan(snap.amenities['car_capacity'][0]) and snap.amenities['car_capacity'][1] == 120
+
+    index = BuildingIndex.from_snapshot(snap)
+    assert len(index) == 3
+
+
+def test_version_mismatch_and_format(tmp_path):
+    path = str(tmp_path / "snapshot")
+    export(FakeConn(), path)
+    # Версия из БД — datetime, в meta.json — её str(); сравниваются строки
+    assert load_snapshot(path, str(BUILT_AT)) is not None
+    assert load_snapshot(path, BUILT_AT + timedelta(seconds=1)) is None
+    assert load_snapshot(path) is not None
+    assert load_snapshot(str(tmp_path / "missing"), BUILT_AT) is None
+
+    meta_path = os.path.join(path, 'meta.json')
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['format'] = 1
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    assert load_snapshot(path, BUILT_AT) is None
+
+
+def test_reexport_replaces_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot")
+    export(FakeConn(), path)
+    later = BUILT_AT + timedelta(days=1)
+    export(FakeConn(later), path)
+    assert load_snapshot(path, later) is not None
+    assert load_snapshot(path, BUILT_AT) is None
+    assert sorted(os.listdir(tmp_path)) == ["snapshot"]
+
+
+def test_local_geocoder_from_snapshot_columns(tmp_path):
+    path = str(tmp_path / "snapshot")
+    export(FakeConn(), path)
+    snap = Snapshot(path)
+    b = snap.buildings
+    local = LocalGeocoder.from_columns(b['building_id'], b['name'], b['geom_lat'], b['geom_lon'])
+    by_rows = LocalGeocoder([snap[i] for i in range(len(snap))])
+    assert len(local) == len(by_rows) == 2
+    for addr in ("Москва, Тверская улица, 7", "Ленинский проспект, 5 к 1", "Тверская, 9"):
+        assert local.lookup(addr) == by_rows.lookup(addr)
+    assert local.lookup("Тверская, 7") == (55.7601, 37.6087, 1)
+    assert local.lookup("Ленинский проспект, 5 к 1") == (55.708, 37.588, 2)
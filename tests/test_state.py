@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import pytest
+
+import state
+from state import HISTORY_SIZE, MemoryStateStore, SQLiteStateStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(state.time, "time", c)
+    return c
+
+
+def _entry(i):
+    return (55.75, 37.61, 1000, f"Тверская, {i}", i)
+
+
+def test_memory_history_is_capped_and_newest_first():
+    store = MemoryStateStore()
+    for i in range(HISTORY_SIZE + 2):
+        asyncio.run(store.add_query(1, _entry(i)))
+    history = asyncio.run(store.get_history(1))
+    assert [e[4] for e in history] == list(range(HISTORY_SIZE + 1, 1, -1))
+    assert history[0] == _entry(HISTORY_SIZE + 1)
+
+
+def test_memory_ttl_expiry(clock):
+    store = MemoryStateStore(ttl=60)
+    asyncio.run(store.add_query(1, _entry(1)))
+    asyncio.run(store.set_compare_state(1, ("first", 3)))
+    clock.now += 59
+    assert asyncio.run(store.get_compare_state(1)) == ("first", 3)
+    clock.now += 2
+    assert asyncio.run(store.get_history(1)) == []
+    assert asyncio.run(store.get_compare_state(1)) is None
+    assert 1 not in store._data
+
+
+def test_memory_lru_evicts_least_recently_written(clock):
+    store = MemoryStateStore(max_users=2)
+    asyncio.run(store.add_query(1, _entry(1)))
+    asyncio.run(store.add_query(2, _entry(2)))
+    # Чтение порядок не меняет: вытесняется пользователь 1, хотя его только что читали
+    asyncio.run(store.get_history(1))
+    asyncio.run(store.add_query(3, _entry(3)))
+    assert list(store._data) == [2, 3]
+    # Запись переносит пользователя в конец очереди
+    asyncio.run(store.set_compare_state(2, ("first", 0)))
+    asyncio.run(store.add_query(4, _entry(4)))
+    assert list(store._data) == [2, 4]
+
+
+def test_sqlite_round_trip_survives_reopen(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    store = SQLiteStateStore(path)
+    assert store._conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    asyncio.run(store.add_query(1, _entry(1)))
+    asyncio.run(store.add_query(1, _entry(2)))
+    asyncio.run(store.set_compare_state(1, ("first", 7)))
+    store.close()
+
+    store = SQLiteStateStore(path)
+    assert asyncio.run(store.get_history(1)) == [_entry(2), _entry(1)]
+    # tuple сохраняется в JSON как list и восстанавливается обратно
+    assert asyncio.run(store.get_compare_state(1)) == ("first", 7)
+    assert asyncio.run(store.get_history(2)) == []
+    store.close()
+
+
+def test_sqlite_ttl_and_cleanup(tmp_path, clock):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"), ttl=60, max_users=2)
+    store.CLEANUP_EVERY = 4
+    for user_id in (1, 2, 3):
+        asyncio.run(store.add_query(user_id, _entry(user_id)))
+        clock.now += 1
+    clock.now += 58
+    # У пользователя 1 TTL истёк, у 2 и 3 — ещё нет
+    assert asyncio.run(store.get_history(1)) == []
+    assert asyncio.run(store.get_history(2)) == [_entry(2)]
+    # Четвёртая запись запускает чистку: устаревшие и сверх max_users удаляются
+    asyncio.run(store.add_query(4, _entry(4)))
+    users = [r[0] for r in store._conn.execute("SELECT user_id FROM user_state ORDER BY user_id;")]
+    assert users == [3, 4]
+    store.close()
+
+
+def test_sqlite_failed_change_is_rolled_back(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"))
+    asyncio.run(store.add_query(1, _entry(1)))
+
+    def broken(record):
+        record["h"] = []
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        store._update(1, broken)
+    assert asyncio.run(store.get_history(1)) == [_entry(1)]
+    assert not store._conn.in_transaction
+    store.close()
+
+
+def test_sqlite_concurrent_writers_do_not_lose_updates(tmp_path):
+    # Две реплики бота на одном файле: BEGIN IMMEDIATE сериализует чтение-изменение-запись
+    path = str(tmp_path / "state.sqlite3")
+    stores = [SQLiteStateStore(path), SQLiteStateStore(path)]
+
+    def writer(store, offset):
+        for i in range(20):
+            store._update(1, lambda record, i=i: record.setdefault("n", []).append(offset + i))
+
+    threads = [threading.Thread(target=writer, args=(s, k * 100)) for k, s in enumerate(stores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stores[0]._read(1)["n"]) == 40
+    for s in stores:
+        s.close()
@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from throttle import SingleFlight, ThrottleMiddleware, TokenBucket
+
+
+def test_token_bucket_spends_and_refills():
+    bucket = TokenBucket(rate=2.0, burst=4, now=0.0)
+    assert bucket.take(3, 0.0)
+    assert not bucket.take(3, 0.0)
+    assert bucket.retry_after(3) == pytest.approx(1.0)
+    assert bucket.take(3, 1.0)
+    # Пополнение не превышает ёмкость корзины
+    bucket.take(0, 100.0)
+    assert bucket.tokens == 4
+    assert bucket.retry_after(10) == 0.0
+
+
+def _data(user_id):
+    return {"event_from_user": SimpleNamespace(id=user_id)}
+
+
+def test_middleware_drops_duplicate_while_first_is_running():
+    async def scenario():
+        middleware = ThrottleMiddleware(lambda event, data: (False, "top"), rate=0.001, burst=10)
+        release = asyncio.Event()
+        calls = []
+
+        async def handler(event, data):
+            calls.append(data["event_from_user"].id)
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(middleware(handler, object(), _data(1)))
+        await asyncio.sleep(0)
+        # Повтор того же пользователя отбрасывается, у другого пользователя — проходит
+        assert await middleware(handler, object(), _data(1)) is None
+        other = asyncio.create_task(middleware(handler, object(), _data(2)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await first == "done"
+        assert await other == "done"
+        # После завершения первого запроса такой же снова выполняется
+        assert await middleware(handler, object(), _data(1)) == "done"
+        assert calls == [1, 2, 1]
+        assert middleware.stats["duplicates"] == 1
+        assert not middleware._inflight
+
+    asyncio.run(scenario())
+
+
+def test_middleware_limits_heavy_requests_by_tokens():
+    async def scenario():
+        middleware = ThrottleMiddleware(lambda event, data: (True, None), rate=0.001, burst=7, heavy_cost=3)
+
+        async def handler(event, data):
+            return "done"
+
+        results = [await middleware(handler, object(), _data(1)) for _ in range(3)]
+        assert results == ["done", "done", None]
+        assert middleware.stats == {"passed": 2, "limited": 1, "duplicates": 0, "heavy": 2}
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def compute(x):
+            calls.append(x)
+            await release.wait()
+            return x * 2
+
+        waiters = [asyncio.create_task(flight.run("k", compute, 21)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*waiters) == [42, 42, 42]
+        assert calls == [21]
+        assert flight.stats == {"calls": 1, "coalesced": 2}
+        assert not flight._inflight
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_leader_cancellation_does_not_fail_waiters():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "result"
+
+        leader = asyncio.create_task(flight.run("k", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.run("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == "result"
+        assert leader.cancelled()
+        assert flight.stats == {"calls": 1, "coalesced": 1}
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_error_reaches_all_waiters():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.run("k", fail), flight.run("k", fail), return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        assert not flight._inflight
+
+    asyncio.run(scenario())
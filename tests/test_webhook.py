@@ -0,0 +1,70 @@
+import asyncio
+import queue
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import PendingUpdates, UserQueue, make_app
+
+
+def test_user_queue_keeps_per_user_order_and_drops_overflow():
+    async def scenario():
+        release = asyncio.Event()
+        handled, done = [], []
+
+        async def handle(update):
+            await release.wait()
+            handled.append(update)
+
+        users = UserQueue(handle, max_per_user=2, on_done=done.append)
+        # Первое обновление пользователя 1 сразу уходит в обработку, в очереди остаются два
+        results = [await users.put(1, ("u1", 0))]
+        await asyncio.sleep(0)
+        results += [await users.put(1, ("u1", i)) for i in range(1, 4)]
+        results.append(await users.put(2, ("u2", 0)))
+        assert results == [True, True, True, False, True]
+        assert users.stats["dropped"] == 1
+        release.set()
+        await users.join()
+        assert [u for u in handled if u[0] == "u1"] == [("u1", 0), ("u1", 1), ("u1", 2)]
+        assert ("u2", 0) in handled
+        # Об отброшенном обновлении тоже сообщается — счётчик главного процесса сходится
+        assert sorted(done) == [1, 1, 1, 1, 2]
+        assert users.active_users == 0
+
+    asyncio.run(scenario())
+
+
+def _update(update_id, user_id):
+    return {"update_id": update_id, "message": {"message_id": update_id, "from": {"id": user_id}}}
+
+
+def test_webhook_answers_503_when_user_has_too_many_pending_updates():
+    async def scenario():
+        queues = [queue.Queue(10), queue.Queue(10)]
+        pending = PendingUpdates(max_per_user=2)
+        app = make_app(queues, "/hook", pending=pending)
+        async with TestClient(TestServer(app)) as client:
+            statuses = [(await client.post("/hook", json=_update(i, 7))).status for i in range(3)]
+            assert statuses == [200, 200, 503]
+            # Другой пользователь не затронут
+            assert (await client.post("/hook", json=_update(10, 8))).status == 200
+            # Рабочий процесс обработал одно обновление — повтор от Telegram принимается
+            pending.done(7)
+            assert (await client.post("/hook", json=_update(2, 7))).status == 200
+        assert app["webhook_stats"] == {"received": 4, "rejected": 0, "user_limited": 1}
+        assert [queues[1].get_nowait()[1]["update_id"] for _ in range(3)] == [0, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_webhook_full_worker_queue_does_not_leak_pending_slot():
+    async def scenario():
+        queues = [queue.Queue(1)]
+        pending = PendingUpdates(max_per_user=5)
+        app = make_app(queues, "/hook", pending=pending)
+        async with TestClient(TestServer(app)) as client:
+            assert (await client.post("/hook", json=_update(1, 7))).status == 200
+            assert (await client.post("/hook", json=_update(2, 7))).status == 503
+        assert pending._count == {7: 1}
+
+    asyncio.run(scenario())
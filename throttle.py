@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from db import PRIORITY_HIGH, PRIORITY_LOW, priority
+
+# Защита от перегрузки одним пользователем.
+# ThrottleMiddleware вешается на router.message / router.callback_query:
+#   - у каждого пользователя корзина токенов (TokenBucket): дешёвый запрос
+#     стоит 1 токен, тяжёлый (сравнение, графики, файлы) — HEAVY_COST; когда
+#     токенов нет, обновление отбрасывается, а пользователь не чаще раза в
+#     NOTICE_INTERVAL получает сообщение с временем ожидания;
+#   - повтор того же запроса, пока первый ещё обрабатывается (двойное нажатие
+#     кнопки, повтор координат), отбрасывается;
+#   - тяжёлые хендлеры выполняются с низким приоритетом: их запросы к БД ждут,
+#     пока обслужатся дешёвые ответы (см. PriorityGate в db.py).
+# Что считать тяжёлым и что — одинаковым запросом, решает classify из main.py.
+# SingleFlight склеивает одинаковые запросы разных пользователей: Топ-10,
+# распределение, дом по тем же координатам считаются один раз на всех.
+
+RATE_PER_SEC = 1.0        # пополнение корзины, токенов в секунду
+BURST = 10                # ёмкость корзины
+HEAVY_COST = 3
+NOTICE_INTERVAL = 10      # сек между сообщениями об ограничении одному пользователю
+IDLE_TTL = 600            # корзины неактивных дольше, сек, удаляются
+
+
+class TokenBucket:
+    def __init__(self, rate: float = RATE_PER_SEC, burst: float = BURST, now: float = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> bool:
+        self._refill(now)
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    # Через сколько секунд хватит токенов на cost
+    def retry_after(self, cost: float) -> float:
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    # classify(event, data) -> (тяжёлый ли запрос, ключ для склейки повторов или None)
+    def __init__(self, classify, rate: float = RATE_PER_SEC, burst: float = BURST,
+                 heavy_cost: float = HEAVY_COST):
+        self.classify = classify
+        self.rate = rate
+        self.burst = burst
+        self.heavy_cost = heavy_cost
+        self._buckets = {}        # user_id -> TokenBucket
+        self._notified = {}       # user_id -> когда последний раз сообщили об ограничении
+        self._inflight = set()    # (user_id, ключ)
+        self._pruned = time.monotonic()
+        self.stats = {"passed": 0, "limited": 0, "duplicates": 0, "heavy": 0}
+
+    def _prune(self, now: float):
+        if now - self._pruned < IDLE_TTL:
+            return
+        self._pruned = now
+        for user_id in [u for u, b in self._buckets.items() if now - b.updated > IDLE_TTL]:
+            del self._buckets[user_id]
+            self._notified.pop(user_id, None)
+
+    async def _notify(self, event, user_id: int, wait: float, now: float):
+        if now - self._notified.get(user_id, -NOTICE_INTERVAL) < NOTICE_INTERVAL:
+            return
+        self._notified[user_id] = now
+        text = f"Слишком много запросов. Попробуйте через {max(1, round(wait))} с."
+        if isinstance(event, (Message, CallbackQuery)):
+            await event.answer(text)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        heavy, key = self.classify(event, data)
+        cost = self.heavy_cost if heavy else 1
+        now = time.monotonic()
+        self._prune(now)
+
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            bucket = self._buckets[user.id] = TokenBucket(self.rate, self.burst, now)
+        if not bucket.take(cost, now):
+            self.stats["limited"] += 1
+            await self._notify(event, user.id, bucket.retry_after(cost), now)
+            return None
+
+        flight = (user.id, key) if key is not None else None
+        if flight is not None:
+            if flight in self._inflight:
+                self.stats["duplicates"] += 1
+                return None
+            self._inflight.add(flight)
+
+        self.stats["passed"] += 1
+        if heavy:
+            self.stats["heavy"] += 1
+        token = priority.set(PRIORITY_LOW if heavy else PRIORITY_HIGH)
+        try:
+            return await handler(event, data)
+        finally:
+            priority.reset(token)
+            if flight is not None:
+                self._inflight.discard(flight)
+
+
+class SingleFlight:
+    # Одинаковые запросы, пришедшие, пока первый ещё выполняется, получают его результат
+    def __init__(self):
+        self._inflight = {}       # key -> asyncio.Task
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def run(self, key, func, *args):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["calls"] += 1
+            # Запрос выполняется отдельной задачей: отмена того, кто его начал
+            # (пользователь ушёл, таймаут хендлера), не отменяет его для остальных
+            task = asyncio.ensure_future(func(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ожидающих может не быть — не ругаться в лог
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+# Режим webhook: приём обновлений Telegram по HTTP и раздача их рабочим процессам.
+# Главный процесс только принимает POST от Telegram и по user_id выбирает рабочий
+# процесс (один пользователь — всегда один и тот же процесс), обновление уходит
+# ему через очередь. В рабочем процессе обновления одного пользователя
+# обрабатываются строго по порядку (UserQueue), разных пользователей — параллельно,
+# поэтому шаги сравнения домов не перемешиваются.
+# Очереди ограничены: если рабочий процесс не успевает или у пользователя уже
+# USER_QUEUE_SIZE необработанных обновлений, webhook отвечает 503 и Telegram
+# повторит доставку позже. Для этого рабочие процессы сообщают главному через
+# общую очередь, чьё обновление обработано (PendingUpdates).
+
+WEBHOOK_WORKERS = max(1, min(4, os.cpu_count() or 1))
+WORKER_QUEUE_SIZE = 1000      # обновлений в очереди к рабочему процессу
+WORKER_MAX_PENDING = 256      # обновлений в обработке в одном рабочем процессе
+USER_QUEUE_SIZE = 8           # необработанных обновлений на пользователя
+SHUTDOWN_TIMEOUT = 30         # сколько ждать дообработки при остановке, сек
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Номер рабочего процесса (0..workers-1); None — не в рабочем процессе
+worker_index = None
+# Очередь к главному процессу: user_id обработанных обновлений
+_done_queue = None
+
+
+# Кому принадлежит обновление: отправитель, иначе чат; 0 — не удалось определить
+def update_user_id(update: dict) -> int:
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            who = value.get(field)
+            if isinstance(who, dict) and 'id' in who:
+                return who['id']
+    return 0
+
+
+class UserQueue:
+    # Очередь обновлений по пользователям: на каждого активного пользователя одна
+    # задача, которая обрабатывает его обновления по одному. Всего в обработке
+    # не больше max_pending обновлений — put() ждёт, пока освободится место.
+    def __init__(self, handle, max_per_user: int = USER_QUEUE_SIZE,
+                 max_pending: int = WORKER_MAX_PENDING, on_done=None):
+        self.handle = handle          # async handle(update)
+        self.max_per_user = max_per_user
+        self.on_done = on_done        # on_done(user_id) — обновление обработано или отброшено
+        self._sem = asyncio.Semaphore(max_pending)
+        self._queues = {}             # user_id -> deque обновлений
+        self._tasks = {}              # user_id -> задача обработки
+        self.stats = {"accepted": 0, "dropped": 0, "processed": 0, "errors": 0}
+
+    async def put(self, user_id: int, update) -> bool:
+        await self._sem.acquire()
+        q = self._queues.get(user_id)
+        if q is None:
+            q = self._queues[user_id] = deque()
+        elif len(q) >= self.max_per_user:
+            # Пользователь шлёт быстрее, чем мы отвечаем — лишнее отбрасываем.
+            # В webhook-режиме сюда не доходит: лишнее отклоняет главный процесс
+            self._sem.release()
+            self.stats["dropped"] += 1
+            self._done(user_id)
+            return False
+        q.append(update)
+        self.stats["accepted"] += 1
+        if user_id not in self._tasks:
+            self._tasks[user_id] = asyncio.create_task(self._drain(user_id, q))
+        return True
+
+    async def _drain(self, user_id: int, q):
+        try:
+            while q:
+                update = q.popleft()
+                try:
+                    await self.handle(update)
+                except Exception:
+                    self.stats["errors"] += 1
+                    logging.exception("Ошибка обработки обновления пользователя %s", user_id)
+                finally:
+                    self.stats["processed"] += 1
+                    self._sem.release()
+                    self._done(user_id)
+        finally:
+            del self._queues[user_id]
+            del self._tasks[user_id]
+
+    def _done(self, user_id: int):
+        if self.on_done is not None:
+            self.on_done(user_id)
+
+    @property
+    def active_users(self) -> int:
+        return len(self._tasks)
+
+    # Дождаться обработки всего, что уже принято
+    async def join(self, timeout: float = None):
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+# Цикл рабочего процесса: обновления из очереди главного процесса -> UserQueue.
+# None в очереди — сигнал остановки: новые обновления больше не придут,
+# принятые дообрабатываются.
+async def consume(updates, handle, timeout: float = SHUTDOWN_TIMEOUT):
+    done = _done_queue
+    users = UserQueue(handle, on_done=done.put_nowait if done is not None else None)
+    loop = asyncio.get_running_loop()
+    # Отдельный поток под блокирующий get(), чтобы не занимать потоки db_call
+    reader = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            item = await loop.run_in_executor(reader, updates.get)
+            if item is None:
+                break
+            user_id, update = item
+            await users.put(user_id, update)
+        await users.join(timeout)
+    finally:
+        reader.shutdown(wait=False)
+    return users.stats
+
+
+def _worker_entry(worker_main, updates, done, args, index):
+    global worker_index, _done_queue
+    worker_index = index
+    _done_queue = done
+    # Останавливает рабочие процессы главный процесс (через очередь), а не сигнал
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker_main(updates, *args))
+
+
+class PendingUpdates:
+    # Сколько обновлений каждого пользователя принято, но ещё не обработано
+    # рабочими процессами. Живёт в главном процессе.
+    def __init__(self, max_per_user: int = USER_QUEUE_SIZE):
+        self.max_per_user = max_per_user
+        self._count = {}              # user_id -> обновлений в работе
+
+    def try_add(self, user_id: int) -> bool:
+        n = self._count.get(user_id, 0)
+        if n >= self.max_per_user:
+            return False
+        self._count[user_id] = n + 1
+        return True
+
+    def done(self, user_id: int):
+        n = self._count.get(user_id, 0) - 1
+        if n > 0:
+            self._count[user_id] = n
+        else:
+            self._count.pop(user_id, None)
+
+    # Разбор отчётов рабочих процессов; None в очереди — остановка
+    async def follow(self, done):
+        loop = asyncio.get_running_loop()
+        reader = ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                user_id = await loop.run_in_executor(reader, done.get)
+                if user_id is None:
+                    break
+                self.done(user_id)
+        finally:
+            reader.shutdown(wait=False)
+
+
+def make_app(queues, path: str, secret_token: str = None, pending: PendingUpdates = None):
+    stats = {"received": 0, "rejected": 0, "user_limited": 0}
+
+    async def handle(request: web.Request):
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        user_id = update_user_id(update)
+        if pending is not None and not pending.try_add(user_id):
+            # Рабочий процесс ещё не разобрал прежние обновления пользователя
+            stats["user_limited"] += 1
+            return web.Response(status=503)
+        try:
+            queues[user_id % len(queues)].put_nowait((user_id, update))
+        except queue.Full:
+            if pending is not None:
+                pending.done(user_id)
+            stats["rejected"] += 1
+            return web.Response(status=503)
+        stats["received"] += 1
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    app['webhook_stats'] = stats
+    return app
+
+
+async def run_webhook(worker_main, path: str, host: str, port: int,
+                      workers: int = WEBHOOK_WORKERS, secret_token: str = None,
+                      worker_args=(), stop: asyncio.Event = None):
+    # worker_main(updates, *worker_args) — корутина рабочего процесса, должна
+    # вызывать consume(). Процессы запускаются через spawn: каждый заново
+    # импортирует модуль и создаёт свои пулы (БД, графики, SQLite).
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+    done = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker_entry, args=(worker_main, q, done, tuple(worker_args), i),
+                    name=f"bot-worker-{i}")
+        for i, q in enumerate(queues)
+    ]
+    for p in procs:
+        p.start()
+
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+    pending = PendingUpdates()
+    runner = web.AppRunner(make_app(queues, path, secret_token, pending))
+    await runner.setup()
+    follower = asyncio.create_task(pending.follow(done))
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logging.info("Webhook слушает %s:%s%s, рабочих процессов: %d", host, port, path, workers)
+        await stop.wait()
+    finally:
+        # Сначала перестаём принимать обновления, затем даём процессам дообработать
+        await runner.cleanup()
+        await asyncio.to_thread(_stop_workers, queues, procs, SHUTDOWN_TIMEOUT + 5)
+        done.put(None)
+        await follower
+
+
+def _stop_workers(queues, procs, timeout: float):
+    for q in queues:
+        q.put(None)
+    for p in procs:
+        p.join(timeout)
+        if p.is_alive():
+            logging.warning("Рабочий процесс %s не завершился, останавливаем", p.name)
+            p.terminate()
+            p.join()